@@ -0,0 +1,133 @@
+import bisect
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.db import transaction
+
+from cryptotracker.models import Cryptocurrency, Price, Snapshot
+from cryptotracker.utils import fetch_price_range
+from cryptotracker.valuation import rematerialize_portfolio_values
+
+# Longest range requested at once, the public API limits the history to a year
+MAX_RANGE_DAYS = 365
+
+# Maximum distance between a snapshot and the price point assigned to it
+MAX_PRICE_DISTANCE = timedelta(days=1)
+
+
+def split_range(
+    start: datetime, end: datetime, max_days: int = MAX_RANGE_DAYS
+) -> List[Tuple[datetime, datetime]]:
+    """
+    Splits a date range in consecutive windows of at most max_days.
+    """
+    windows = []
+    while start < end:
+        window_end = min(start + timedelta(days=max_days), end)
+        windows.append((start, window_end))
+        start = window_end
+    return windows
+
+
+def nearest_price(
+    points: Sequence[Tuple[datetime, Decimal]], date: datetime
+) -> Optional[Decimal]:
+    """
+    Returns the price of the point closest to the date, or None if no point is
+    within MAX_PRICE_DISTANCE.
+    Args:
+        points (list): (timestamp, price) tuples sorted by timestamp.
+        date (datetime): The date to price.
+    """
+    index = bisect.bisect_left(points, (date,))
+    candidates = points[max(index - 1, 0) : index + 1]
+    if not candidates:
+        return None
+    timestamp, price = min(candidates, key=lambda point: abs(point[0] - date))
+    if abs(timestamp - date) > MAX_PRICE_DISTANCE:
+        return None
+    return price
+
+
+def backfill_prices(
+    crypto_ids: Optional[List[str]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> int:
+    """
+    Fills the Price rows missing from the snapshots with the price history of
+    each cryptocurrency, fetched with one range request per year of history
+    instead of one request per snapshot. The stored values of the snapshots
+    that got a price are valued again.
+    Args:
+        crypto_ids (list, optional): The cryptocurrencies to backfill, all if not provided.
+        start (datetime, optional): Only backfill the snapshots taken after this date.
+        end (datetime, optional): Only backfill the snapshots taken before this date.
+    Returns:
+        int: The number of Price rows created.
+    """
+    snapshots = Snapshot.objects.order_by("date")
+    if start:
+        snapshots = snapshots.filter(date__gte=start)
+    if end:
+        snapshots = snapshots.filter(date__lte=end)
+    cryptocurrencies = Cryptocurrency.objects.all()
+    if crypto_ids:
+        cryptocurrencies = cryptocurrencies.filter(name__in=crypto_ids)
+
+    stored: Dict[int, set] = defaultdict(set)
+    for crypto_id, snapshot_id in Price.objects.filter(
+        snapshot__in=snapshots, cryptocurrency__in=cryptocurrencies
+    ).values_list("cryptocurrency_id", "snapshot_id"):
+        stored[crypto_id].add(snapshot_id)
+
+    snapshots_list = list(snapshots)
+    prices = []
+    requests = 0
+    for cryptocurrency in cryptocurrencies:
+        missing = [
+            snapshot
+            for snapshot in snapshots_list
+            if snapshot.id not in stored[cryptocurrency.id]
+        ]
+        if not missing:
+            continue
+
+        points: List[Tuple[datetime, Decimal]] = []
+        for window_start, window_end in split_range(
+            missing[0].date - MAX_PRICE_DISTANCE, missing[-1].date + MAX_PRICE_DISTANCE
+        ):
+            requests += 1
+            window_points = fetch_price_range(
+                cryptocurrency.name, window_start, window_end
+            )
+            if window_points is None:
+                logging.error(
+                    f"Failed to fetch the prices of {cryptocurrency.name} "
+                    f"from {window_start} to {window_end}"
+                )
+                continue
+            points.extend(window_points)
+        points.sort()
+
+        for snapshot in missing:
+            price = nearest_price(points, snapshot.date)
+            if price is None:
+                logging.warning(
+                    f"No price of {cryptocurrency.name} near snapshot {snapshot}"
+                )
+                continue
+            prices.append(
+                Price(cryptocurrency=cryptocurrency, price=price, snapshot=snapshot)
+            )
+
+    with transaction.atomic():
+        Price.objects.bulk_create(prices, batch_size=500, ignore_conflicts=True)
+    logging.info(f"Backfilled {len(prices)} prices with {requests} API requests")
+    rematerialize_portfolio_values(
+        {price.snapshot.id: price.snapshot for price in prices}.values()
+    )
+    return len(prices)
@@ -0,0 +1,125 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+
+# Prefix of the keys stored in the Redis tier
+REDIS_KEY_PREFIX = "cryptotracker:response:"
+
+
+class ResponseCache:
+    """
+    Cache of chain and subgraph responses read at a pinned block.
+    Responses at a fixed block never change, so identical reads made for
+    different addresses of a snapshot run are executed once.
+    Entries live in an in-process LRU and, when a Redis URL is configured,
+    in a Redis tier shared by the processes of the run.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        redis_url: Optional[str] = None,
+        ttl: int = 86400,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits: Dict[str, int] = defaultdict(int)
+        self.misses: Dict[str, int] = defaultdict(int)
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis: Any = None
+        if redis_url:
+            import redis
+
+            self._redis = redis.Redis.from_url(redis_url)
+
+    @staticmethod
+    def make_key(chain: str, block: int, call: bytes) -> str:
+        """
+        Returns the cache key of a call made on a chain at a block.
+        """
+        return f"{chain}:{block}:{hashlib.sha256(call).hexdigest()}"
+
+    def get(self, key: str, signature: str) -> Optional[bytes]:
+        """
+        Returns the cached response of a key, counting a hit or a miss for the
+        call signature.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        if value is None and self._redis is not None:
+            try:
+                value = self._redis.get(REDIS_KEY_PREFIX + key)
+            except Exception as e:
+                logging.warning(f"Response cache Redis tier unavailable: {e}")
+                self._redis = None
+            if value is not None:
+                self._store(key, value)
+        with self._lock:
+            if value is None:
+                self.misses[signature] += 1
+            else:
+                self.hits[signature] += 1
+        return value
+
+    def set(self, key: str, value: bytes) -> None:
+        """
+        Stores a response in every tier of the cache.
+        """
+        self._store(key, value)
+        if self._redis is not None:
+            try:
+                self._redis.set(REDIS_KEY_PREFIX + key, value, ex=self.ttl)
+            except Exception as e:
+                logging.warning(f"Response cache Redis tier unavailable: {e}")
+                self._redis = None
+
+    def _store(self, key: str, value: bytes) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits.clear()
+            self.misses.clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns the hit and miss counts of each call signature.
+        """
+        return {
+            signature: {
+                "hits": self.hits.get(signature, 0),
+                "misses": self.misses.get(signature, 0),
+            }
+            for signature in sorted(set(self.hits) | set(self.misses))
+        }
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    Returns the response cache of this process, configured from the settings.
+    """
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(
+                max_entries=settings.RESPONSE_CACHE_SIZE,
+                redis_url=settings.RESPONSE_CACHE_REDIS_URL,
+                ttl=settings.RESPONSE_CACHE_TTL,
+            )
+        return _response_cache
@@ -0,0 +1,63 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable
+
+from django.db import connections
+
+
+def _run_on_network(fn: Callable[..., Any], network_choice: str, args: tuple) -> Any:
+    try:
+        return fn(network_choice, *args)
+    finally:
+        # Close the DB connections the worker thread may have opened
+        connections.close_all()
+
+
+class ChainPool:
+    """
+    Runs chain reads concurrently with one worker thread per network.
+    The reads are JSON-RPC requests sent through the shared client of each
+    network, which spend their time waiting on the endpoint, so threads run the
+    networks in parallel without starting processes. This also works inside
+    the daemonic processes of a Celery prefork worker.
+    Submitted functions receive the network choice as first argument.
+    """
+
+    def __init__(self, network_choices: Iterable[str]):
+        self._executors: Dict[str, ThreadPoolExecutor] = {
+            network_choice: ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f"chain-{network_choice}"
+            )
+            for network_choice in set(network_choices)
+        }
+
+    def submit(self, network_choice: str, fn: Callable[..., Any], *args: Any) -> Future:
+        """
+        Schedules fn(network_choice, *args) on the worker thread of network_choice.
+        """
+        return self._executors[network_choice].submit(
+            _run_on_network, fn, network_choice, args
+        )
+
+    def shutdown(self) -> None:
+        for executor in self._executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self) -> "ChainPool":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.shutdown()
+
+
+class LocalChainRunner:
+    """
+    Sequential, in-process counterpart of ChainPool. Used when a single address is fetched.
+    """
+
+    def submit(self, network_choice: str, fn: Callable[..., Any], *args: Any) -> Future:
+        future: Future = Future()
+        try:
+            future.set_result(fn(network_choice, *args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
@@ -10,6 +10,10 @@ ERROR_TYPES = {
 
 ETHEREUM_RPC = "ethereum:mainnet:alchemy"
 
+# Multicall3 is deployed at the same address on every supported network
+# https://github.com/mds1/multicall
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+
 WALLET_TYPES = {
     "HOT": "HOT",
     "COLD": "COLD",
@@ -154,6 +158,16 @@ PROTOCOLS_DATA: Dict[str, Any] = {
     },
 }
 
+# Parts of a snapshot that can be refreshed on their own, with the source of
+# the snapshot they belong to and, for the protocols, their PROTOCOLS_DATA keys
+REFRESH_SOURCES: Dict[str, Any] = {
+    "tokens": {"source": "assets"},
+    "staking": {"source": "staking"},
+    "aave": {"source": "protocols", "protocols": ["AAVE_V3"]},
+    "liquity": {"source": "protocols", "protocols": ["LQTY_V1", "LQTY_V2"]},
+    "uniswap": {"source": "protocols", "protocols": ["UNI_V3"]},
+}
+
 TOKENS: Dict[str, Any] = {
     "ETH": {
         "name": "ethereum",
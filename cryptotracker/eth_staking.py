@@ -2,12 +2,34 @@ from datetime import datetime
 from decimal import Decimal
 from typing import Dict, List, Optional, Union
 
-from cryptotracker.models import Snapshot, UserAddress, Validator, ValidatorSnapshot
-from cryptotracker.utils import APIquery, get_last_price
+from cryptotracker.models import Snapshot, UserAddress, ValidatorSnapshot
+from cryptotracker.utils import APIquery, PriceBook
+from cryptotracker.writer import SnapshotWriter, snapshot_writer
 
 BEACONCHAN_API = "https://beaconcha.in/api/v1/validator"
 
 
+class BeaconchainError(Exception):
+    """Raised when a Beaconcha API request fails"""
+
+
+def query_beaconchain(url: str, params: Dict) -> Dict:
+    """
+    Sends a request to the Beaconcha API.
+    Args:
+        url (str): The URL to query.
+        params (dict): The query parameters.
+    Returns:
+        dict: The JSON response from the API.
+    Raises:
+        BeaconchainError: If the request fails.
+    """
+    data = APIquery(url, params)
+    if data is None:
+        raise BeaconchainError(f"Beaconcha API request {url} failed")
+    return data
+
+
 class ValidatorDetails:
     """
     A class to represent validator details.
@@ -56,12 +78,16 @@ def get_last_validators(
 
 
 def get_aggregated_staking(
-    user_addresses: List[UserAddress], snapshot: Optional[Snapshot] = None
+    user_addresses: List[UserAddress],
+    snapshot: Optional[Snapshot] = None,
+    prices: Optional[PriceBook] = None,
 ) -> Optional[Dict[str, Union[int, Decimal]]]:
     """
     Get the aggregated staking information for a list of user_addresses.
     Args:
         user_addresses (list): A list of UserAddress objects.
+        snapshot (Snapshot, optional): The snapshot to read, the last one if not provided.
+        prices (PriceBook, optional): The prices shared by the caller.
     Returns:
         dict: A dictionary containing the aggregated staking information or None if no validators exist.
     """
@@ -80,7 +106,8 @@ def get_aggregated_staking(
     for validator in last_validators:
         balance += validator.balance
         rewards += validator.rewards
-    current_price = get_last_price("ethereum", last_validators[0].snapshot.date)
+    prices = prices or PriceBook(snapshot)
+    current_price = prices.get("ethereum", last_validators[0].snapshot.date)
     balance_eur = balance * current_price
     total_eth_staking = {
         "num_validators": num_validators,
@@ -91,12 +118,18 @@ def get_aggregated_staking(
     return total_eth_staking
 
 
-def fetch_staking_assets(user_address: UserAddress, snapshot: Snapshot) -> None:
+def fetch_staking_assets(
+    user_address: UserAddress,
+    snapshot: Snapshot,
+    writer: Optional[SnapshotWriter] = None,
+) -> None:
     """
     Fetch the staking assets of a user from the Ethereum blockchain and store them in the database.
     Args:
         user_address (UserAddress): The UserAddress object.
         snapshot (Snapshot): The Snapshot object.
+        writer (SnapshotWriter, optional): The writer buffering the snapshot rows,
+            a new one is flushed at the end if not provided.
     """
     validators = get_validators_from_withdrawal(user_address.public_address)
 
@@ -106,25 +139,18 @@ def fetch_staking_assets(user_address: UserAddress, snapshot: Snapshot) -> None:
     validator_details = get_validators_info(validators)
     rewards = get_rewards(validators)
 
-    for validator in validator_details:
-        # Create or get the Validator object
-        validator_obj, _ = Validator.objects.get_or_create(
-            user_address=user_address,
-            validator_index=validator.index,
-            defaults={
-                "public_key": validator.public_key,
-                "activation_date": validator.activation_date,
-            },
-        )
-
-        # Save the validator snapshot
-        ValidatorSnapshot.objects.create(
-            validator=validator_obj,
-            balance=validator.balance,
-            status=validator.status,
-            rewards=rewards[str(validator.index)]["performance"],
-            snapshot=snapshot,
-        )
+    with snapshot_writer(snapshot, writer) as writer:
+        for validator in validator_details:
+            # Buffer the Validator (created if missing) and its snapshot
+            writer.add_validator(
+                user_address=user_address,
+                validator_index=validator.index,
+                public_key=validator.public_key,
+                activation_date=validator.activation_date,
+                balance=validator.balance,
+                status=validator.status,
+                rewards=rewards[str(validator.index)]["performance"],
+            )
 
 
 def get_validators_from_withdrawal(user_address: str) -> List[int]:
@@ -140,9 +166,7 @@ def get_validators_from_withdrawal(user_address: str) -> List[int]:
 
     url = f"{BEACONCHAN_API}/withdrawalCredentials/{user_address}"
     # Fetch validator data from the API
-    data = APIquery(url, params=params)
-    if data is None:
-        return []
+    data = query_beaconchain(url, params=params)
 
     for validator in data["data"]:
         validator_index = validator["validatorindex"]
@@ -164,9 +188,7 @@ def get_validators_info(validator_indexes: List[int]) -> List[ValidatorDetails]:
     url = f"{BEACONCHAN_API}/{validator_indexes_str}"
     params: dict = {}
 
-    data = APIquery(url, params)
-    if data is None:
-        return []
+    data = query_beaconchain(url, params)
 
     if isinstance(data["data"], dict):
         data["data"] = [data["data"]]
@@ -204,28 +226,24 @@ def get_rewards(validator_indexes: List[int]) -> Dict[str, Dict[str, float]]:
     # Fetch rewards data from the API
     # Get the current execution reward performance
     url = f"{BEACONCHAN_API}/{validator_indexes_str}/execution/performance"
-    data = APIquery(url, {})
-    if data is not None:
-        for validator in data["data"]:
-            index = str(validator["validatorindex"])
-            # Initialize the rewards dictionary for the validator
-            if index not in rewards:
-                rewards[index] = {}
-            rewards[index]["executionperformance"] = (
-                validator["performanceTotal"] / 1e18
-            )
+    data = query_beaconchain(url, {})
+    for validator in data["data"]:
+        index = str(validator["validatorindex"])
+        # Initialize the rewards dictionary for the validator
+        if index not in rewards:
+            rewards[index] = {}
+        rewards[index]["executionperformance"] = validator["performanceTotal"] / 1e18
 
     # Get the current consensus reward performance
     url = f"{BEACONCHAN_API}/{validator_indexes_str}/performance"
-    data = APIquery(url, {})
-    if data is not None:
-        for validator in data["data"]:
-            index = str(validator["validatorindex"])
-            rewards[index]["consensusperformance"] = validator["performancetotal"] / 1e9
-            rewards[index]["performance"] = (
-                rewards[index]["executionperformance"]
-                + rewards[index]["consensusperformance"]
-            )
+    data = query_beaconchain(url, {})
+    for validator in data["data"]:
+        index = str(validator["validatorindex"])
+        rewards[index]["consensusperformance"] = validator["performancetotal"] / 1e9
+        rewards[index]["performance"] = (
+            rewards[index]["executionperformance"]
+            + rewards[index]["consensusperformance"]
+        )
     return rewards
 
 
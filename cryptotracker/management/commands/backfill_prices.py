@@ -0,0 +1,46 @@
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand
+
+from cryptotracker.backfill import backfill_prices
+from cryptotracker.tasks import backfill_prices_range
+
+
+def parse_date(value: str) -> datetime:
+    return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+
+class Command(BaseCommand):
+    help = "Fill the prices missing from the snapshots with the Coingecko price history"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--coins",
+            nargs="+",
+            help="Coingecko IDs of the cryptocurrencies to backfill (default: all)",
+        )
+        parser.add_argument(
+            "--start", type=parse_date, help="First snapshot date (YYYY-MM-DD)"
+        )
+        parser.add_argument(
+            "--end", type=parse_date, help="Last snapshot date (YYYY-MM-DD)"
+        )
+        parser.add_argument(
+            "--async",
+            action="store_true",
+            dest="run_async",
+            help="Run the backfill in a Celery worker",
+        )
+
+    def handle(self, *args, **options):
+        if options["run_async"]:
+            result = backfill_prices_range.delay(
+                options["coins"],
+                options["start"].isoformat() if options["start"] else None,
+                options["end"].isoformat() if options["end"] else None,
+            )
+            self.stdout.write(self.style.SUCCESS(f"Backfill task {result.id} queued."))
+            return
+
+        created = backfill_prices(options["coins"], options["start"], options["end"])
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {created} prices."))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from cryptotracker.models import Snapshot, UserAddress
+from cryptotracker.utils import PriceBook
+from cryptotracker.valuation import materialize_portfolio_values
+
+
+class Command(BaseCommand):
+    help = "Store the portfolio values of the snapshots taken before they were materialized"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "snapshot_ids",
+            nargs="*",
+            type=int,
+            help="IDs of the snapshots to value again (default: those without stored values)",
+        )
+
+    def handle(self, *args, **options):
+        snapshots = Snapshot.objects.order_by("date")
+        if options["snapshot_ids"]:
+            snapshots = snapshots.filter(id__in=options["snapshot_ids"])
+        else:
+            snapshots = snapshots.filter(portfolio_values__isnull=True)
+
+        stored = 0
+        for snapshot in snapshots:
+            # Only the user_addresses of the users holding data in the snapshot
+            user_addresses = list(
+                UserAddress.objects.filter(user__usersnapshot__snapshot=snapshot)
+            )
+            if not user_addresses:
+                continue
+            stored += materialize_portfolio_values(
+                snapshot, user_addresses, PriceBook(snapshot, fetch_missing=False)
+            )
+            self.stdout.write(f"Valued snapshot {snapshot.id}")
+        self.stdout.write(self.style.SUCCESS(f"Stored {stored} portfolio values."))
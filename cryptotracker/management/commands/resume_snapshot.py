@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cryptotracker.models import Snapshot
+from cryptotracker.tasks import resume_snapshot_update
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the pending and failed units of a snapshot again, into the same snapshot"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "snapshot_id",
+            nargs="?",
+            type=int,
+            help="ID of the snapshot to resume (default: the last unfinished one)",
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, help="Number of user_addresses per subtask"
+        )
+
+    def handle(self, *args, **options):
+        snapshots = Snapshot.objects.all()
+        if options["snapshot_id"] is None:
+            snapshot = snapshots.exclude(status=Snapshot.COMPLETE).first()
+        else:
+            snapshot = snapshots.filter(id=options["snapshot_id"]).first()
+        if snapshot is None:
+            raise CommandError("No snapshot to resume.")
+
+        result = resume_snapshot_update(snapshot.id, options["chunk_size"])
+        if result is None:
+            self.stdout.write(f"Snapshot {snapshot.id} has no unit to resume.")
+            return
+        result.save()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Resuming snapshot {snapshot.id}: task group {result.id}"
+            )
+        )
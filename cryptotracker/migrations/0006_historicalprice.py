@@ -0,0 +1,39 @@
+# Generated by Django 5.2 on 2026-10-18 03:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cryptotracker", "0005_snapshotblock"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HistoricalPrice",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("coin_id", models.CharField(max_length=50)),
+                ("date", models.DateField()),
+                ("currency", models.CharField(max_length=10)),
+                ("price", models.DecimalField(decimal_places=10, max_digits=30)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("coin_id", "date", "currency"),
+                        name="unique_historical_price",
+                    )
+                ],
+            },
+        ),
+    ]
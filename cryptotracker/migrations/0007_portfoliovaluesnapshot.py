@@ -0,0 +1,65 @@
+# Generated by Django 5.2 on 2026-10-18 03:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cryptotracker", "0006_historicalprice"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PortfolioValueSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "category",
+                    models.CharField(
+                        choices=[
+                            ("assets", "Assets"),
+                            ("staking", "Staking"),
+                            ("protocols", "Protocols"),
+                            ("troves", "Troves"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("value_eur", models.DecimalField(decimal_places=5, max_digits=30)),
+                ("line_items", models.JSONField(default=list)),
+                (
+                    "snapshot",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="portfolio_values",
+                        to="cryptotracker.snapshot",
+                    ),
+                ),
+                (
+                    "user_address",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="cryptotracker.useraddress",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("snapshot", "user_address", "category"),
+                        name="unique_portfolio_value",
+                    )
+                ],
+            },
+        ),
+    ]
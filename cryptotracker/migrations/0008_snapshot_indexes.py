@@ -0,0 +1,137 @@
+# Generated by Django 5.2 on 2026-10-18 03:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_prices(apps, schema_editor):
+    """Keeps the last Price stored for each cryptocurrency of a snapshot"""
+    Price = apps.get_model("cryptotracker", "Price")
+    duplicates = (
+        Price.objects.values("snapshot", "cryptocurrency")
+        .annotate(count=Count("id"), last_id=Max("id"))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for duplicate in duplicates:
+        Price.objects.filter(
+            snapshot=duplicate["snapshot"],
+            cryptocurrency=duplicate["cryptocurrency"],
+            id__lt=duplicate["last_id"],
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cryptotracker", "0007_portfoliovaluesnapshot"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_prices, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="poolbalancesnapshot",
+            name="snapshot",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="cryptotracker.snapshot",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="poolrewardssnapshot",
+            name="snapshot",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="cryptotracker.snapshot",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="portfoliovaluesnapshot",
+            name="snapshot",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="portfolio_values",
+                to="cryptotracker.snapshot",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="price",
+            name="snapshot",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="cryptotracker.snapshot",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="snapshotassets",
+            name="snapshot",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="cryptotracker.snapshot",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="trovesnapshot",
+            name="snapshot",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="cryptotracker.snapshot",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="validatorsnapshot",
+            name="snapshot",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="cryptotracker.snapshot",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="poolbalancesnapshot",
+            index=models.Index(
+                fields=["snapshot", "pool_position"], name="poolbalance_snapshot_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="poolrewardssnapshot",
+            index=models.Index(
+                fields=["snapshot", "pool_position"], name="poolrewards_snapshot_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="snapshot",
+            index=models.Index(fields=["date"], name="snapshot_date_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="snapshotassets",
+            index=models.Index(
+                fields=["snapshot", "user_address"], name="snapshotassets_snapshot_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="trovesnapshot",
+            index=models.Index(
+                fields=["snapshot", "trove"], name="trovesnapshot_snapshot_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="validatorsnapshot",
+            index=models.Index(
+                fields=["snapshot", "validator"], name="validatorsnapshot_snap_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="price",
+            constraint=models.UniqueConstraint(
+                fields=("snapshot", "cryptocurrency"), name="unique_snapshot_price"
+            ),
+        ),
+    ]
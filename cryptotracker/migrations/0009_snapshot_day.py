@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 03:20
+
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+
+
+def set_snapshot_days(apps, schema_editor):
+    Snapshot = apps.get_model("cryptotracker", "Snapshot")
+    Snapshot.objects.update(day=TruncDate("date"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cryptotracker", "0008_snapshot_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="snapshot",
+            name="day",
+            field=models.DateField(db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(set_snapshot_days, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="snapshot",
+            name="day",
+            field=models.DateField(db_index=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.2 on 2026-10-18 03:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def record_user_snapshots(apps, schema_editor):
+    """Records the snapshots holding rows of each user before this migration"""
+    Snapshot = apps.get_model("cryptotracker", "Snapshot")
+    UserSnapshot = apps.get_model("cryptotracker", "UserSnapshot")
+    user_snapshots = set()
+    for model_name, user_lookup in (
+        ("SnapshotAssets", "user_address__user"),
+        ("ValidatorSnapshot", "validator__user_address__user"),
+        ("PoolBalanceSnapshot", "pool_position__user_address__user"),
+        ("TroveSnapshot", "trove__user_address__user"),
+    ):
+        model = apps.get_model("cryptotracker", model_name)
+        user_snapshots.update(
+            model.objects.values_list(user_lookup, "snapshot").distinct().order_by()
+        )
+    days = dict(Snapshot.objects.values_list("id", "day"))
+    UserSnapshot.objects.bulk_create(
+        [
+            UserSnapshot(
+                user_id=user_id, snapshot_id=snapshot_id, day=days[snapshot_id]
+            )
+            for user_id, snapshot_id in user_snapshots
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cryptotracker", "0009_snapshot_day"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                (
+                    "snapshot",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="cryptotracker.snapshot",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "day"], name="usersnapshot_user_day_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "snapshot"), name="unique_user_snapshot"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(record_user_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.2 on 2026-10-18 03:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F
+
+
+def complete_existing_snapshots(apps, schema_editor):
+    """The snapshots taken before their status was tracked are all finished"""
+    Snapshot = apps.get_model("cryptotracker", "Snapshot")
+    Snapshot.objects.update(status="complete", completed_at=F("date"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cryptotracker", "0010_usersnapshot"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="snapshot",
+            name="completed_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="snapshot",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("running", "Running"),
+                    ("partial", "Partial"),
+                    ("complete", "Complete"),
+                ],
+                default="pending",
+                max_length=10,
+            ),
+        ),
+        migrations.CreateModel(
+            name="SnapshotSource",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "source",
+                    models.CharField(
+                        choices=[
+                            ("prices", "Prices"),
+                            ("assets", "Assets"),
+                            ("staking", "Staking"),
+                            ("protocols", "Protocols"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("expected", models.PositiveIntegerField(default=0)),
+                ("succeeded", models.PositiveIntegerField(default=0)),
+                ("failed", models.PositiveIntegerField(default=0)),
+                (
+                    "snapshot",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="sources",
+                        to="cryptotracker.snapshot",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("snapshot", "source"), name="unique_snapshot_source"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(complete_existing_snapshots, migrations.RunPython.noop),
+    ]
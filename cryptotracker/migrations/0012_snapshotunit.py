@@ -0,0 +1,85 @@
+# Generated by Django 5.2 on 2026-10-18 03:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cryptotracker", "0011_snapshot_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SnapshotUnit",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "source",
+                    models.CharField(
+                        choices=[
+                            ("prices", "Prices"),
+                            ("assets", "Assets"),
+                            ("staking", "Staking"),
+                            ("protocols", "Protocols"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("succeeded", "Succeeded"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                (
+                    "snapshot",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="units",
+                        to="cryptotracker.snapshot",
+                    ),
+                ),
+                (
+                    "user_address",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="snapshot_units",
+                        to="cryptotracker.useraddress",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("snapshot", "source", "user_address"),
+                        name="unique_snapshot_unit",
+                    ),
+                    models.UniqueConstraint(
+                        condition=models.Q(("user_address__isnull", True)),
+                        fields=("snapshot", "source"),
+                        name="unique_snapshot_source_unit",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 04:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cryptotracker", "0012_snapshotunit"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="snapshot",
+            name="refreshed_addresses",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="snapshot",
+            name="refreshed_sources",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -1,5 +1,8 @@
+from datetime import date, datetime
+
 from django.contrib.auth.models import User
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 
@@ -34,12 +37,40 @@ class CryptocurrencyNetwork(models.Model):
 class Price(models.Model):
     cryptocurrency = models.ForeignKey("Cryptocurrency", on_delete=models.CASCADE)
     price = models.DecimalField(max_digits=20, decimal_places=2)
-    snapshot = models.ForeignKey("Snapshot", on_delete=models.CASCADE)
+    snapshot = models.ForeignKey(
+        "Snapshot", on_delete=models.CASCADE, db_index=False
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["snapshot", "cryptocurrency"], name="unique_snapshot_price"
+            )
+        ]
 
     def __str__(self):
         return f"{self.cryptocurrency.name} - {self.price} - {self.snapshot}"
 
 
+class HistoricalPrice(models.Model):
+    """Daily price of a coin fetched from the API, which never changes once known"""
+
+    coin_id = models.CharField(max_length=50)
+    date = models.DateField()
+    currency = models.CharField(max_length=10)
+    price = models.DecimalField(max_digits=30, decimal_places=10)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["coin_id", "date", "currency"], name="unique_historical_price"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.coin_id} - {self.date} - {self.price} {self.currency}"
+
+
 class Account(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=20)
@@ -72,7 +103,16 @@ class SnapshotAssets(models.Model):
     )
     user_address = models.ForeignKey("UserAddress", on_delete=models.CASCADE)
     quantity = models.DecimalField(max_digits=20, decimal_places=5)
-    snapshot = models.ForeignKey("Snapshot", on_delete=models.CASCADE)
+    snapshot = models.ForeignKey(
+        "Snapshot", on_delete=models.CASCADE, db_index=False
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["snapshot", "user_address"], name="snapshotassets_snapshot_idx"
+            )
+        ]
 
     def __str__(self):
         return f"{self.cryptocurrency.cryptocurrency.name} - {self.quantity} - {self.snapshot}"
@@ -93,7 +133,16 @@ class ValidatorSnapshot(models.Model):
     balance = models.DecimalField(max_digits=20, decimal_places=5)
     status = models.CharField(max_length=20)
     rewards = models.DecimalField(max_digits=20, decimal_places=5)
-    snapshot = models.ForeignKey("Snapshot", on_delete=models.CASCADE)
+    snapshot = models.ForeignKey(
+        "Snapshot", on_delete=models.CASCADE, db_index=False
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["snapshot", "validator"], name="validatorsnapshot_snap_idx"
+            )
+        ]
 
     def __str__(self):
         return f"{self.validator} - {self.balance}"
@@ -145,7 +194,14 @@ class PoolBalanceSnapshot(models.Model):
     pool_position = models.ForeignKey("PoolPosition", on_delete=models.CASCADE)
     token = models.ForeignKey("Cryptocurrency", on_delete=models.CASCADE)
     quantity = models.DecimalField(max_digits=20, decimal_places=5)
-    snapshot = models.ForeignKey("Snapshot", on_delete=models.CASCADE)
+    snapshot = models.ForeignKey(
+        "Snapshot", on_delete=models.CASCADE, db_index=False
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["snapshot", "pool_position"], name="poolbalance_snapshot_idx")
+        ]
 
     def __str__(self):
         return f"{self.pool_position} - {self.quantity} - {self.snapshot}"
@@ -155,7 +211,14 @@ class PoolRewardsSnapshot(models.Model):
     pool_position = models.ForeignKey("PoolPosition", on_delete=models.CASCADE)
     token = models.ForeignKey("Cryptocurrency", on_delete=models.CASCADE)
     quantity = models.DecimalField(max_digits=20, decimal_places=5)
-    snapshot = models.ForeignKey("Snapshot", on_delete=models.CASCADE)
+    snapshot = models.ForeignKey(
+        "Snapshot", on_delete=models.CASCADE, db_index=False
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["snapshot", "pool_position"], name="poolrewards_snapshot_idx")
+        ]
 
     def __str__(self):
         return f"{self.pool_position} - {self.quantity} - {self.snapshot}"
@@ -176,22 +239,206 @@ class TroveSnapshot(models.Model):
     debt = models.DecimalField(max_digits=20, decimal_places=5)
     balance = models.DecimalField(max_digits=20, decimal_places=5)
     interest_rate = models.DecimalField(max_digits=5, decimal_places=2)
-    snapshot = models.ForeignKey("Snapshot", on_delete=models.CASCADE)
+    snapshot = models.ForeignKey(
+        "Snapshot", on_delete=models.CASCADE, db_index=False
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["snapshot", "trove"], name="trovesnapshot_snapshot_idx")
+        ]
 
     def __str__(self):
         return f"{self.trove} - {self.collateral} - {self.snapshot}"
 
 
 class Snapshot(models.Model):
+    PENDING = "pending"
+    RUNNING = "running"
+    PARTIAL = "partial"
+    COMPLETE = "complete"
+    STATUSES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (PARTIAL, "Partial"),
+        (COMPLETE, "Complete"),
+    ]
+
     date = models.DateTimeField()
+    # Calendar date of the snapshot, for indexed lookups by day
+    day = models.DateField(db_index=True, editable=False)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    # Set when every source of the snapshot finished without errors
+    completed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Parts of REFRESH_SOURCES and IDs of the user_addresses fetched by a scoped
+    # refresh, the rest being carried forward. Null when everything was fetched.
+    refreshed_sources = models.JSONField(null=True, blank=True)
+    refreshed_addresses = models.JSONField(null=True, blank=True)
 
     class Meta:
         ordering = ["-date"]  # "Sort by descending date (most recent first)"
+        indexes = [models.Index(fields=["date"], name="snapshot_date_idx")]
+
+    def save(self, *args, **kwargs):
+        self.day = snapshot_day(self.date)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.date}"
 
 
+def snapshot_day(snapshot_date: datetime) -> date:
+    """Returns the calendar date of a snapshot date in the current time zone"""
+    if timezone.is_aware(snapshot_date):
+        snapshot_date = timezone.localtime(snapshot_date)
+    return snapshot_date.date()
+
+
+class SnapshotSource(models.Model):
+    """Completion counters of a source of data of a snapshot, counted from its units by the finalizer of its run"""
+
+    SOURCES = [
+        ("prices", "Prices"),
+        ("assets", "Assets"),
+        ("staking", "Staking"),
+        ("protocols", "Protocols"),
+    ]
+
+    snapshot = models.ForeignKey(
+        "Snapshot", on_delete=models.CASCADE, related_name="sources"
+    )
+    source = models.CharField(max_length=20, choices=SOURCES)
+    expected = models.PositiveIntegerField(default=0)
+    succeeded = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["snapshot", "source"], name="unique_snapshot_source"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.source} - {self.succeeded + self.failed}/{self.expected} - {self.snapshot}"
+
+
+class SnapshotUnit(models.Model):
+    """Unit of work of a snapshot run, the data of a source for one user_address, retried on its own"""
+
+    PENDING = "pending"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUSES = [
+        (PENDING, "Pending"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    snapshot = models.ForeignKey(
+        "Snapshot", on_delete=models.CASCADE, related_name="units", db_index=False
+    )
+    source = models.CharField(max_length=20, choices=SnapshotSource.SOURCES)
+    # Empty for the prices, fetched once for every user_address
+    user_address = models.ForeignKey(
+        "UserAddress",
+        on_delete=models.CASCADE,
+        related_name="snapshot_units",
+        null=True,
+        blank=True,
+    )
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["snapshot", "source", "user_address"],
+                name="unique_snapshot_unit",
+            ),
+            models.UniqueConstraint(
+                fields=["snapshot", "source"],
+                condition=models.Q(user_address__isnull=True),
+                name="unique_snapshot_source_unit",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.source} - {self.user_address} - {self.status} - {self.snapshot}"
+
+
+class UserSnapshot(models.Model):
+    """Snapshot holding the complete data of a user, recorded once its tasks finished"""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    snapshot = models.ForeignKey("Snapshot", on_delete=models.CASCADE)
+    day = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "snapshot"], name="unique_user_snapshot"
+            )
+        ]
+        indexes = [models.Index(fields=["user", "day"], name="usersnapshot_user_day_idx")]
+
+    def __str__(self):
+        return f"{self.user} - {self.snapshot}"
+
+
+class SnapshotBlock(models.Model):
+    """Block number at which every chain read of a snapshot is made"""
+
+    snapshot = models.ForeignKey(
+        "Snapshot", on_delete=models.CASCADE, related_name="blocks"
+    )
+    network = models.ForeignKey("Network", on_delete=models.CASCADE)
+    block_number = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["snapshot", "network"], name="unique_snapshot_network_block"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.network} - {self.block_number} - {self.snapshot}"
+
+
+class PortfolioValueSnapshot(models.Model):
+    """EUR value of a category of positions of a user_address in a snapshot"""
+
+    CATEGORIES = [
+        ("assets", "Assets"),
+        ("staking", "Staking"),
+        ("protocols", "Protocols"),
+        ("troves", "Troves"),
+    ]
+
+    snapshot = models.ForeignKey(
+        "Snapshot",
+        on_delete=models.CASCADE,
+        related_name="portfolio_values",
+        db_index=False,
+    )
+    user_address = models.ForeignKey("UserAddress", on_delete=models.CASCADE)
+    category = models.CharField(max_length=20, choices=CATEGORIES)
+    value_eur = models.DecimalField(max_digits=30, decimal_places=5)
+    line_items = models.JSONField(default=list)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["snapshot", "user_address", "category"],
+                name="unique_portfolio_value",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user_address} - {self.category} - {self.value_eur} - {self.snapshot}"
+
+
 class ErrorTypes(models.Model):
     error_type = models.CharField(max_length=20)
 
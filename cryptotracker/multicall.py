@@ -0,0 +1,182 @@
+import logging
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple
+
+from eth_abi import decode, encode
+from eth_utils import function_signature_to_4byte_selector, to_checksum_address, to_hex
+
+from cryptotracker.constants import MULTICALL3_ADDRESS
+from cryptotracker.rpc import BlockIdentifier, RPCClient, block_param
+
+# A function performing a plain eth_call: (to, calldata) -> returned bytes
+EthCall = Callable[[str, bytes], bytes]
+
+# A single sub-call of an aggregated call: (target, calldata)
+Call = Tuple[str, bytes]
+
+AGGREGATE3_SELECTOR = function_signature_to_4byte_selector(
+    "aggregate3((address,bool,bytes)[])"
+)
+BALANCE_OF_SELECTOR = function_signature_to_4byte_selector("balanceOf(address)")
+GET_ETH_BALANCE_SELECTOR = function_signature_to_4byte_selector(
+    "getEthBalance(address)"
+)
+
+# Upper bound for the calldata of one aggregated eth_call. Public RPC nodes
+# reject oversized requests, so the sub-calls are split in chunks below it.
+MAX_CALLDATA_BYTES = 48 * 1024
+
+# ABI size of one (address,bool,bytes) tuple without its payload:
+# array offset + address + bool + bytes offset + bytes length
+_CALL_OVERHEAD_BYTES = 5 * 32
+
+
+def multicall_available(client: RPCClient, block: BlockIdentifier = "latest") -> bool:
+    """
+    Checks whether Multicall3 is deployed on the network of the client.
+    """
+    try:
+        return len(client.get_code(MULTICALL3_ADDRESS, block)) > 0
+    except Exception as e:
+        logging.warning(f"Could not check the Multicall3 deployment: {e}")
+        return False
+
+
+def _encoded_size(call: Call) -> int:
+    """
+    Returns the number of bytes a sub-call takes inside the aggregate3 calldata.
+    """
+    padded_data = (len(call[1]) + 31) // 32 * 32
+    return _CALL_OVERHEAD_BYTES + padded_data
+
+
+def chunk_calls(
+    calls: Sequence[Call], max_bytes: int = MAX_CALLDATA_BYTES
+) -> Iterator[List[Call]]:
+    """
+    Splits the sub-calls in chunks whose encoded calldata fits in max_bytes.
+    Args:
+        calls (list): A list of (target, calldata) tuples.
+        max_bytes (int): The maximum calldata size of a chunk.
+    Returns:
+        Iterator: Lists of sub-calls, keeping the original order.
+    """
+    chunk: List[Call] = []
+    chunk_size = 0
+    for call in calls:
+        call_size = _encoded_size(call)
+        if chunk and chunk_size + call_size > max_bytes:
+            yield chunk
+            chunk = []
+            chunk_size = 0
+        chunk.append(call)
+        chunk_size += call_size
+    if chunk:
+        yield chunk
+
+
+def encode_aggregate3(calls: Sequence[Call]) -> bytes:
+    """
+    Encodes the calldata of a Multicall3 aggregate3 call allowing every sub-call to fail.
+    """
+    return AGGREGATE3_SELECTOR + encode(
+        ["(address,bool,bytes)[]"],
+        [[(to_checksum_address(target), True, data) for target, data in calls]],
+    )
+
+
+def aggregate3(
+    eth_call: EthCall,
+    calls: Sequence[Call],
+    max_bytes: int = MAX_CALLDATA_BYTES,
+) -> List[Optional[bytes]]:
+    """
+    Executes the sub-calls through Multicall3 using as few eth_calls as possible.
+    Args:
+        eth_call (EthCall): The function used to send each aggregated eth_call.
+        calls (list): A list of (target, calldata) tuples.
+        max_bytes (int): The maximum calldata size of each aggregated eth_call.
+    Returns:
+        list: The returned data of each sub-call, or None if the sub-call reverted.
+    """
+    results: List[Optional[bytes]] = []
+    for chunk in chunk_calls(calls, max_bytes):
+        raw = eth_call(MULTICALL3_ADDRESS, encode_aggregate3(chunk))
+        (decoded,) = decode(["(bool,bytes)[]"], raw)
+        for success, return_data in decoded:
+            results.append(return_data if success else None)
+    return results
+
+
+def encode_balance_call(token_address: Optional[str], owner: str) -> Call:
+    """
+    Builds the sub-call returning the balance of owner.
+    Args:
+        token_address (str): The ERC-20 token address, or None for the native token.
+        owner (str): The address holding the balance.
+    Returns:
+        tuple: The (target, calldata) of the sub-call.
+    """
+    encoded_owner = encode(["address"], [to_checksum_address(owner)])
+    if token_address is None:
+        return MULTICALL3_ADDRESS, GET_ETH_BALANCE_SELECTOR + encoded_owner
+    return to_checksum_address(token_address), BALANCE_OF_SELECTOR + encoded_owner
+
+
+def fetch_balances(
+    eth_call: EthCall,
+    queries: Sequence[Tuple[Optional[str], str]],
+    max_bytes: int = MAX_CALLDATA_BYTES,
+) -> List[Optional[int]]:
+    """
+    Fetches native and ERC-20 balances packed in aggregated Multicall3 calls.
+    Args:
+        eth_call (EthCall): The function used to send each aggregated eth_call.
+        queries (list): A list of (token_address, owner) tuples, token_address being None for the native token.
+        max_bytes (int): The maximum calldata size of each aggregated eth_call.
+    Returns:
+        list: The raw balance of each query, or None if it could not be read.
+    """
+    calls = [encode_balance_call(token, owner) for token, owner in queries]
+    balances: List[Optional[int]] = []
+    for (token, owner), data in zip(queries, aggregate3(eth_call, calls, max_bytes)):
+        if data is None or len(data) < 32:
+            logging.warning(f"Balance call failed for token {token} and {owner}")
+            balances.append(None)
+            continue
+        balances.append(decode(["uint256"], data[:32])[0])
+    return balances
+
+
+def fetch_balances_without_multicall(
+    client: RPCClient,
+    queries: Sequence[Tuple[Optional[str], str]],
+    block: BlockIdentifier = "latest",
+) -> List[Optional[int]]:
+    """
+    Fetches native and ERC-20 balances with one eth_getBalance or eth_call per query,
+    packed in JSON-RPC batch arrays. Used on networks without Multicall3.
+    Args:
+        client (RPCClient): The JSON-RPC client of the network.
+        queries (list): A list of (token_address, owner) tuples, token_address being None for the native token.
+        block (int|str): The block number or tag to read at.
+    Returns:
+        list: The raw balance of each query, or None if it could not be read.
+    """
+    calls: List[Tuple[str, List[Any]]] = []
+    for token, owner in queries:
+        if token is None:
+            calls.append(("eth_getBalance", [owner, block_param(block)]))
+            continue
+        target, data = encode_balance_call(token, owner)
+        calls.append(
+            ("eth_call", [{"to": target, "data": to_hex(data)}, block_param(block)])
+        )
+
+    balances: List[Optional[int]] = []
+    for (token, owner), result in zip(queries, client.batch(calls, allow_failure=True)):
+        if not result or result == "0x":
+            logging.warning(f"Balance call failed for token {token} and {owner}")
+            balances.append(None)
+            continue
+        balances.append(int(result, 16))
+    return balances
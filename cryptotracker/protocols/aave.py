@@ -1,18 +1,107 @@
 import logging
+from collections import defaultdict
+from typing import List, NamedTuple, Optional
 
-from ape import Contract, networks
+from eth_abi import decode
 
+from cryptotracker.chain_pool import ChainPool, LocalChainRunner
 from cryptotracker.models import Pool, ProtocolNetwork, Snapshot, UserAddress
 from cryptotracker.protocols.protocols import save_pool_snapshot
 from cryptotracker.constants import POOL_TYPES, PROTOCOLS_DATA
+from cryptotracker.multicall import aggregate3, multicall_available
+from cryptotracker.rpc import BlockIdentifier, encode_call, get_rpc_client
+from cryptotracker.snapshots import get_snapshot_blocks
+from cryptotracker.writer import SnapshotWriter, snapshot_writer
 
+# Output of AaveProtocolDataProvider.getUserReserveData: currentATokenBalance,
+# currentStableDebt, currentVariableDebt, principalStableDebt, scaledVariableDebt,
+# stableBorrowRate, liquidityRate, stableRateLastUpdated, usageAsCollateralEnabled
+USER_RESERVE_DATA_TYPES = ["uint256"] * 7 + ["uint40", "bool"]
 
-def update_aave_lending_pools(user_address: UserAddress, snapshot: Snapshot) -> None:
+
+class AavePosition(NamedTuple):
+    """Raw balances of an address in one AAVE V3 reserve"""
+
+    public_address: str
+    token_symbol: str
+    supplied: int
+    stable_debt: int
+    variable_debt: int
+
+
+def fetch_aave_positions(
+    network_choice: str,
+    pool_address: str,
+    public_addresses: List[str],
+    block: BlockIdentifier = "latest",
+) -> List[AavePosition]:
     """
-    Save the AAVE V3 lending pool participation of a given user_address (acting as a supplier only).
+    Reads the AAVE V3 supplies and debts of a list of addresses on a network.
+    The getUserReserveData reads of every (address, reserve) pair are packed in
+    aggregated Multicall3 calls, falling back to JSON-RPC batches on networks
+    without Multicall3.
     Args:
-        user_address (UserAddress): The user_address to check.
+        network_choice (str): The Ape network choice of the network.
+        pool_address (str): The address of the AAVE V3 pool addresses provider.
+        public_addresses (list): The addresses to check.
+        block (int|str): The block number or tag to read at.
+    Returns:
+        list: The AavePosition of every reserve where an address supplies or borrows.
+    """
+    client = get_rpc_client(network_choice)
+    (provider_address,) = decode(
+        ["address"],
+        client.eth_call(pool_address, encode_call("getPoolDataProvider()"), block),
+    )
+    (tokens,) = decode(
+        ["(string,address)[]"],
+        client.eth_call(provider_address, encode_call("getAllReservesTokens()"), block),
+    )
+
+    pairs = [(address, token) for address in public_addresses for token in tokens]
+    calls = [
+        (
+            provider_address,
+            encode_call("getUserReserveData(address,address)", token[1], address),
+        )
+        for address, token in pairs
+    ]
+    if multicall_available(client, block):
+        results = aggregate3(lambda to, data: client.eth_call(to, data, block), calls)
+    else:
+        results = client.batch_eth_call(calls, block=block, allow_failure=True)
 
+    positions = []
+    for (public_address, token), data in zip(pairs, results):
+        if not data:
+            logging.error(f"Error fetching data for {token[1]}")
+            continue
+        aave_pool_data = decode(USER_RESERVE_DATA_TYPES, data)
+        supplied, stable_debt, variable_debt = aave_pool_data[:3]
+        if not (supplied or stable_debt or variable_debt):
+            continue
+        positions.append(
+            AavePosition(public_address, token[0], supplied, stable_debt, variable_debt)
+        )
+    return positions
+
+
+def update_aave_lending_pools_batch(
+    user_addresses: List[UserAddress],
+    snapshot: Snapshot,
+    chain_pool: Optional[ChainPool] = None,
+    writer: Optional[SnapshotWriter] = None,
+) -> List[Pool]:
+    """
+    Save the AAVE V3 lending pool participation of a list of user_addresses (acting as suppliers only).
+    Args:
+        user_addresses (list): The user_addresses to check.
+        snapshot (Snapshot): The snapshot object to associate with the updates.
+        chain_pool (ChainPool, optional): Pool fetching the networks concurrently.
+        writer (SnapshotWriter, optional): The writer buffering the snapshot rows,
+            a new one is flushed at the end if not provided.
+    Returns:
+        list: The pools whose positions could not be fetched.
     """
     logging.info("Searching AAVE pools")
     protocols = ProtocolNetwork.objects.filter(
@@ -21,35 +110,62 @@ def update_aave_lending_pools(user_address: UserAddress, snapshot: Snapshot) ->
     pools = Pool.objects.filter(
         protocol_network__in=protocols,
         type__name=POOL_TYPES["LENDING"],
-    )
+    ).select_related("protocol_network__network")
 
-    for pool in pools:
-        network = pool.protocol_network.network
-
-        with networks.parse_network_choice(network.url_rpc):
-            contract = Contract(pool.contract_address)
-            provider_address = contract.getPoolDataProvider()
-            provider = Contract(provider_address)
-            tokens = provider.getAllReservesTokens()
-            for token in tokens:
-                token_address = token[1]
-                try:
-                    aave_pool_data = provider.getUserReserveData(
-                        token_address, user_address.public_address
-                    )
-                except Exception as e:
-                    logging.error(f"Error fetching data for {token_address}: {e}")
-                    aave_pool_data = None
+    public_addresses = sorted({address.public_address for address in user_addresses})
+    blocks = get_snapshot_blocks(snapshot)
+    runner = chain_pool or LocalChainRunner()
+    reads = {
+        pool: runner.submit(
+            pool.protocol_network.network.url_rpc,
+            fetch_aave_positions,
+            pool.contract_address,
+            public_addresses,
+            blocks.get(pool.protocol_network.network.url_rpc, "latest"),
+        )
+        for pool in pools
+        if pool.protocol_network.network.url_rpc
+    }
 
-                if not aave_pool_data or aave_pool_data.currentATokenBalance == 0:
+    users_by_address = defaultdict(list)
+    for user_address in user_addresses:
+        users_by_address[user_address.public_address].append(user_address)
+
+    failed_pools: List[Pool] = []
+    with snapshot_writer(snapshot, writer) as writer:
+        for pool, read in reads.items():
+            try:
+                positions = read.result()
+            except Exception as e:
+                logging.error(f"Error fetching AAVE pool {pool}: {e}")
+                failed_pools.append(pool)
+                continue
+
+            for position in positions:
+                if not position.supplied:
                     continue
+                for user_address in users_by_address[position.public_address]:
+                    # Save PoolBalanceSnapshot
+                    save_pool_snapshot(
+                        pool,
+                        user_address,
+                        position.token_symbol,
+                        position.supplied / 1e18,
+                        snapshot,
+                        writer=writer,
+                    )
+    return failed_pools
 
-                # Save PoolBalanceSnapshot
 
-                save_pool_snapshot(
-                    pool,
-                    user_address,
-                    token[0],
-                    aave_pool_data.currentATokenBalance / 1e18,
-                    snapshot,
-                )
+def update_aave_lending_pools(
+    user_address: UserAddress, snapshot: Snapshot
+) -> List[Pool]:
+    """
+    Save the AAVE V3 lending pool participation of a given user_address (acting as a supplier only).
+    Args:
+        user_address (UserAddress): The user_address to check.
+
+    Returns:
+        list: The pools whose positions could not be fetched.
+    """
+    return update_aave_lending_pools_batch([user_address], snapshot)
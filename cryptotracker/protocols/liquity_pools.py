@@ -1,14 +1,17 @@
 import logging
-from ape import Contract, networks
 from decimal import Decimal
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from eth_abi import decode
 
 from cryptotracker.models import (
     Pool,
+    Price,
     Snapshot,
+    TroveSnapshot,
     UserAddress,
     Cryptocurrency,
-    Trove,
-    TroveSnapshot,
 )
 from cryptotracker.constants import (
     NETWORKS,
@@ -19,27 +22,88 @@ from cryptotracker.constants import (
     ERROR_TYPES,
 )
 from cryptotracker.protocols.protocols import save_pool_snapshot
-from cryptotracker.protocols.subgraph import send_graphql_query
-from cryptotracker.utils import get_last_price
+from cryptotracker.protocols.subgraph import (
+    SubgraphError,
+    block_filter,
+    get_indexed_block,
+    send_graphql_query,
+)
+from cryptotracker.utils import PriceBook
 from cryptotracker.error_traking import log_snapshot_error
+from cryptotracker.rpc import BlockIdentifier, encode_call, get_rpc_client
+from cryptotracker.snapshots import get_snapshot_block
+from cryptotracker.writer import SnapshotWriter, snapshot_writer
 
 LQTY_V2_SUBGRAPH_ID = "6bg574MHrEZXopJDYTu7S7TAvJKEMsV111gpKLM7ZCA7"
 
 
-def get_proxy_staking_contract(user_address: UserAddress) -> str:
-    LQTY_V2_STAKING = Pool.objects.get(
-        type__name=POOL_TYPES["STAKING"],
-        protocol_network__protocol__name=PROTOCOLS_DATA["LQTY_V2"]["name"],
-        protocol_network__network__name=NETWORKS["ETHEREUM"]["name"],
+@lru_cache(maxsize=32)
+def get_liquity_pools(
+    protocol: str, pool_type: str, snapshot_id: int
+) -> Tuple[Pool, ...]:
+    """
+    Returns the Ethereum pools of a Liquity protocol version and pool type.
+    The lookup is cached per snapshot, so it is made once per run instead of
+    once per address.
+    Args:
+        protocol (str): The PROTOCOLS_DATA key of the protocol version.
+        pool_type (str): The POOL_TYPES key of the pools.
+        snapshot_id (int): The ID of the Snapshot being updated.
+    Returns:
+        tuple: The matching pools.
+    """
+    return tuple(
+        Pool.objects.select_related("protocol_network__protocol").filter(
+            type__name=POOL_TYPES[pool_type],
+            protocol_network__protocol__name=PROTOCOLS_DATA[protocol]["name"],
+            protocol_network__network__name=NETWORKS["ETHEREUM"]["name"],
+        )
     )
 
-    with networks.parse_network_choice(ETHEREUM_RPC):
-        lqty_govern_contract = Contract(LQTY_V2_STAKING.contract_address)
-        return lqty_govern_contract.deriveUserProxyAddress(user_address.public_address)
+
+def read_uint_views(
+    calls: List[Tuple[Optional[str], bytes]], block: BlockIdentifier = "latest"
+) -> List[int]:
+    """
+    Reads uint256 views of Ethereum contracts in a single JSON-RPC batch.
+    Args:
+        calls (list): A list of (contract_address, calldata) tuples.
+        block (int|str): The block number or tag to read at.
+    Returns:
+        list: The first uint256 returned by each call.
+    """
+    targets = []
+    for contract_address, calldata in calls:
+        if not contract_address:
+            raise ValueError("Liquity pool without contract address")
+        targets.append((contract_address, calldata))
+    results = get_rpc_client(ETHEREUM_RPC).batch_eth_call(targets, block=block)
+    return [decode(["uint256"], data[:32])[0] if data else 0 for data in results]
+
+
+def get_proxy_staking_contract(user_address: UserAddress, snapshot: Snapshot) -> str:
+    LQTY_V2_STAKING = get_liquity_pools("LQTY_V2", "STAKING", snapshot.id)[0]
+
+    if not LQTY_V2_STAKING.contract_address:
+        raise ValueError("Liquity v2 staking pool without contract address")
+    client = get_rpc_client(ETHEREUM_RPC)
+    (proxy_address,) = decode(
+        ["address"],
+        client.eth_call(
+            LQTY_V2_STAKING.contract_address,
+            encode_call("deriveUserProxyAddress(address)", user_address.public_address),
+            get_snapshot_block(snapshot, ETHEREUM_RPC),
+        ),
+    )
+    return proxy_address
 
 
 def get_lqty_stakes(
-    address: str, pool: Pool, snapshot: Snapshot, user_address: UserAddress
+    address: str,
+    pool: Pool,
+    snapshot: Snapshot,
+    user_address: UserAddress,
+    writer: Optional[SnapshotWriter] = None,
 ) -> None:
     """
     Helper to query the LQTY stakes of a given public user_address using the staking pool v1 and save the snapshot
@@ -48,48 +112,56 @@ def get_lqty_stakes(
         pool (Pool): The pool object to save the snapshot.
         snapshot (Snapshot): The snapshot object to associate with the updates.
         user_address (UserAddress): The user_address object to associate with the updates.
+        writer (SnapshotWriter, optional): The writer buffering the snapshot rows.
     """
-    LQTY_V1_STAKING = Pool.objects.get(
-        type__name=POOL_TYPES["STAKING"],
-        protocol_network__protocol__name=PROTOCOLS_DATA["LQTY_V1"]["name"],
-        protocol_network__network__name=NETWORKS["ETHEREUM"]["name"],
+    LQTY_V1_STAKING = get_liquity_pools("LQTY_V1", "STAKING", snapshot.id)[0]
+
+    contract = LQTY_V1_STAKING.contract_address
+    lqty_stakes, eth_rewards, lusd_rewards = read_uint_views(
+        [
+            (contract, encode_call("stakes(address)", address)),
+            (contract, encode_call("getPendingETHGain(address)", address)),
+            (contract, encode_call("getPendingLUSDGain(address)", address)),
+        ],
+        get_snapshot_block(snapshot, ETHEREUM_RPC),
     )
-
-    with networks.parse_network_choice(ETHEREUM_RPC):
-        contract = Contract(LQTY_V1_STAKING.contract_address)
-        lqty_stakes = contract.stakes(address)
-        if not lqty_stakes:
-            return
-        eth_rewards = contract.getPendingETHGain(address)
-        lusd_rewards = contract.getPendingLUSDGain(address)
+    if not lqty_stakes:
+        return
 
     save_pool_snapshot(
         pool=pool,
         address=user_address,
         token_symbol="LQTY",
-        quantity=lqty_stakes / 1e18,
+        quantity=Decimal(lqty_stakes) / Decimal(1e18),
         snapshot=snapshot,
+        writer=writer,
     )
     # Save PoolRewardsSnapshot
     save_pool_snapshot(
         pool=pool,
         address=user_address,
         token_symbol="ETH",
-        quantity=eth_rewards / 1e18,
+        quantity=Decimal(eth_rewards) / Decimal(1e18),
         snapshot=snapshot,
         is_reward=True,
+        writer=writer,
     )
     save_pool_snapshot(
         pool=pool,
         address=user_address,
         token_symbol="LUSD",
-        quantity=lusd_rewards / 1e18,
+        quantity=Decimal(lusd_rewards) / Decimal(1e18),
         snapshot=snapshot,
         is_reward=True,
+        writer=writer,
     )
 
 
-def update_lqty_v1_staking(user_address: UserAddress, snapshot: Snapshot) -> None:
+def update_lqty_v1_staking(
+    user_address: UserAddress,
+    snapshot: Snapshot,
+    writer: Optional[SnapshotWriter] = None,
+) -> None:
     """
     Saves a snapshot of the total LQTY v1 stakes of a given user_address.
     Args:
@@ -97,17 +169,17 @@ def update_lqty_v1_staking(user_address: UserAddress, snapshot: Snapshot) -> Non
         snapshot (Snapshot): The snapshot object to associate with the updates.
     """
     logging.info("Updating LQTY V1 staking")
-    LQTY_V1_STAKING = Pool.objects.get(
-        type__name=POOL_TYPES["STAKING"],
-        protocol_network__protocol__name=PROTOCOLS_DATA["LQTY_V1"]["name"],
-        protocol_network__network__name=NETWORKS["ETHEREUM"]["name"],
-    )
+    LQTY_V1_STAKING = get_liquity_pools("LQTY_V1", "STAKING", snapshot.id)[0]
     get_lqty_stakes(
-        user_address.public_address, LQTY_V1_STAKING, snapshot, user_address
+        user_address.public_address, LQTY_V1_STAKING, snapshot, user_address, writer
     )
 
 
-def update_lqty_v2_staking(user_address: UserAddress, snapshot: Snapshot) -> None:
+def update_lqty_v2_staking(
+    user_address: UserAddress,
+    snapshot: Snapshot,
+    writer: Optional[SnapshotWriter] = None,
+) -> None:
     """
     Saves the total LQTY V2 governance stakes of a given user_address.
     Args:
@@ -115,18 +187,18 @@ def update_lqty_v2_staking(user_address: UserAddress, snapshot: Snapshot) -> Non
     """
     logging.info("Updating LQTY V2 staking")
 
-    LQTY_V2_STAKING = Pool.objects.get(
-        type__name=POOL_TYPES["STAKING"],
-        protocol_network__protocol__name=PROTOCOLS_DATA["LQTY_V2"]["name"],
-        protocol_network__network__name=NETWORKS["ETHEREUM"]["name"],
-    )
+    LQTY_V2_STAKING = get_liquity_pools("LQTY_V2", "STAKING", snapshot.id)[0]
 
-    proxy_contract = get_proxy_staking_contract(user_address)
+    proxy_contract = get_proxy_staking_contract(user_address, snapshot)
     logging.info(f"Proxy contract for {user_address.public_address}: {proxy_contract}")
-    get_lqty_stakes(proxy_contract, LQTY_V2_STAKING, snapshot, user_address)
+    get_lqty_stakes(proxy_contract, LQTY_V2_STAKING, snapshot, user_address, writer)
 
 
-def update_lqty_stability_pool(user_address: UserAddress, snapshot: Snapshot) -> None:
+def update_lqty_stability_pool(
+    user_address: UserAddress,
+    snapshot: Snapshot,
+    writer: Optional[SnapshotWriter] = None,
+) -> None:
     """
     Saves the LQTY V1 stability pool participation of a given user_address.
     Args:
@@ -134,49 +206,58 @@ def update_lqty_stability_pool(user_address: UserAddress, snapshot: Snapshot) ->
     """
     logging.info(" Updating LQTY V1 stability pool")
 
-    LQTY_V1_STABILITY_POOL = Pool.objects.get(
-        type__name=POOL_TYPES["STABILITY_POOL"],
-        protocol_network__protocol__name=PROTOCOLS_DATA["LQTY_V1"]["name"],
-        protocol_network__network__name=NETWORKS["ETHEREUM"]["name"],
+    LQTY_V1_STABILITY_POOL = get_liquity_pools(
+        "LQTY_V1", "STABILITY_POOL", snapshot.id
+    )[0]
+
+    contract = LQTY_V1_STABILITY_POOL.contract_address
+    address = user_address.public_address
+    # deposits returns (initialValue, frontEndTag), only initialValue is read
+    initial_value, ETH_gains, LQTY_gains = read_uint_views(
+        [
+            (contract, encode_call("deposits(address)", address)),
+            (contract, encode_call("getDepositorETHGain(address)", address)),
+            (contract, encode_call("getDepositorLQTYGain(address)", address)),
+        ],
+        get_snapshot_block(snapshot, ETHEREUM_RPC),
     )
-
-    with networks.parse_network_choice(ETHEREUM_RPC):
-        contract = Contract(LQTY_V1_STABILITY_POOL.contract_address)
-        deposits = contract.deposits(user_address.public_address)
-        if not deposits.initialValue:
-            return
-        ETH_gains = contract.getDepositorETHGain(user_address.public_address)
-        LQTY_gains = contract.getDepositorLQTYGain(user_address.public_address)
+    if not initial_value:
+        return
 
     # Save PoolBalanceSnapshot
     save_pool_snapshot(
         pool=LQTY_V1_STABILITY_POOL,
         address=user_address,
         token_symbol="LUSD",
-        quantity=deposits.initialValue / 1e18,
+        quantity=Decimal(initial_value) / Decimal(1e18),
         snapshot=snapshot,
+        writer=writer,
     )
     # Save PoolRewardsSnapshot
     save_pool_snapshot(
         pool=LQTY_V1_STABILITY_POOL,
         address=user_address,
         token_symbol="ETH",
-        quantity=ETH_gains / 1e18,
+        quantity=Decimal(ETH_gains) / Decimal(1e18),
         snapshot=snapshot,
         is_reward=True,
+        writer=writer,
     )
     save_pool_snapshot(
         pool=LQTY_V1_STABILITY_POOL,
         address=user_address,
         token_symbol="LQTY",
-        quantity=LQTY_gains / 1e18,
+        quantity=Decimal(LQTY_gains) / Decimal(1e18),
         snapshot=snapshot,
         is_reward=True,
+        writer=writer,
     )
 
 
 def update_lqty_stability_pool_v2(
-    user_address: UserAddress, snapshot: Snapshot
+    user_address: UserAddress,
+    snapshot: Snapshot,
+    writer: Optional[SnapshotWriter] = None,
 ) -> None:
     """
     Saves a snapshot of the participation of a given user_address in the three LIQUITY V2 stabiity pools .
@@ -185,65 +266,121 @@ def update_lqty_stability_pool_v2(
     """
     logging.info("Updating LQTY V2 stability pool")
 
-    LQTY_V2_STABILITY_POOLS = Pool.objects.filter(
-        type__name=POOL_TYPES["STABILITY_POOL"],
-        protocol_network__protocol__name=PROTOCOLS_DATA["LQTY_V2"]["name"],
-        protocol_network__network__name=NETWORKS["ETHEREUM"]["name"],
+    LQTY_V2_STABILITY_POOLS = get_liquity_pools(
+        "LQTY_V2", "STABILITY_POOL", snapshot.id
     )
 
-    with networks.parse_network_choice(ETHEREUM_RPC):
-        for pool in LQTY_V2_STABILITY_POOLS:
-            contract = Contract(pool.contract_address)
-            deposits = contract.deposits(user_address.public_address)
-            if not deposits:
-                continue
-            coll_gains = contract.getDepositorCollGain(user_address.public_address)
-            yield_gains = contract.getDepositorYieldGain(user_address.public_address)
-
-            # Save PoolBalanceSnapshot
-            save_pool_snapshot(
-                pool=pool,
-                address=user_address,
-                token_symbol="BOLD",
-                quantity=deposits / 1e18,
-                snapshot=snapshot,
-            )
-            # Save PoolRewardsSnapshot gains (BOLD) and collateral (WETH, wstETH, and rETH)
-            save_pool_snapshot(
-                pool=pool,
-                address=user_address,
-                token_symbol="BOLD",
-                quantity=yield_gains / 1e18,
-                snapshot=snapshot,
-                is_reward=True,
+    address = user_address.public_address
+    pools = list(LQTY_V2_STABILITY_POOLS)
+    results = read_uint_views(
+        [
+            (pool.contract_address, encode_call(signature, address))
+            for pool in pools
+            for signature in (
+                "deposits(address)",
+                "getDepositorCollGain(address)",
+                "getDepositorYieldGain(address)",
             )
+        ],
+        get_snapshot_block(snapshot, ETHEREUM_RPC),
+    )
 
-            token_symbol = pool.description
-            if not token_symbol:
-                continue
+    for index, pool in enumerate(pools):
+        deposits, coll_gains, yield_gains = results[3 * index : 3 * index + 3]
+        if not deposits:
+            continue
+
+        # Save PoolBalanceSnapshot
+        save_pool_snapshot(
+            pool=pool,
+            address=user_address,
+            token_symbol="BOLD",
+            quantity=Decimal(deposits) / Decimal(1e18),
+            snapshot=snapshot,
+            writer=writer,
+        )
+        # Save PoolRewardsSnapshot gains (BOLD) and collateral (WETH, wstETH, and rETH)
+        save_pool_snapshot(
+            pool=pool,
+            address=user_address,
+            token_symbol="BOLD",
+            quantity=Decimal(yield_gains) / Decimal(1e18),
+            snapshot=snapshot,
+            is_reward=True,
+            writer=writer,
+        )
 
-            save_pool_snapshot(
-                pool=pool,
-                address=user_address,
-                token_symbol=token_symbol,
-                quantity=coll_gains / 1e18,
-                snapshot=snapshot,
-                is_reward=True,
-            )
+        token_symbol = pool.description
+        if not token_symbol:
+            continue
+
+        save_pool_snapshot(
+            pool=pool,
+            address=user_address,
+            token_symbol=token_symbol,
+            quantity=Decimal(coll_gains) / Decimal(1e18),
+            snapshot=snapshot,
+            is_reward=True,
+            writer=writer,
+        )
+
+
+def trove_balance(
+    collateral: Decimal, debt: Decimal, token_price: Decimal, bold_price: Decimal
+) -> Decimal:
+    """
+    Returns the EUR balance of a trove: its collateral minus its BOLD debt.
+    """
+    return collateral * token_price - debt * bold_price
+
+
+def update_trove_balances(snapshot: Snapshot) -> int:
+    """
+    Values the troves of a snapshot again at the prices stored for it. The
+    troves carried forward from an older snapshot hold the EUR balance of that
+    one. A trove whose token or BOLD has no stored price keeps its balance.
+    Args:
+        snapshot (Snapshot): The snapshot.
+    Returns:
+        int: The number of troves updated.
+    """
+    prices = dict(
+        Price.objects.filter(snapshot=snapshot).values_list(
+            "cryptocurrency__name", "price"
+        )
+    )
+    bold_price = prices.get(TOKENS["BOLD"]["name"])
+    troves = []
+    for trove in TroveSnapshot.objects.filter(snapshot=snapshot).select_related(
+        "trove__token"
+    ):
+        token_price = prices.get(trove.trove.token.name)
+        if token_price is None or bold_price is None:
+            continue
+        trove.balance = trove_balance(
+            trove.collateral, trove.debt, token_price, bold_price
+        )
+        troves.append(trove)
+    TroveSnapshot.objects.bulk_update(troves, ["balance"], batch_size=500)
+    return len(troves)
 
 
-def get_troves(user_address: UserAddress, snapshot: Snapshot) -> None:
+def get_troves(
+    user_address: UserAddress,
+    snapshot: Snapshot,
+    writer: Optional[SnapshotWriter] = None,
+) -> None:
     """Query all the troves for a given user_address using The Graph API"""
     error = ERROR_TYPES["TROVE"]
 
-    pool = Pool.objects.get(
-        type__name=POOL_TYPES["BORROWING"],
-        protocol_network__protocol__name=PROTOCOLS_DATA["LQTY_V2"]["name"],
-        protocol_network__network__name=NETWORKS["ETHEREUM"]["name"],
+    pool = get_liquity_pools("LQTY_V2", "BORROWING", snapshot.id)[0]
+    block = get_indexed_block(
+        LQTY_V2_SUBGRAPH_ID, get_snapshot_block(snapshot, ETHEREUM_RPC)
     )
     query = f"""
     {{
         troves(
+            {block_filter(block)}
             where: {{
                 borrower: "{user_address.public_address}",
                 
@@ -263,63 +400,68 @@ def get_troves(user_address: UserAddress, snapshot: Snapshot) -> None:
     }}
     """
     logging.info("Fetching troves for user: %s", user_address.public_address)
-    troves = send_graphql_query(LQTY_V2_SUBGRAPH_ID, query)
-    if troves == "error":
+    try:
+        troves = send_graphql_query(LQTY_V2_SUBGRAPH_ID, query, block=block)
+    except SubgraphError:
         logging.error("Error fetching troves for user: %s", user_address.public_address)
         log_snapshot_error(
             snapshot, error, user_address, pool.protocol_network.protocol
         )
-        return
+        raise
     if not troves or not troves.get("data") or not troves["data"].get("troves"):
         return
 
-    for trove in troves["data"]["troves"]:
-        token = Cryptocurrency.objects.get(
-            symbol={
-                0: "WETH",
-                1: "wstETH",
-            }.get(trove["collateral"]["collIndex"], "rETH")
-        )
-
-        logging.info(
-            f"Processing trove {trove['id']} for user {user_address.public_address}"
-        )
-
-        trove_obj, _ = Trove.objects.get_or_create(
-            trove_id=trove["id"],
-            defaults={
-                "user_address": user_address,
-                "pool": pool,
-                "token": token,
-            },
-        )
-        collateral = Decimal(trove["deposit"]) / Decimal(1e18)
-        debt = Decimal(trove["debt"]) / Decimal(1e18)
+    prices = PriceBook(snapshot)
+    with snapshot_writer(snapshot, writer) as writer:
+        for trove in troves["data"]["troves"]:
+            token = Cryptocurrency.objects.get(
+                symbol={
+                    0: "WETH",
+                    1: "wstETH",
+                }.get(trove["collateral"]["collIndex"], "rETH")
+            )
 
-        collateral_eur = collateral * get_last_price(token.name, snapshot.date)
+            logging.info(
+                f"Processing trove {trove['id']} for user {user_address.public_address}"
+            )
 
-        debt_eur = debt * get_last_price(TOKENS["BOLD"]["name"], snapshot.date)
-        balance = collateral_eur - debt_eur
+            collateral = Decimal(trove["deposit"]) / Decimal(1e18)
+            debt = Decimal(trove["debt"]) / Decimal(1e18)
+            balance = trove_balance(
+                collateral,
+                debt,
+                prices.get(token.name),
+                prices.get(TOKENS["BOLD"]["name"]),
+            )
 
-        TroveSnapshot.objects.create(
-            trove=trove_obj,
-            collateral=collateral,
-            debt=debt,
-            balance=balance,
-            interest_rate=Decimal(trove["interestRate"]) / Decimal(1e16),
-            snapshot=snapshot,
-        )
+            writer.add_trove(
+                user_address=user_address,
+                pool=pool,
+                trove_id=trove["id"],
+                token=token,
+                collateral=collateral,
+                debt=debt,
+                balance=balance,
+                interest_rate=Decimal(trove["interestRate"]) / Decimal(1e16),
+            )
 
 
-def update_lqty_pools(user_address: UserAddress, snapshot: Snapshot) -> None:
+def update_lqty_pools(
+    user_address: UserAddress,
+    snapshot: Snapshot,
+    writer: Optional[SnapshotWriter] = None,
+) -> None:
     """
     Updates the snapshots of the LQTY pools participation for a given user_address.
     Args:
         user_address (UserAddress): The user_address to check.
         snapshot (Snapshot): The snapshot object to associate with the updates.
+        writer (SnapshotWriter, optional): The writer buffering the snapshot rows,
+            a new one is flushed at the end if not provided.
     """
-    update_lqty_stability_pool(user_address, snapshot)
-    update_lqty_stability_pool_v2(user_address, snapshot)
-    update_lqty_v1_staking(user_address, snapshot)
-    update_lqty_v2_staking(user_address, snapshot)
-    get_troves(user_address, snapshot)
+    with snapshot_writer(snapshot, writer) as writer:
+        update_lqty_stability_pool(user_address, snapshot, writer)
+        update_lqty_stability_pool_v2(user_address, snapshot, writer)
+        update_lqty_v1_staking(user_address, snapshot, writer)
+        update_lqty_v2_staking(user_address, snapshot, writer)
+        get_troves(user_address, snapshot, writer)
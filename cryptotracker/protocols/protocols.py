@@ -2,11 +2,9 @@ import logging
 
 from collections import defaultdict
 from decimal import Decimal
-from typing import Optional, Dict
-from django.db.models import QuerySet
+from typing import Dict, List, Optional
 
 from cryptotracker.models import (
-    Cryptocurrency,
     Pool,
     PoolBalanceSnapshot,
     PoolPosition,
@@ -15,7 +13,8 @@ from cryptotracker.models import (
     TroveSnapshot,
     UserAddress,
 )
-from cryptotracker.utils import get_last_price
+from cryptotracker.utils import PriceBook
+from cryptotracker.writer import SnapshotWriter, snapshot_writer
 
 
 def save_pool_snapshot(
@@ -26,6 +25,7 @@ def save_pool_snapshot(
     snapshot: Snapshot,
     is_reward: bool = False,
     pool_id: Optional[str] = None,
+    writer: Optional[SnapshotWriter] = None,
 ) -> None:
     """
     Saves the pool balance or rewards to the database.
@@ -36,31 +36,19 @@ def save_pool_snapshot(
         quantity (Decimal): The quantity of the token.
         snapshot (Snapshot): The snapshot object.
         is_reward (bool): Whether the data is a reward (default: False).
+        writer (SnapshotWriter, optional): The writer buffering the row, the row
+            is written immediately if not provided.
     """
     try:
-        token = Cryptocurrency.objects.get(symbol=token_symbol)
-
-        pool_position, created = PoolPosition.objects.get_or_create(
-            user_address=address,
-            pool=pool,
-            position_id=pool_id,
-        )
-
-        if created:
-            logging.info(f"Created new pool position: {pool_position}")
-        else:
-            logging.info(f"Found existing pool position: {pool_position}")
-
-        snapshot_model = PoolRewardsSnapshot if is_reward else PoolBalanceSnapshot
-
-        pool_snapshot = snapshot_model(
-            pool_position=pool_position,
-            token=token,
-            quantity=quantity,
-            snapshot=snapshot,
-        )
-
-        pool_snapshot.save()
+        with snapshot_writer(snapshot, writer) as writer:
+            writer.add_pool_balance(
+                pool=pool,
+                user_address=address,
+                token_symbol=token_symbol,
+                quantity=quantity,
+                is_reward=is_reward,
+                position_id=pool_id,
+            )
     except Exception as e:
         logging.warning(
             f"Error saving pool {pool} {'reward' if is_reward else 'balance'}: {e}"
@@ -68,93 +56,117 @@ def save_pool_snapshot(
 
 
 class PoolData:
-    def __init__(self, pool_position: PoolPosition, snapshot: Snapshot):
+    def __init__(
+        self,
+        pool_position: PoolPosition,
+        snapshot: Snapshot,
+        prices: PriceBook,
+        balances: List[PoolBalanceSnapshot],
+        rewards: List[PoolRewardsSnapshot],
+    ):
         """
-        Initialize PoolData with a pool position and snapshot.
+        Initialize PoolData with a pool position, its balance and rewards rows in
+        the snapshot, valued with the given prices.
+        Use load_pool_data to build the PoolData of many positions at once.
         """
         self.pool_position = pool_position
         self.snapshot = snapshot
-        self.protocol = self._protocol()
-        self.balances = self._get_balance()
-        self.rewards = self._get_rewards()
+        self.prices = prices
+        self.protocol = pool_position.pool.protocol_network.protocol.name
+        self.balances = balances
+        self.rewards = rewards
         self.balance_eur = self._calculate_balance_eur()
 
-    def _protocol(self) -> str:
-        return self.pool_position.pool.protocol_network.protocol.name
-
-    def _get_balance(self) -> Optional[QuerySet]:
-        """
-        Fetch the balance snapshot for the pool position and snapshot.
-        """
-        try:
-            return PoolBalanceSnapshot.objects.filter(
-                pool_position=self.pool_position, snapshot=self.snapshot
-            )
-        except PoolBalanceSnapshot.DoesNotExist:
-            logging.warning(
-                ValueError(
-                    f"No balance found for pool {self.pool_position} in snapshot {self.snapshot}"
-                )
-            )
-            return None
-
-    def _get_rewards(self) -> Optional[QuerySet]:
-        """
-        Fetch the rewards snapshots for the pool position and snapshot.
-        """
-        try:
-            return PoolRewardsSnapshot.objects.filter(
-                pool_position=self.pool_position, snapshot=self.snapshot
-            )
-        except PoolBalanceSnapshot.DoesNotExist:
-            logging.warning(
-                ValueError(
-                    f"No balance found for pool {self.pool_position} in snapshot {self.snapshot}"
-                )
-            )
-            return None
-
     def _calculate_balance_eur(self) -> Optional[Decimal]:
         """
         Calculate the balance in EUR based on the current price.
         """
         if not self.balances:
             return None
-        balance_eu = 0
+        balance_eu = Decimal(0)
         for balance in self.balances:
-            current_price = get_last_price(balance.token.name, self.snapshot.date)
+            current_price = self.prices.get(balance.token.name, self.snapshot.date)
             balance_eu += balance.quantity * current_price
 
-        return Decimal(balance_eu)
+        return balance_eu
+
+
+def load_pool_data(
+    user_addresses: list,
+    snapshot: Snapshot,
+    prices: PriceBook,
+) -> List[PoolData]:
+    """
+    Loads the PoolData of every pool position of the user_addresses holding a
+    balance in the snapshot.
+    The balance and reward rows are fetched with one query each, with their
+    position, pool and token, and grouped in memory, so the number of queries
+    does not depend on the number of positions.
+    Args:
+        user_addresses (list): A list of UserAddress objects.
+        snapshot (Snapshot): The snapshot to read.
+        prices (PriceBook): The prices valuing the balances.
+    Returns:
+        list: The PoolData of each position, in position order.
+    """
+    balances = PoolBalanceSnapshot.objects.filter(
+        pool_position__user_address__in=user_addresses, snapshot=snapshot
+    ).select_related(
+        "token",
+        "pool_position__user_address",
+        "pool_position__pool__type",
+        "pool_position__pool__protocol_network__protocol",
+        "pool_position__pool__protocol_network__network",
+    )
+    rewards = PoolRewardsSnapshot.objects.filter(
+        pool_position__user_address__in=user_addresses, snapshot=snapshot
+    ).select_related("token")
+
+    positions: Dict[int, PoolPosition] = {}
+    balances_by_position: Dict[int, List[PoolBalanceSnapshot]] = defaultdict(list)
+    for balance in balances:
+        positions.setdefault(balance.pool_position_id, balance.pool_position)
+        balances_by_position[balance.pool_position_id].append(balance)
+    rewards_by_position: Dict[int, List[PoolRewardsSnapshot]] = defaultdict(list)
+    for reward in rewards:
+        rewards_by_position[reward.pool_position_id].append(reward)
+
+    return [
+        PoolData(
+            positions[position_id],
+            snapshot,
+            prices,
+            balances_by_position[position_id],
+            rewards_by_position[position_id],
+        )
+        for position_id in sorted(positions)
+    ]
 
 
 def get_protocols_snapshots(
-    user_addresses: list, snapshot: Optional[Snapshot] = None
+    user_addresses: list,
+    snapshot: Optional[Snapshot] = None,
+    prices: Optional[PriceBook] = None,
 ) -> dict:
     """
     Fetches the last snapshot of the protocols in the database.
-
+    The pool balances are valued with the given PriceBook, or one loaded for
+    the snapshot.
     """
     if snapshot is None:
         snapshot = Snapshot.objects.first()
 
-    user_pools = PoolPosition.objects.filter(user_address__in=user_addresses)
-
-    if not user_pools or not snapshot:
-        logging.warning("No user pools or last snapshot found.")
+    if not snapshot:
+        logging.warning("No last snapshot found.")
         return {"pool_data": {}, "troves": []}
 
-    pool_data = []
-
-    for pool_position in user_pools:
-        data = PoolData(pool_position, snapshot)
-        if data.balances:
-            pool_data.append(data)
+    prices = prices or PriceBook(snapshot)
+    pool_data = load_pool_data(user_addresses, snapshot, prices)
 
     troves = TroveSnapshot.objects.filter(
         trove__user_address__in=user_addresses,
         snapshot=snapshot,
-    )
+    ).select_related("trove__token")
 
     grouped_data = defaultdict(list)
 
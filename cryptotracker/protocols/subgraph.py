@@ -1,16 +1,83 @@
+import json
 import os
+from typing import Dict
 
 import requests
 
 import logging
 
+from cryptotracker.cache import ResponseCache, get_response_cache
+from cryptotracker.rpc import BlockIdentifier
+
 THE_GRAPH_API_KEY = os.environ.get("THE_GRAPH_API_KEY")
 
 
-def send_graphql_query(id: str, query: str, variables=None) -> dict:
+class SubgraphError(Exception):
+    """Raised when a subgraph query fails or returns GraphQL errors"""
+
+
+# Highest block number known to be indexed by each subgraph
+_indexed_blocks: Dict[str, int] = {}
+
+
+def get_indexed_block(id: str, block: BlockIdentifier) -> BlockIdentifier:
+    """
+    Returns the block at which to query a subgraph for a snapshot pinned at block:
+    the pinned block once the subgraph has indexed it, the last indexed block
+    otherwise, since The Graph rejects queries at blocks not indexed yet.
+    """
+    if not isinstance(block, int) or _indexed_blocks.get(id, -1) >= block:
+        return block
+    response = _send_graphql_query(id, "{ _meta { block { number } } }")
+    try:
+        indexed = int(response["data"]["_meta"]["block"]["number"])
+    except (KeyError, TypeError, ValueError) as e:
+        raise SubgraphError(f"Subgraph {id} returned no indexed block: {e}") from e
+    _indexed_blocks[id] = max(indexed, _indexed_blocks.get(id, -1))
+    if indexed < block:
+        logging.warning(
+            f"Subgraph {id} is indexed up to block {indexed}, behind block {block}"
+        )
+        return indexed
+    return block
+
+
+def block_filter(block: BlockIdentifier) -> str:
+    """
+    Returns the argument pinning a subgraph query to a block number, or an empty
+    string to query the latest indexed block.
+    """
+    if isinstance(block, int):
+        return f"block: {{number: {block}}},"
+    return ""
+
+
+def send_graphql_query(
+    id: str, query: str, variables=None, block: BlockIdentifier = "latest"
+) -> dict:
     """
     Sends a GraphQL query to The Graph API and returns the response as a dictionary.
+    Responses of queries pinned to a block number are served from the response cache.
+    Raises:
+        SubgraphError: If the request fails or the response contains GraphQL errors.
     """
+    if isinstance(block, int):
+        cache = get_response_cache()
+        key = ResponseCache.make_key(
+            f"subgraph:{id}",
+            block,
+            json.dumps([query, variables], sort_keys=True).encode(),
+        )
+        cached = cache.get(key, f"subgraph:{id}")
+        if cached is not None:
+            return json.loads(cached)
+        response = _send_graphql_query(id, query, variables)
+        cache.set(key, json.dumps(response).encode())
+        return response
+    return _send_graphql_query(id, query, variables)
+
+
+def _send_graphql_query(id: str, query: str, variables=None) -> dict:
     url = f"https://gateway.thegraph.com/api/subgraphs/id/{id}"
 
     headers = {
@@ -26,23 +93,14 @@ def send_graphql_query(id: str, query: str, variables=None) -> dict:
     try:
         logging.debug(f"Sending GraphQL query to {url} with payload: {payload}")
         response = requests.post(url, headers=headers, json=payload)
-        logging.debug(f"Received response: {response.json()}")
         response.raise_for_status()
-        if "errors" in response.json():
-            logging.error(f"GraphQL errors: {response.json()['errors']}")
-            return {}
-        return response.json()
-
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"HTTP error occurred: {e} - Status Code: {response.status_code}")
-    except requests.exceptions.ConnectionError:
-        logging.error("Error connecting to the API.")
-    except requests.exceptions.Timeout:
-        logging.error("The request timed out.")
+        data = response.json()
     except requests.exceptions.RequestException as e:
-        logging.error(f"An error occurred: {e}")
-    except Exception as e:
-        logging.error(f"Unexpected error: {e}")
+        raise SubgraphError(f"Subgraph {id} request failed: {e}") from e
+    except ValueError as e:
+        raise SubgraphError(f"Subgraph {id} returned invalid JSON: {e}") from e
 
-    # Return an empty dictionary in case of an error
-    return {}
+    logging.debug(f"Received response: {data}")
+    if "errors" in data:
+        raise SubgraphError(f"Subgraph {id} GraphQL errors: {data['errors']}")
+    return data
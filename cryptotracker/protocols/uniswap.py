@@ -1,13 +1,25 @@
 import logging
-from cryptotracker.constants import NETWORKS, POOL_TYPES, PROTOCOLS_DATA
+from typing import Optional
+
+from cryptotracker.constants import ETHEREUM_RPC, NETWORKS, POOL_TYPES, PROTOCOLS_DATA
 from cryptotracker.models import Cryptocurrency, Pool, Snapshot, UserAddress
 from cryptotracker.protocols.protocols import save_pool_snapshot
-from cryptotracker.protocols.subgraph import send_graphql_query
+from cryptotracker.protocols.subgraph import (
+    block_filter,
+    get_indexed_block,
+    send_graphql_query,
+)
+from cryptotracker.snapshots import get_snapshot_block
+from cryptotracker.writer import SnapshotWriter, snapshot_writer
 
 UNISWAP_V3_SUBGRAPH_ID = "5zvR82QoaXYFyDEKLZ9t6v9adgnptxYpKpSbxtgVENFV"
 
 
-def update_uniswap_v3_positions(user_address: UserAddress, snapshot: Snapshot) -> None:
+def update_uniswap_v3_positions(
+    user_address: UserAddress,
+    snapshot: Snapshot,
+    writer: Optional[SnapshotWriter] = None,
+) -> None:
     """Query all the troves for a given user_address using The Graph API and save snapshots"""
     logging.info("Quering Uniswap v3 subgraph")
 
@@ -17,9 +29,13 @@ def update_uniswap_v3_positions(user_address: UserAddress, snapshot: Snapshot) -
         protocol_network__network__name=NETWORKS["ETHEREUM"]["name"],
     )
 
+    block = get_indexed_block(
+        UNISWAP_V3_SUBGRAPH_ID, get_snapshot_block(snapshot, ETHEREUM_RPC)
+    )
     query = f"""
     {{
         positions(
+            {block_filter(block)}
             where: {{
                 owner: "{user_address.public_address}",
                 liquidity_gt: "0"}}
@@ -42,7 +58,7 @@ def update_uniswap_v3_positions(user_address: UserAddress, snapshot: Snapshot) -
     }}
     """
 
-    response = send_graphql_query(UNISWAP_V3_SUBGRAPH_ID, query)
+    response = send_graphql_query(UNISWAP_V3_SUBGRAPH_ID, query, block=block)
 
     if not response or "data" not in response or "positions" not in response["data"]:
         return None
@@ -50,26 +66,31 @@ def update_uniswap_v3_positions(user_address: UserAddress, snapshot: Snapshot) -
     positions = response["data"]["positions"]
     logging.info(f"Found UNISWAP {positions} positions")
 
-    for position in positions:
-        for key in [0, 1]:
-            token = Cryptocurrency.objects.get(symbol=position[f"token{key}"]["symbol"])
-            logging.info(f"Position: {position} Token: {token.symbol}")
-            if position[f"depositedToken{key}"] != "0":
-                save_pool_snapshot(
-                    pool=UNISWAP_LENDING_POOL,
-                    address=user_address,
-                    token_symbol=token.symbol,
-                    quantity=position[f"depositedToken{key}"],
-                    snapshot=snapshot,
-                    pool_id=str(position["id"]),
-                )
-            if position[f"collectedFeesToken{key}"] != "0":
-                save_pool_snapshot(
-                    pool=UNISWAP_LENDING_POOL,
-                    address=user_address,
-                    token_symbol=token.symbol,
-                    quantity=position[f"collectedFeesToken{key}"],
-                    snapshot=snapshot,
-                    is_reward=True,
-                    pool_id=str(position["id"]),
+    with snapshot_writer(snapshot, writer) as writer:
+        for position in positions:
+            for key in [0, 1]:
+                token = Cryptocurrency.objects.get(
+                    symbol=position[f"token{key}"]["symbol"]
                 )
+                logging.info(f"Position: {position} Token: {token.symbol}")
+                if position[f"depositedToken{key}"] != "0":
+                    save_pool_snapshot(
+                        pool=UNISWAP_LENDING_POOL,
+                        address=user_address,
+                        token_symbol=token.symbol,
+                        quantity=position[f"depositedToken{key}"],
+                        snapshot=snapshot,
+                        pool_id=str(position["id"]),
+                        writer=writer,
+                    )
+                if position[f"collectedFeesToken{key}"] != "0":
+                    save_pool_snapshot(
+                        pool=UNISWAP_LENDING_POOL,
+                        address=user_address,
+                        token_symbol=token.symbol,
+                        quantity=position[f"collectedFeesToken{key}"],
+                        snapshot=snapshot,
+                        is_reward=True,
+                        pool_id=str(position["id"]),
+                        writer=writer,
+                    )
@@ -0,0 +1,321 @@
+import itertools
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import backoff
+import requests
+from ape import networks
+from eth_abi import encode
+from eth_utils import function_signature_to_4byte_selector, to_hex
+from hexbytes import HexBytes
+from requests.adapters import HTTPAdapter
+
+from cryptotracker.cache import ResponseCache, get_response_cache
+from cryptotracker.utils import log_backoff
+
+# Timeout in seconds of a JSON-RPC HTTP request
+DEFAULT_RPC_TIMEOUT = 20
+
+# Number of keep-alive connections kept open per endpoint
+RPC_POOL_SIZE = 10
+
+# Maximum number of calls sent in one JSON-RPC batch array
+MAX_BATCH_SIZE = 100
+
+BlockIdentifier = Union[int, str]
+
+# Function signatures of the selectors encoded by encode_call, used to report
+# the response cache statistics per call signature
+_signatures: Dict[bytes, str] = {}
+
+
+class RPCError(Exception):
+    """
+    Raised when a JSON-RPC call returns an error object.
+    """
+
+    def __init__(self, method: str, error: Dict[str, Any]):
+        self.method = method
+        self.code = error.get("code")
+        super().__init__(f"{method} failed: {error.get('message')} ({self.code})")
+
+
+class RPCStats:
+    """
+    Call counts and latencies of a JSON-RPC client, per method.
+    """
+
+    def __init__(self) -> None:
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.requests = 0
+        self.latency = 0.0
+
+    def record(self, methods: Sequence[str], elapsed: float) -> None:
+        self.requests += 1
+        self.latency += elapsed
+        for method in methods:
+            self.calls[method] += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "calls": dict(self.calls),
+            "errors": dict(self.errors),
+            "latency": round(self.latency, 3),
+            "avg_latency": (
+                round(self.latency / self.requests, 3) if self.requests else 0.0
+            ),
+        }
+
+
+def block_param(block: BlockIdentifier) -> str:
+    """
+    Formats a block number or tag as a JSON-RPC block parameter.
+    """
+    return hex(block) if isinstance(block, int) else block
+
+
+class RPCClient:
+    """
+    Thin JSON-RPC client for plain reads that need no Ape features.
+    Keeps the HTTP connections of its endpoint alive and packs several calls
+    in JSON-RPC batch arrays.
+    eth_calls made at a block number are served from the response cache when
+    the same call was already made at that block.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        timeout: float = DEFAULT_RPC_TIMEOUT,
+        pool_size: int = RPC_POOL_SIZE,
+        chain: Optional[str] = None,
+        cache: Optional[ResponseCache] = None,
+    ):
+        self.url = url
+        self.chain = chain or url
+        self._cache = cache
+        self.timeout = timeout
+        self.stats = RPCStats()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._ids = itertools.count(1)
+
+    @backoff.on_exception(
+        backoff.expo,
+        requests.exceptions.RequestException,
+        max_tries=3,
+        max_time=60,
+        on_backoff=log_backoff,
+    )
+    def _post(self, payload: Union[Dict, List[Dict]], methods: List[str]) -> Any:
+        start = time.perf_counter()
+        response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        self.stats.record(methods, time.perf_counter() - start)
+        response.raise_for_status()
+        return response.json()
+
+    def _payload(self, method: str, params: List[Any]) -> Dict[str, Any]:
+        return {
+            "jsonrpc": "2.0",
+            "id": next(self._ids),
+            "method": method,
+            "params": params,
+        }
+
+    def request(self, method: str, params: List[Any]) -> Any:
+        """
+        Sends a single JSON-RPC call and returns its result.
+        """
+        response = self._post(self._payload(method, params), [method])
+        if "error" in response:
+            self.stats.errors[method] += 1
+            raise RPCError(method, response["error"])
+        return response["result"]
+
+    def batch(
+        self, calls: Sequence[Tuple[str, List[Any]]], allow_failure: bool = False
+    ) -> List[Any]:
+        """
+        Sends the calls in JSON-RPC batch arrays of at most MAX_BATCH_SIZE calls.
+        Args:
+            calls (list): A list of (method, params) tuples.
+            allow_failure (bool): Return None for failed calls instead of raising RPCError.
+        Returns:
+            list: The result of each call, in the same order.
+        """
+        results: List[Any] = []
+        for start in range(0, len(calls), MAX_BATCH_SIZE):
+            chunk = calls[start : start + MAX_BATCH_SIZE]
+            payloads = [self._payload(method, params) for method, params in chunk]
+            response = self._post(payloads, [method for method, _ in chunk])
+            if not isinstance(response, list):
+                # The endpoint rejected the whole batch with a single error object
+                for payload in payloads:
+                    self.stats.errors[payload["method"]] += 1
+                raise RPCError("batch", response.get("error") or {})
+            by_id = {item.get("id"): item for item in response}
+            for payload in payloads:
+                item = by_id.get(payload["id"], {"error": {"message": "missing"}})
+                if "error" in item:
+                    self.stats.errors[payload["method"]] += 1
+                    error = RPCError(payload["method"], item["error"])
+                    if not allow_failure:
+                        raise error
+                    logging.warning(str(error))
+                    results.append(None)
+                    continue
+                results.append(item["result"])
+        return results
+
+    @property
+    def cache(self) -> ResponseCache:
+        if self._cache is None:
+            self._cache = get_response_cache()
+        return self._cache
+
+    def _call_key(self, to: str, data: bytes, block: int) -> str:
+        return ResponseCache.make_key(self.chain, block, HexBytes(to) + data)
+
+    def eth_call(
+        self, to: str, data: bytes, block: BlockIdentifier = "latest"
+    ) -> bytes:
+        """
+        Executes an eth_call with pre-encoded calldata and returns the raw result.
+        """
+        if isinstance(block, int):
+            key = self._call_key(to, data, block)
+            cached = self.cache.get(key, call_signature(data))
+            if cached is not None:
+                return cached
+        result = bytes(
+            HexBytes(
+                self.request(
+                    "eth_call", [{"to": to, "data": to_hex(data)}, block_param(block)]
+                )
+            )
+        )
+        if isinstance(block, int):
+            self.cache.set(key, result)
+        return result
+
+    def batch_eth_call(
+        self,
+        calls: Sequence[Tuple[str, bytes]],
+        block: BlockIdentifier = "latest",
+        allow_failure: bool = False,
+    ) -> List[Optional[bytes]]:
+        """
+        Executes several eth_calls with pre-encoded calldata in JSON-RPC batches.
+        Only the calls missing from the response cache are sent when reading at a
+        block number.
+        Args:
+            calls (list): A list of (to, calldata) tuples.
+            block (int|str): The block number or tag to read at.
+            allow_failure (bool): Return None for reverted calls instead of raising RPCError.
+        Returns:
+            list: The raw result of each call.
+        """
+        results: List[Optional[bytes]] = [None] * len(calls)
+        pending = list(range(len(calls)))
+        if isinstance(block, int):
+            keys = [self._call_key(to, data, block) for to, data in calls]
+            pending = []
+            for index, (_, data) in enumerate(calls):
+                results[index] = self.cache.get(keys[index], call_signature(data))
+                if results[index] is None:
+                    pending.append(index)
+
+        responses = self.batch(
+            [
+                (
+                    "eth_call",
+                    [
+                        {"to": calls[index][0], "data": to_hex(calls[index][1])},
+                        block_param(block),
+                    ],
+                )
+                for index in pending
+            ],
+            allow_failure=allow_failure,
+        )
+        for index, response in zip(pending, responses):
+            if response is None:
+                continue
+            result = bytes(HexBytes(response))
+            results[index] = result
+            if isinstance(block, int):
+                self.cache.set(keys[index], result)
+        return results
+
+    def eth_get_balance(self, address: str, block: BlockIdentifier = "latest") -> int:
+        return int(self.request("eth_getBalance", [address, block_param(block)]), 16)
+
+    def get_code(self, address: str, block: BlockIdentifier = "latest") -> bytes:
+        return bytes(
+            HexBytes(self.request("eth_getCode", [address, block_param(block)]))
+        )
+
+
+def encode_call(signature: str, *args: Any) -> bytes:
+    """
+    Encodes the calldata of a contract call from its signature.
+    Args:
+        signature (str): The function signature, e.g. "balanceOf(address)".
+        args: The arguments of the call.
+    Returns:
+        bytes: The 4-byte selector followed by the ABI encoded arguments.
+    """
+    arg_types = signature[signature.index("(") + 1 : -1]
+    types = arg_types.split(",") if arg_types else []
+    selector = function_signature_to_4byte_selector(signature)
+    _signatures.setdefault(selector, signature)
+    return selector + encode(types, list(args))
+
+
+def call_signature(data: bytes) -> str:
+    """
+    Returns the function signature of encoded calldata, or its selector when the
+    calldata was not encoded by encode_call.
+    """
+    return _signatures.get(data[:4], to_hex(data[:4]))
+
+
+_clients: Dict[str, RPCClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_rpc_client(
+    network_choice: str, timeout: float = DEFAULT_RPC_TIMEOUT
+) -> RPCClient:
+    """
+    Returns the shared JSON-RPC client of a network, resolving its endpoint
+    from the Ape provider configuration without connecting the provider.
+    Args:
+        network_choice (str): The Ape network choice, e.g. "ethereum:mainnet:alchemy".
+        timeout (float): The request timeout of the endpoint.
+    Returns:
+        RPCClient: The client of the network endpoint.
+    """
+    with _clients_lock:
+        if network_choice not in _clients:
+            provider = networks.get_provider_from_choice(network_choice)
+            if not provider.http_uri:
+                raise ValueError(f"No HTTP endpoint configured for {network_choice}")
+            _clients[network_choice] = RPCClient(
+                provider.http_uri, timeout=timeout, chain=network_choice
+            )
+        return _clients[network_choice]
+
+
+def get_rpc_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the call counts and latencies of every JSON-RPC client of this process.
+    """
+    return {choice: client.stats.as_dict() for choice, client in _clients.items()}
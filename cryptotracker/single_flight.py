@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+
+# Prefix of the keys stored in Redis
+REDIS_KEY_PREFIX = "cryptotracker:flight:"
+
+
+class SingleFlight:
+    """
+    Registry of the in-flight runs, each claimed under a key by the ID of the
+    task group doing the work, so concurrent callers attach to that group
+    instead of starting the same work again.
+    Claims live in Redis when a URL is configured, shared by the web processes
+    and the workers, and in this process otherwise. Claims expire after a TTL
+    so a run that died without releasing its claim does not block new runs.
+    """
+
+    def __init__(self, redis_url: Optional[str] = None, ttl: int = 3600):
+        self.ttl = ttl
+        self._claims: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self._redis: Any = None
+        if redis_url:
+            import redis
+
+            self._redis = redis.Redis.from_url(redis_url)
+
+    def claim(self, key: str, value: str) -> Optional[str]:
+        """
+        Claims a key for a run, unless another run holds it.
+        Args:
+            key (str): The key of the work.
+            value (str): The ID of the task group of the run.
+        Returns:
+            str: The ID of the run holding the key, None if the claim succeeded.
+        """
+        if self._redis is not None:
+            try:
+                if self._redis.set(REDIS_KEY_PREFIX + key, value, nx=True, ex=self.ttl):
+                    return None
+                holder = self._redis.get(REDIS_KEY_PREFIX + key)
+                return holder.decode() if holder is not None else self.claim(key, value)
+            except Exception as e:
+                logging.warning(f"Single flight Redis unavailable: {e}")
+                self._redis = None
+
+        with self._lock:
+            holder = self._holder(key)
+            if holder is not None:
+                return holder
+            self._claims[key] = (value, time.monotonic() + self.ttl)
+            return None
+
+    def holder(self, key: str) -> Optional[str]:
+        """
+        Returns the ID of the run holding a key, None if the key is free.
+        """
+        if self._redis is not None:
+            try:
+                holder = self._redis.get(REDIS_KEY_PREFIX + key)
+                return holder.decode() if holder is not None else None
+            except Exception as e:
+                logging.warning(f"Single flight Redis unavailable: {e}")
+                self._redis = None
+
+        with self._lock:
+            return self._holder(key)
+
+    def release(self, key: str, value: str) -> None:
+        """
+        Releases the claim of a run on a key, if it still holds it.
+        Args:
+            key (str): The key of the work.
+            value (str): The ID of the task group of the run.
+        """
+        if self._redis is not None:
+            try:
+                holder = self._redis.get(REDIS_KEY_PREFIX + key)
+                if holder is not None and holder.decode() == value:
+                    self._redis.delete(REDIS_KEY_PREFIX + key)
+                return
+            except Exception as e:
+                logging.warning(f"Single flight Redis unavailable: {e}")
+                self._redis = None
+
+        with self._lock:
+            if self._holder(key) == value:
+                del self._claims[key]
+
+    def _holder(self, key: str) -> Optional[str]:
+        claim = self._claims.get(key)
+        if claim is None:
+            return None
+        value, expires = claim
+        if expires <= time.monotonic():
+            del self._claims[key]
+            return None
+        return value
+
+
+_single_flight: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """
+    Returns the single flight registry of this process, configured from the settings.
+    """
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight(
+                redis_url=settings.SNAPSHOT_LOCK_REDIS_URL,
+                ttl=settings.SNAPSHOT_LOCK_TTL,
+            )
+        return _single_flight
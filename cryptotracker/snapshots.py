@@ -0,0 +1,357 @@
+import logging
+import threading
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Count, F, Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from sortedcontainers import SortedDict
+
+from cryptotracker.constants import REFRESH_SOURCES
+from cryptotracker.models import (
+    Network,
+    Snapshot,
+    SnapshotBlock,
+    SnapshotSource,
+    SnapshotUnit,
+    UserSnapshot,
+)
+from cryptotracker.rpc import BlockIdentifier, get_rpc_client
+
+
+def fetch_block_number(network_choice: str, finalized: bool = False) -> int:
+    """
+    Fetches the current head (or last finalized) block number of a network.
+    Args:
+        network_choice (str): The Ape network choice of the network.
+        finalized (bool): Whether to return the last finalized block.
+    Returns:
+        int: The block number.
+    """
+    client = get_rpc_client(network_choice)
+    if finalized:
+        block = client.request("eth_getBlockByNumber", ["finalized", False])
+        return int(block["number"], 16)
+    return int(client.request("eth_blockNumber", []), 16)
+
+
+def pin_snapshot_blocks(snapshot: Snapshot) -> Dict[str, int]:
+    """
+    Resolves and records one block number per network for the snapshot, so every
+    source of the snapshot is read at the same block.
+    Networks whose block cannot be resolved are read at the latest block.
+    Args:
+        snapshot (Snapshot): The Snapshot to pin.
+    Returns:
+        dict: The pinned block numbers keyed by network choice.
+    """
+    finalized = settings.SNAPSHOT_FINALIZED_BLOCKS
+    blocks: Dict[str, int] = {}
+    snapshot_blocks = []
+    for network in Network.objects.all():
+        if not network.url_rpc:
+            continue
+        try:
+            block_number = fetch_block_number(network.url_rpc, finalized=finalized)
+        except Exception as e:
+            logging.error(f"Could not pin the block of network {network.name}: {e}")
+            continue
+        blocks[network.url_rpc] = block_number
+        snapshot_blocks.append(
+            SnapshotBlock(snapshot=snapshot, network=network, block_number=block_number)
+        )
+    SnapshotBlock.objects.bulk_create(snapshot_blocks)
+    logging.info(f"Snapshot {snapshot.id} pinned at blocks {blocks}")
+    return blocks
+
+
+def snapshot_covers(
+    snapshot: Snapshot,
+    user_address_ids: Iterable[int],
+    sources: Optional[Iterable[str]] = None,
+) -> bool:
+    """
+    Returns whether the snapshot fetched the given parts of REFRESH_SOURCES of
+    the user_addresses, instead of carrying them forward from an older snapshot.
+    A user_address without units in the snapshot, e.g. added after it was
+    taken, is not covered.
+    Args:
+        snapshot (Snapshot): The snapshot.
+        user_address_ids (iterable): The IDs of the user_addresses.
+        sources (iterable, optional): The parts of REFRESH_SOURCES, all if not provided.
+    Returns:
+        bool: True if the snapshot fetched all of them.
+    """
+    if snapshot.refreshed_sources is not None and not set(
+        sources or REFRESH_SOURCES
+    ) <= set(snapshot.refreshed_sources):
+        return False
+    ids = set(user_address_ids)
+    if snapshot.refreshed_addresses is not None:
+        return ids <= set(snapshot.refreshed_addresses)
+    return ids <= set(
+        SnapshotUnit.objects.filter(
+            snapshot=snapshot, user_address__in=ids
+        ).values_list("user_address", flat=True)
+    )
+
+
+def get_snapshot_blocks(snapshot: Snapshot) -> Dict[str, int]:
+    """
+    Returns the pinned block numbers of a snapshot keyed by network choice.
+    """
+    return {
+        network_choice: block_number
+        for network_choice, block_number in SnapshotBlock.objects.filter(
+            snapshot=snapshot
+        ).values_list("network__url_rpc", "block_number")
+        if network_choice
+    }
+
+
+def get_snapshot_block(snapshot: Snapshot, network_choice: str) -> BlockIdentifier:
+    """
+    Returns the block at which the snapshot reads a network, "latest" if not pinned.
+    """
+    return get_snapshot_blocks(snapshot).get(network_choice, "latest")
+
+
+class SnapshotIndex:
+    """
+    In-process index of the complete snapshots sorted by calendar day, resolving
+    the snapshot of a day, or the nearest earlier one, in O(log n) without
+    querying the snapshot table.
+    Each lookup checks the last completion time with one indexed query and only
+    loads the snapshots completed since, so snapshots finished by the workers
+    are seen by the web processes.
+    """
+
+    def __init__(self):
+        # Last snapshot of each day
+        self._days: SortedDict = SortedDict()
+        self._last_completed: Optional[datetime] = None
+        self._lock = threading.Lock()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._days.clear()
+            self._last_completed = None
+
+    def _sync(self) -> None:
+        last_completed = Snapshot.objects.aggregate(last_completed=Max("completed_at"))[
+            "last_completed"
+        ]
+        with self._lock:
+            if last_completed == self._last_completed:
+                return
+            snapshots = Snapshot.objects.filter(status=Snapshot.COMPLETE)
+            if self._last_completed is not None and last_completed is not None:
+                snapshots = snapshots.filter(completed_at__gt=self._last_completed)
+            else:
+                self._days.clear()
+            for snapshot in snapshots:
+                current = self._days.get(snapshot.day)
+                if current is None or snapshot.date >= current.date:
+                    self._days[snapshot.day] = snapshot
+            self._last_completed = last_completed
+
+    def latest(self) -> Optional[Snapshot]:
+        """
+        Returns the most recent complete snapshot, None if there is none.
+        """
+        self._sync()
+        with self._lock:
+            return self._days.peekitem(-1)[1] if self._days else None
+
+    def at_or_before(self, day: date) -> Optional[Snapshot]:
+        """
+        Returns the last complete snapshot taken on the day, or the nearest
+        earlier one.
+        Args:
+            day (date): The calendar date to resolve.
+        Returns:
+            Snapshot: The snapshot, None if no snapshot was taken on or before the day.
+        """
+        self._sync()
+        with self._lock:
+            index = self._days.bisect_right(day)
+            return self._days.peekitem(index - 1)[1] if index else None
+
+
+snapshot_index = SnapshotIndex()
+
+
+@receiver(post_save, sender=Snapshot)
+@receiver(post_delete, sender=Snapshot)
+def clear_snapshot_index(sender, **kwargs) -> None:
+    snapshot_index.clear()
+
+
+def record_user_snapshots(snapshot: Snapshot, user_ids: Iterable[int]) -> None:
+    """
+    Records the snapshot as holding the complete data of the users, once every
+    task writing their rows has finished.
+    Args:
+        snapshot (Snapshot): The finished snapshot.
+        user_ids (iterable): The IDs of the users covered by the snapshot.
+    """
+    UserSnapshot.objects.bulk_create(
+        [
+            UserSnapshot(user_id=user_id, snapshot=snapshot, day=snapshot.day)
+            for user_id in set(user_ids)
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def get_user_snapshot(user: User, day: Optional[date] = None) -> Optional[Snapshot]:
+    """
+    Returns the last snapshot holding the complete data of a user, taken on or
+    before the day if given, with one keyed lookup.
+    Users without any recorded snapshot fall back to the global snapshots.
+    Args:
+        user (User): The user.
+        day (date, optional): The calendar date to resolve, the last snapshot if not provided.
+    Returns:
+        Snapshot: The snapshot, None if there is none.
+    """
+    user_snapshots = UserSnapshot.objects.filter(user=user)
+    if day is not None:
+        user_snapshots = user_snapshots.filter(day__lte=day)
+    user_snapshot = (
+        user_snapshots.select_related("snapshot")
+        .order_by("-day", "-snapshot_id")
+        .first()
+    )
+    if user_snapshot is not None:
+        return user_snapshot.snapshot
+    if UserSnapshot.objects.filter(user=user).exists():
+        return None
+    return snapshot_index.latest() if day is None else snapshot_index.at_or_before(day)
+
+
+def start_snapshot_source(
+    snapshot: Snapshot, source: str, user_address_ids: Optional[List[int]] = None
+) -> None:
+    """
+    Registers the units a source of the snapshot will process, one per
+    user_address or a single one for the prices, and marks a pending snapshot
+    as running.
+    Args:
+        snapshot (Snapshot): The snapshot being written.
+        source (str): The source, one of SnapshotSource.SOURCES.
+        user_address_ids (list, optional): The IDs of the user_addresses of the
+            source, a single unit without user_address if not provided.
+    """
+    units = [None] if user_address_ids is None else user_address_ids
+    SnapshotUnit.objects.bulk_create(
+        [
+            SnapshotUnit(snapshot=snapshot, source=source, user_address_id=unit)
+            for unit in units
+        ],
+        ignore_conflicts=True,
+    )
+    SnapshotSource.objects.update_or_create(
+        snapshot=snapshot, source=source, defaults={"expected": len(units)}
+    )
+    Snapshot.objects.filter(id=snapshot.id, status=Snapshot.PENDING).update(
+        status=Snapshot.RUNNING
+    )
+
+
+def mark_snapshot_units(
+    snapshot: Snapshot,
+    source: str,
+    status: str,
+    user_address_ids: Optional[List[int]] = None,
+) -> None:
+    """
+    Sets the status of units of a source of the snapshot after an attempt.
+    Args:
+        snapshot (Snapshot): The snapshot being written.
+        source (str): The source, one of SnapshotSource.SOURCES.
+        status (str): The status of the attempt, one of SnapshotUnit.STATUSES.
+        user_address_ids (list, optional): The IDs of the user_addresses of the
+            units, the unit without user_address if not provided.
+    """
+    units = SnapshotUnit.objects.filter(snapshot=snapshot, source=source)
+    if user_address_ids is None:
+        units = units.filter(user_address__isnull=True)
+    elif not user_address_ids:
+        return
+    else:
+        units = units.filter(user_address_id__in=user_address_ids)
+    units.update(status=status, attempts=F("attempts") + 1)
+
+
+def get_unfinished_units(snapshot: Snapshot) -> Dict[str, List[Optional[int]]]:
+    """
+    Returns the units of the snapshot that are pending or failed, to run again.
+    Args:
+        snapshot (Snapshot): The snapshot.
+    Returns:
+        dict: The user_address IDs of the units keyed by source, None for a
+            unit without user_address.
+    """
+    units: Dict[str, List[Optional[int]]] = {}
+    for source, user_address_id in (
+        snapshot.units.exclude(status=SnapshotUnit.SUCCEEDED)
+        .order_by("source", "user_address_id")
+        .values_list("source", "user_address_id")
+    ):
+        units.setdefault(source, []).append(user_address_id)
+    return units
+
+
+def count_snapshot_units(snapshot: Snapshot) -> None:
+    """
+    Sets the counters of the sources of the snapshot from the status of their
+    units, with one grouped query.
+    """
+    counters: Dict[str, Dict[str, int]] = {}
+    for source, status, count in (
+        snapshot.units.values_list("source", "status")
+        .annotate(count=Count("id"))
+        .order_by()
+    ):
+        counters.setdefault(source, {})[status] = count
+    for source, counts in counters.items():
+        SnapshotSource.objects.filter(snapshot=snapshot, source=source).update(
+            succeeded=counts.get(SnapshotUnit.SUCCEEDED, 0),
+            failed=counts.get(SnapshotUnit.FAILED, 0),
+        )
+
+
+def finalize_snapshot(snapshot: Snapshot) -> str:
+    """
+    Sets the final status of the snapshot once all its tasks have finished:
+    complete if every source processed all its units without errors, partial
+    otherwise. The counters of the sources are first counted from their units.
+    Args:
+        snapshot (Snapshot): The finished snapshot.
+    Returns:
+        str: The final status.
+    """
+    count_snapshot_units(snapshot)
+    sources = {source.source: source for source in snapshot.sources.all()}
+    complete = all(
+        name in sources
+        and not sources[name].failed
+        and sources[name].succeeded >= sources[name].expected
+        for name, _ in SnapshotSource.SOURCES
+    )
+    snapshot.status = Snapshot.COMPLETE if complete else Snapshot.PARTIAL
+    snapshot.completed_at = timezone.now() if complete else None
+    snapshot.save(update_fields=["status", "completed_at"])
+    logging.info(
+        f"Snapshot {snapshot.id} {snapshot.status}: "
+        + ", ".join(
+            f"{name} {source.succeeded}/{source.expected} ({source.failed} failed)"
+            for name, source in sources.items()
+        )
+    )
+    return snapshot.status
@@ -1,178 +1,955 @@
+import hashlib
 import logging
 
-from datetime import datetime
-from typing import Optional
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
 
-from celery import shared_task, group
+from celery import Task, chord, shared_task, group
 from celery.exceptions import TimeoutError
+from celery.result import GroupResult
+from celery.utils import uuid
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils import timezone
 
-from cryptotracker.models import Cryptocurrency, Price, Snapshot, UserAddress
-from cryptotracker.protocols.aave import update_aave_lending_pools
-from cryptotracker.protocols.liquity_pools import update_lqty_pools
+from cryptotracker.backfill import backfill_prices
+from cryptotracker.cache import get_response_cache
+from cryptotracker.constants import REFRESH_SOURCES
+from cryptotracker.chain_pool import ChainPool
+from cryptotracker.models import (
+    Cryptocurrency,
+    Network,
+    Snapshot,
+    SnapshotUnit,
+    UserAddress,
+)
+from cryptotracker.protocols.aave import update_aave_lending_pools_batch
+from cryptotracker.protocols.liquity_pools import (
+    update_lqty_pools,
+    update_trove_balances,
+)
 from cryptotracker.protocols.uniswap import update_uniswap_v3_positions
 from cryptotracker.eth_staking import fetch_staking_assets
-from cryptotracker.tokens import fetch_assets
-from cryptotracker.utils import fetch_cryptocurrency_price
+from cryptotracker.rpc import get_rpc_stats
+from cryptotracker.single_flight import get_single_flight
+from cryptotracker.snapshots import (
+    finalize_snapshot,
+    get_unfinished_units,
+    get_user_snapshot,
+    mark_snapshot_units,
+    pin_snapshot_blocks,
+    record_user_snapshots,
+    snapshot_covers,
+    start_snapshot_source,
+)
+from cryptotracker.tokens import fetch_assets_batch
+from cryptotracker.utils import (
+    PriceBook,
+    fetch_cryptocurrency_price,
+    fetch_historical_price,
+    historical_price_cache,
+)
+from cryptotracker.valuation import (
+    materialize_portfolio_values,
+    rematerialize_portfolio_values,
+)
+from cryptotracker.writer import SnapshotWriter, carry_forward_rows, delete_unit_rows
+
+
+def get_network_choices() -> List[str]:
+    """
+    Returns the Ape network choice of every network with a configured RPC.
+    """
+    return [network.url_rpc for network in Network.objects.all() if network.url_rpc]
+
+
+def get_user_address_ids(user_id: Optional[int]) -> List[int]:
+    """
+    Returns the IDs of the user_addresses of a user, of every user if not provided.
+    """
+    if user_id is None:
+        logging.info("Automated daily snapshot update initiated.")
+        user_addresses = UserAddress.objects.all()
+    else:
+        logging.info(f"User initiated a daily snapshot update with user ID: {user_id}")
+        user_addresses = UserAddress.objects.filter(user_id=user_id)
+    return list(user_addresses.order_by("id").values_list("id", flat=True))
+
+
+def source_outcome(source: str, succeeded: list, failed: list) -> Dict[str, Any]:
+    """
+    Returns the outcome of a subtask of the snapshot run, collected by its finalizer.
+    Args:
+        source (str): The source, one of SnapshotSource.SOURCES.
+        succeeded (list): The units processed, e.g. user_address IDs.
+        failed (list): The units that failed.
+    Returns:
+        dict: The JSON serializable outcome.
+    """
+    return {"source": source, "succeeded": succeeded, "failed": failed}
+
+
+def finish_snapshot_units(
+    task: Task,
+    snapshot: Snapshot,
+    source: str,
+    succeeded: List[int],
+    failed: List[int],
+) -> Dict[str, Any]:
+    """
+    Records the status of the units processed by a subtask of the snapshot run
+    and retries the subtask with the failed units only, with an exponential
+    backoff, until the task runs out of retries.
+    Args:
+        task (Task): The bound subtask, called with the snapshot ID and the
+            user_address IDs of its units.
+        snapshot (Snapshot): The snapshot being written.
+        source (str): The source, one of SnapshotSource.SOURCES.
+        succeeded (list): The IDs of the user_addresses processed.
+        failed (list): The IDs of the user_addresses that failed.
+    Returns:
+        dict: The outcome of the subtask.
+    """
+    mark_snapshot_units(snapshot, source, SnapshotUnit.SUCCEEDED, succeeded)
+    mark_snapshot_units(snapshot, source, SnapshotUnit.FAILED, failed)
+    retries = task.request.retries
+    if failed and not task.request.called_directly and retries < task.max_retries:
+        countdown = settings.SNAPSHOT_RETRY_BACKOFF * 2**retries
+        logging.warning(
+            f"Retrying {len(failed)} {source} units of snapshot {snapshot.id} "
+            f"in {countdown}s"
+        )
+        raise task.retry(args=(snapshot.id, failed), countdown=countdown)
+    return source_outcome(source, succeeded, failed)
+
+
+def dispatch_snapshot_units(
+    snapshot_id: int,
+    units: Dict[str, List[Any]],
+    user_id: Optional[int],
+    chunk_size: Optional[int] = None,
+    group_id: Optional[str] = None,
+    flight_key: Optional[str] = None,
+    protocols: Optional[List[str]] = None,
+) -> GroupResult:
+    """
+    Fans the units of a snapshot out in a chord: one subtask for the prices and
+    one per source and chunk of user_addresses, so the run scales with the
+    number of workers. The finalizer collects the status of every unit into the
+    snapshot, or marks it partial if the run failed, and releases the single
+    flight claim of the run.
+    Args:
+        snapshot_id (int): The ID of the Snapshot to write.
+        units (dict): The user_address IDs of the units to run, keyed by source.
+        user_id (int, optional): The user of the run, every user if not provided.
+        chunk_size (int, optional): The number of user_addresses per subtask,
+            settings.SNAPSHOT_CHUNK_SIZE if not provided.
+        group_id (str, optional): The ID of the returned GroupResult, a new one if
+            not provided.
+        flight_key (str, optional): The single flight key claimed by group_id.
+        protocols (list, optional): The protocols of REFRESH_SOURCES fetched by
+            the protocols units, all if not provided.
+    Returns:
+        GroupResult: The results of the update tasks and of the valuation.
+    """
+    chunk_size = max(chunk_size or settings.SNAPSHOT_CHUNK_SIZE, 1)
+    source_tasks = {
+        "assets": update_assets_database,
+        "staking": update_staking_assets,
+        "protocols": update_protocols,
+    }
+    signatures = []
+    if "prices" in units:
+        signatures.append(update_cryptocurrency_price.s(snapshot_id))
+    for source, task in source_tasks.items():
+        user_address_ids = units.get(source, [])
+        options = (
+            {"protocols": protocols} if source == "protocols" and protocols else {}
+        )
+        signatures.extend(
+            task.s(snapshot_id, user_address_ids[index : index + chunk_size], **options)
+            for index in range(0, len(user_address_ids), chunk_size)
+        )
+
+    # Run tasks in parallel
+    task_group = group(signatures)
+    logging.info(
+        f"Snapshot {snapshot_id}: {len(signatures)} subtasks in chunks of {chunk_size}"
+    )
+
+    group_id = group_id or uuid()
+    finalizer = update_portfolio_values.s(
+        snapshot_id, user_id, flight_key=flight_key, group_id=group_id
+    ).on_error(
+        mark_snapshot_partial.si(snapshot_id, flight_key=flight_key, group_id=group_id)
+    )
+    result = chord(task_group)(finalizer)
+    # Ready once the portfolio values are stored, not only the snapshot rows
+    return GroupResult(group_id, [*result.parent.results, result])
 
 
 @shared_task(bind=True)
-def run_daily_snapshot_update(self, user_id: Optional[int] = None) -> group:
+def run_daily_snapshot_update(
+    self,
+    user_id: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    group_id: Optional[str] = None,
+    flight_key: Optional[str] = None,
+    user_address_ids: Optional[List[int]] = None,
+    sources: Optional[List[str]] = None,
+) -> str:
     """
     Coordinates the daily snapshot update process.
-    Creates a snapshot and then runs all update tasks in parallel.
+    Creates a snapshot, pins its blocks, registers one unit per source and
+    user_address and fans them out in a chord.
+    A refresh scoped to some user_addresses or parts of REFRESH_SOURCES copies
+    the other rows from the last complete snapshot, so only the scope is fetched.
+    Args:
+        user_id (int, optional): The user to update, every user if not provided.
+        chunk_size (int, optional): The number of user_addresses per subtask,
+            settings.SNAPSHOT_CHUNK_SIZE if not provided.
+        group_id (str, optional): The ID of the GroupResult of the run, saved
+            for the callers waiting on it.
+        flight_key (str, optional): The single flight key claimed by group_id,
+            released once the run finished.
+        user_address_ids (list, optional): The user_addresses to fetch, all the
+            user_addresses of the run if not provided.
+        sources (list, optional): The parts of REFRESH_SOURCES to fetch, all if
+            not provided.
+    Returns:
+        str: The ID of the GroupResult of the update tasks and of the valuation.
     """
-    # Create the snapshot first
-    snapshot_id = create_snapshot()
+    try:
+        result = start_snapshot_update(
+            user_id, chunk_size, group_id, flight_key, user_address_ids, sources
+        )
+    except Exception:
+        if flight_key is not None and group_id is not None:
+            get_single_flight().release(flight_key, group_id)
+        if group_id is not None and not self.request.called_directly:
+            # The failure of this task ends the wait of the callers
+            GroupResult(group_id, [self.AsyncResult(self.request.id)]).save()
+        raise
+    if group_id is not None:
+        result.save()
+    return result.id
 
-    # Run tasks in parallel
-    task_group = group(
-        update_cryptocurrency_price.s(snapshot_id),
-        update_assets_database.s(snapshot_id, user_id),
-        update_staking_assets.s(snapshot_id, user_id),
-        update_protocols.s(snapshot_id, user_id),
+
+def start_snapshot_update(
+    user_id: Optional[int],
+    chunk_size: Optional[int],
+    group_id: Optional[str],
+    flight_key: Optional[str],
+    user_address_ids: Optional[List[int]],
+    sources: Optional[List[str]],
+) -> GroupResult:
+    """
+    Creates the snapshot of a run_daily_snapshot_update, carries forward the
+    rows outside its scope and dispatches its units.
+    Returns:
+        GroupResult: The results of the update tasks and of the valuation.
+    """
+    all_ids = get_user_address_ids(user_id)
+    scope_ids = [
+        user_address_id
+        for user_address_id in all_ids
+        if user_address_ids is None or user_address_id in user_address_ids
+    ]
+    scope_sources = [
+        source for source in REFRESH_SOURCES if sources is None or source in sources
+    ]
+    previous = None
+    if scope_ids != all_ids or len(scope_sources) < len(REFRESH_SOURCES):
+        previous = get_previous_snapshots(all_ids)
+        if previous is None:
+            logging.warning("No complete snapshot to carry forward, updating all")
+            scope_ids, scope_sources = all_ids, list(REFRESH_SOURCES)
+
+    # Create the snapshot first, recording the scope it fetches
+    if previous is None:
+        snapshot_id = create_snapshot()
+    else:
+        snapshot_id = create_snapshot(
+            refreshed_sources=scope_sources, refreshed_addresses=scope_ids
+        )
+    snapshot = Snapshot.objects.get(id=snapshot_id)
+
+    # Register every unit before its subtask runs
+    start_snapshot_units(snapshot, all_ids)
+    for previous_snapshot, ids in (previous or {}).items():
+        carry_forward_snapshot(
+            previous_snapshot,
+            snapshot,
+            ids,
+            [
+                user_address_id
+                for user_address_id in scope_ids
+                if user_address_id in ids
+            ],
+            scope_sources,
+        )
+
+    protocols = [
+        source
+        for source in scope_sources
+        if REFRESH_SOURCES[source]["source"] == "protocols"
+    ]
+    return dispatch_snapshot_units(
+        snapshot_id,
+        get_unfinished_units(snapshot),
+        user_id,
+        chunk_size,
+        group_id=group_id,
+        flight_key=flight_key,
+        protocols=None if previous is None else protocols,
     )
 
-    result = task_group.apply_async()
-    return result
+
+def get_previous_snapshots(
+    user_address_ids: List[int], skip_missing: bool = False
+) -> Optional[Dict[Snapshot, List[int]]]:
+    """
+    Returns the last complete snapshot of each user owning the user_addresses,
+    to carry their rows forward from, since the last snapshot of every user may
+    hold the rows of a single user.
+    Args:
+        user_address_ids (list): The IDs of the user_addresses of the run.
+        skip_missing (bool): Leave out the users without a complete snapshot
+            instead of returning None.
+    Returns:
+        dict: The IDs of the user_addresses keyed by the snapshot holding their
+            last complete data, None if a user has no complete snapshot, or
+            with skip_missing if no user has one.
+    """
+    ids_by_user: Dict[int, List[int]] = {}
+    for user_address_id, user_id in (
+        UserAddress.objects.filter(id__in=user_address_ids)
+        .order_by("id")
+        .values_list("id", "user_id")
+    ):
+        ids_by_user.setdefault(user_id, []).append(user_address_id)
+
+    previous: Dict[Snapshot, List[int]] = {}
+    skipped: List[int] = []
+    for user_id, ids in ids_by_user.items():
+        snapshot = get_user_snapshot(User(id=user_id))
+        if snapshot is None:
+            if not skip_missing:
+                return None
+            skipped.append(user_id)
+            continue
+        previous.setdefault(snapshot, []).extend(ids)
+    if skipped:
+        logging.warning(f"Users without a complete snapshot skipped: {skipped}")
+    return previous or None
+
+
+def start_snapshot_units(snapshot: Snapshot, user_address_ids: List[int]) -> None:
+    """
+    Registers the prices unit of the snapshot and one unit per source and
+    user_address.
+    """
+    start_snapshot_source(snapshot, "prices")
+    for source in ("assets", "staking", "protocols"):
+        start_snapshot_source(snapshot, source, user_address_ids)
+
+
+def carry_forward_snapshot(
+    previous: Snapshot,
+    snapshot: Snapshot,
+    user_address_ids: List[int],
+    scope_ids: List[int],
+    sources: List[str],
+) -> None:
+    """
+    Copies the rows of the previous snapshot outside the scope of a refresh into
+    the new snapshot, and marks the units they complete as succeeded.
+    Args:
+        previous (Snapshot): The last complete snapshot of the user_addresses.
+        snapshot (Snapshot): The snapshot being written.
+        user_address_ids (list): The IDs of every user_address of the run.
+        scope_ids (list): The IDs of the user_addresses to fetch again.
+        sources (list): The parts of REFRESH_SOURCES to fetch again.
+    """
+    other_ids = [
+        user_address_id
+        for user_address_id in user_address_ids
+        if user_address_id not in scope_ids
+    ]
+    other_sources = [source for source in REFRESH_SOURCES if source not in sources]
+    copied = carry_forward_rows(previous, snapshot, list(REFRESH_SOURCES), other_ids)
+    copied += carry_forward_rows(previous, snapshot, other_sources, scope_ids)
+
+    for source in ("assets", "staking", "protocols"):
+        mark_snapshot_units(snapshot, source, SnapshotUnit.SUCCEEDED, other_ids)
+        if all(
+            name in other_sources
+            for name, refresh_source in REFRESH_SOURCES.items()
+            if refresh_source["source"] == source
+        ):
+            mark_snapshot_units(snapshot, source, SnapshotUnit.SUCCEEDED, scope_ids)
+    logging.info(
+        f"Snapshot {snapshot.id}: carried {copied} rows forward from snapshot "
+        f"{previous.id}, fetching {', '.join(['prices', *sources])} of "
+        f"{len(scope_ids)} user_addresses"
+    )
+
+
+def snapshot_update_key(
+    user_address_ids: Optional[List[int]], sources: Optional[List[str]] = None
+) -> str:
+    """
+    Returns the single flight key of a snapshot update of a set of
+    user_addresses, or of every user_address if not provided, and of a set of
+    parts of REFRESH_SOURCES, all if not provided.
+    """
+    if user_address_ids is None:
+        return "snapshot:all"
+    scope = ",".join(map(str, sorted(user_address_ids)))
+    if sources is not None:
+        scope += "|" + ",".join(sorted(sources))
+    digest = hashlib.sha256(scope.encode())
+    return f"snapshot:{digest.hexdigest()[:32]}"
+
+
+@shared_task(bind=True)
+def request_snapshot_update(
+    self,
+    user_id: Optional[int] = None,
+    user_address_ids: Optional[List[int]] = None,
+    sources: Optional[List[str]] = None,
+) -> Optional[str]:
+    """
+    Starts a snapshot update in a worker unless an identical one is already
+    in flight.
+    A user whose last complete snapshot finished within SNAPSHOT_FRESHNESS
+    seconds reuses it, if that snapshot fetched the requested scope rather
+    than carrying it forward. A caller asking for the same scope as a run in flight,
+    or for a user while the run of every user or the full run of the user is
+    in flight, is attached to that run instead of starting a new snapshot.
+    Args:
+        user_id (int, optional): The user to update, every user if not provided.
+        user_address_ids (list, optional): The user_addresses of the user to
+            update, all if not provided.
+        sources (list, optional): The parts of REFRESH_SOURCES to update, all if
+            not provided.
+    Returns:
+        str: The ID of the task group to wait for, None if the last snapshot is
+            fresh. The task group is saved once the run has started.
+    """
+    flights = get_single_flight()
+    if user_id is None:
+        flight_key = snapshot_update_key(None)
+    else:
+        all_ids = get_user_address_ids(user_id)
+        scope_ids = [
+            user_address_id
+            for user_address_id in all_ids
+            if user_address_ids is None or user_address_id in user_address_ids
+        ]
+        snapshot = get_user_snapshot(User.objects.get(id=user_id))
+        freshness = timedelta(seconds=settings.SNAPSHOT_FRESHNESS)
+        if (
+            snapshot
+            and snapshot.completed_at
+            and (timezone.now() - snapshot.completed_at < freshness)
+            and snapshot_covers(snapshot, scope_ids, sources)
+        ):
+            logging.info(f"Snapshot {snapshot.id} of user {user_id} is still fresh")
+            return None
+
+        for covering_key in (snapshot_update_key(None), snapshot_update_key(all_ids)):
+            holder = flights.holder(covering_key)
+            if holder is not None:
+                logging.info(f"User {user_id} attached to the run in flight {holder}")
+                return holder
+        flight_key = snapshot_update_key(scope_ids, sources)
+
+    group_id = uuid()
+    holder = flights.claim(flight_key, group_id)
+    if holder is not None:
+        logging.info(f"Snapshot update attached to the run in flight {holder}")
+        return holder
+
+    # The snapshot is created and its blocks pinned by a worker, not by the
+    # caller, which may be a web request
+    try:
+        run_daily_snapshot_update.delay(
+            user_id,
+            group_id=group_id,
+            flight_key=flight_key,
+            user_address_ids=user_address_ids,
+            sources=sources,
+        )
+    except Exception:
+        flights.release(flight_key, group_id)
+        raise
+    return group_id
+
+
+def reprice_key(user_id: Optional[int]) -> str:
+    """
+    Returns the single flight key of a reprice of a user, or of every user if
+    not provided.
+    """
+    return f"reprice:{user_id if user_id is not None else 'all'}"
+
+
+def request_snapshot_reprice(user_id: Optional[int] = None) -> str:
+    """
+    Starts a reprice in a worker unless one is already in flight. A caller
+    asking for a reprice while a snapshot update covering its user_addresses is
+    in flight is attached to that run, which fetches the prices as well.
+    Args:
+        user_id (int, optional): The user to value, every user if not provided.
+    Returns:
+        str: The ID of the task group to wait for. The task group is saved once
+            the reprice has started.
+    """
+    flights = get_single_flight()
+    covering_keys = [snapshot_update_key(None)]
+    if user_id is not None:
+        covering_keys.append(snapshot_update_key(get_user_address_ids(user_id)))
+    for covering_key in covering_keys:
+        holder = flights.holder(covering_key)
+        if holder is not None:
+            logging.info(f"Reprice attached to the run in flight {holder}")
+            return holder
+
+    flight_key = reprice_key(user_id)
+    group_id = uuid()
+    holder = flights.claim(flight_key, group_id)
+    if holder is not None:
+        logging.info(f"Reprice attached to the run in flight {holder}")
+        return holder
+
+    try:
+        reprice_snapshot.delay(user_id, group_id=group_id, flight_key=flight_key)
+    except Exception:
+        flights.release(flight_key, group_id)
+        raise
+    return group_id
+
+
+@shared_task(bind=True)
+def reprice_snapshot(
+    self,
+    user_id: Optional[int] = None,
+    group_id: Optional[str] = None,
+    flight_key: Optional[str] = None,
+) -> str:
+    """
+    Values the latest quantities at the current prices: creates a snapshot
+    carrying every row of the last complete snapshot of each user forward and
+    fetches only the prices, with one request and without reading any chain.
+    The snapshot records an empty refreshed scope, so it does not count as a
+    fresh snapshot for request_snapshot_update.
+    Args:
+        user_id (int, optional): The user to value, every user if not provided.
+        group_id (str, optional): The ID of the GroupResult of the reprice,
+            saved for the callers waiting on it.
+        flight_key (str, optional): The single flight key claimed by group_id,
+            released once the reprice finished.
+    Returns:
+        str: A success message.
+    """
+    if group_id is not None and not self.request.called_directly:
+        GroupResult(group_id, [self.AsyncResult(self.request.id)]).save()
+    try:
+        previous = get_previous_snapshots(
+            get_user_address_ids(user_id), skip_missing=True
+        )
+        if previous is None:
+            return "No complete snapshot to reprice."
+        user_address_ids = [
+            user_address_id for ids in previous.values() for user_address_id in ids
+        ]
+
+        snapshot_id = create_snapshot(
+            pin_blocks=False, refreshed_sources=[], refreshed_addresses=[]
+        )
+        snapshot = Snapshot.objects.get(id=snapshot_id)
+        start_snapshot_units(snapshot, user_address_ids)
+        for previous_snapshot, ids in previous.items():
+            carry_forward_snapshot(previous_snapshot, snapshot, ids, ids, [])
+
+        outcome = update_cryptocurrency_price(snapshot_id)
+        return update_portfolio_values([outcome], snapshot_id, user_id)
+    finally:
+        if flight_key is not None and group_id is not None:
+            get_single_flight().release(flight_key, group_id)
 
 
 @shared_task(bind=True)
-def create_snapshot(self) -> int:
+def resume_snapshot_update(
+    self, snapshot_id: int, chunk_size: Optional[int] = None
+) -> Optional[GroupResult]:
     """
-    Creates a new Snapshot entry and returns its ID.
+    Runs the pending and failed units of a snapshot again, into the same
+    snapshot, instead of taking a new one.
+    Args:
+        snapshot_id (int): The ID of the Snapshot to resume.
+        chunk_size (int, optional): The number of user_addresses per subtask.
+    Returns:
+        GroupResult: The results of the update tasks and of the valuation, None
+            if every unit of the snapshot already succeeded.
+    """
+    snapshot = Snapshot.objects.get(id=snapshot_id)
+    units = get_unfinished_units(snapshot)
+    if not units:
+        logging.info(f"Snapshot {snapshot_id} has no unit to resume")
+        return None
+
+    logging.info(
+        f"Resuming snapshot {snapshot_id}: "
+        + ", ".join(f"{len(ids)} {source}" for source, ids in units.items())
+    )
+    Snapshot.objects.filter(id=snapshot_id).update(
+        status=Snapshot.RUNNING, completed_at=None
+    )
+    return dispatch_snapshot_units(snapshot_id, units, None, chunk_size)
+
+
+@shared_task(bind=True)
+def create_snapshot(
+    self,
+    pin_blocks: bool = True,
+    refreshed_sources: Optional[List[str]] = None,
+    refreshed_addresses: Optional[List[int]] = None,
+) -> int:
+    """
+    Creates a new Snapshot entry, pins the block number read on each network
+    and returns its ID.
+    Args:
+        pin_blocks (bool): Whether to pin the blocks, not needed by a snapshot
+            that reads no chain.
+        refreshed_sources (list, optional): The parts of REFRESH_SOURCES fetched
+            by a scoped refresh, all if not provided.
+        refreshed_addresses (list, optional): The IDs of the user_addresses
+            fetched by a scoped refresh, all if not provided.
     Returns:
         int: The ID of the created Snapshot.
     """
-    snapshot = Snapshot.objects.create(date=datetime.now())
+    snapshot = Snapshot.objects.create(
+        date=datetime.now(),
+        refreshed_sources=refreshed_sources,
+        refreshed_addresses=refreshed_addresses,
+    )
+    if pin_blocks:
+        pin_snapshot_blocks(snapshot)
     return snapshot.id
 
 
-@shared_task(bind=True)
-def update_cryptocurrency_price(self, snapshot_id: int) -> str:
+@shared_task(bind=True, max_retries=settings.SNAPSHOT_MAX_RETRIES)
+def update_cryptocurrency_price(self, snapshot_id: int) -> Dict[str, Any]:
     """
     Fetches the current price of each cryptocurrency and stores it in the database with the given Snapshot.
     Args:
         snapshot_id (int): The ID of the Snapshot to associate with the prices.
     Returns:
-        str: A success message.
+        dict: The cryptocurrencies priced and those that failed.
     """
-    logging.info("Updating cryptocurrency prices...", snapshot_id)
+    logging.info(f"Updating cryptocurrency prices of snapshot {snapshot_id}...")
     snapshot = Snapshot.objects.get(id=snapshot_id)
     cryptocurrencies = Cryptocurrency.objects.all()
     crypto_ids = [crypto.name for crypto in cryptocurrencies]
 
-    prices = fetch_cryptocurrency_price(crypto_ids)
-    if prices is None:
+    prices = fetch_cryptocurrency_price(crypto_ids) or {}
+    if not prices:
         logging.error("Failed to fetch cryptocurrency prices.")
-        return "Failed to update cryptocurrency prices."
 
-    for crypto in crypto_ids:
-        crypto_price = Price(
-            cryptocurrency=Cryptocurrency.objects.get(name=crypto),
-            price=prices[crypto]["eur"],
-            snapshot=snapshot,
+    succeeded: List[str] = []
+    failed: List[str] = []
+    with SnapshotWriter(snapshot) as writer:
+        for crypto in cryptocurrencies:
+            if crypto.name not in prices:
+                logging.error(f"Missing price of {crypto.name}")
+                failed.append(crypto.name)
+                continue
+            writer.add_price(crypto, prices[crypto.name]["eur"])
+            succeeded.append(crypto.name)
+            logging.info(
+                f"Price of {crypto.name} updated to {prices[crypto.name]['eur']} EUR"
+            )
+
+    # The prices are a single unit, fetched again until every price is stored
+    mark_snapshot_units(
+        snapshot, "prices", SnapshotUnit.FAILED if failed else SnapshotUnit.SUCCEEDED
+    )
+    retries = self.request.retries
+    if failed and not self.request.called_directly and retries < self.max_retries:
+        raise self.retry(countdown=settings.SNAPSHOT_RETRY_BACKOFF * 2**retries)
+    return source_outcome("prices", succeeded, failed)
+
+
+@shared_task(bind=True, ignore_result=True)
+def backfill_price(self, crypto_id: str, snapshot_date: str) -> str:
+    """
+    Fetches the historical price of a cryptocurrency missing from the snapshots
+    taken at the given date, stores it and values the snapshots again.
+    Args:
+        crypto_id (str): The ID of the cryptocurrency.
+        snapshot_date (str): The ISO date of the snapshots.
+    Returns:
+        str: A success message.
+    """
+    date = datetime.fromisoformat(snapshot_date)
+    snapshots = list(
+        Snapshot.objects.filter(date=date).exclude(
+            price__cryptocurrency__name=crypto_id
         )
-        crypto_price.save()
-        logging.info(f"Price of {crypto} updated to {prices[crypto]['eur']} EUR")
-    return "Cryptocurrency prices updated successfully!"
+    )
+    if not snapshots:
+        return f"Price of {crypto_id} already stored."
+
+    price = fetch_historical_price(crypto_id, date.date())
+    if price is None:
+        logging.error(f"Failed to backfill the price of {crypto_id} on {date}")
+        return f"Failed to backfill the price of {crypto_id}."
+
+    logging.info(f"Historical price cache: {historical_price_cache.stats()}")
+    cryptocurrency = Cryptocurrency.objects.get(name=crypto_id)
+    for snapshot in snapshots:
+        with SnapshotWriter(snapshot) as writer:
+            writer.add_price(cryptocurrency, price)
+    rematerialize_portfolio_values(snapshots)
+    return f"Price of {crypto_id} backfilled."
 
 
 @shared_task(bind=True)
-def update_assets_database(self, snapshot_id: int, user_id: Optional[int]) -> str:
+def backfill_prices_range(
+    self,
+    crypto_ids: Optional[List[str]] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+) -> str:
     """
-    Fetches the assets of a user and stores them in the database with the given Snapshot.
+    Fills the prices missing from the snapshots taken between two dates with the
+    price history of each cryptocurrency.
     Args:
-        snapshot_id (int): The ID of the Snapshot to associate with the assets.
+        crypto_ids (list, optional): The cryptocurrencies to backfill, all if not provided.
+        start (str, optional): The ISO date of the first snapshot.
+        end (str, optional): The ISO date of the last snapshot.
     Returns:
         str: A success message.
     """
+    created = backfill_prices(
+        crypto_ids,
+        datetime.fromisoformat(start) if start else None,
+        datetime.fromisoformat(end) if end else None,
+    )
+    return f"Backfilled {created} prices."
+
+
+@shared_task(bind=True, max_retries=settings.SNAPSHOT_MAX_RETRIES)
+def update_assets_database(
+    self, snapshot_id: int, user_address_ids: List[int]
+) -> Dict[str, Any]:
+    """
+    Fetches the assets of a chunk of user_addresses and stores them in the database with the given Snapshot.
+    Args:
+        snapshot_id (int): The ID of the Snapshot to associate with the assets.
+        user_address_ids (list): The IDs of the user_addresses of the chunk.
+    Returns:
+        dict: The user_addresses updated and those that failed.
+    """
     logging.info("Updating assets database...")
     snapshot = Snapshot.objects.get(id=snapshot_id)
+    user_addresses = list(UserAddress.objects.filter(id__in=user_address_ids))
+    ids = [user_address.id for user_address in user_addresses]
+    delete_unit_rows(snapshot, "assets", ids)
 
-    if user_id is None:
-        logging.info("Automated daily snapshot update initiated.")
-        user_addresses = UserAddress.objects.all()
-    else:
-        logging.info(f"User initiated a daily snapshot update with user ID: {user_id}")
-        user_addresses = UserAddress.objects.filter(user_id=user_id)
-
-    for user_address in user_addresses:
-        try:
-            logging.info(
-                f"Fetching assets for user_address: {user_address.public_address}"
+    try:
+        logging.info(f"Fetching assets for {len(user_addresses)} user_addresses")
+        with ChainPool(get_network_choices()) as pool:
+            failed_networks = fetch_assets_batch(
+                user_addresses, snapshot, chain_pool=pool
             )
-            fetch_assets(user_address, snapshot)
-        except TimeoutError:
-            logging.error("TimeoutError: Retrying...")
-            continue
-        except Exception as e:
-            logging.error(f"An error occurred: {e}")
-            continue
-    return "Assets updated successfully!"
+    except TimeoutError:
+        logging.error("TimeoutError while fetching assets")
+        return finish_snapshot_units(self, snapshot, "assets", [], ids)
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+        return finish_snapshot_units(self, snapshot, "assets", [], ids)
+    # A network is scanned for every user_address of the chunk at once, so a
+    # failed network fails the whole chunk
+    if failed_networks:
+        logging.error(f"Failed to fetch the assets on networks {failed_networks}")
+        return finish_snapshot_units(self, snapshot, "assets", [], ids)
+    return finish_snapshot_units(self, snapshot, "assets", ids, [])
 
 
-@shared_task(bind=True)
-def update_staking_assets(self, snapshot_id: int, user_id: Optional[int]) -> str:
+@shared_task(bind=True, max_retries=settings.SNAPSHOT_MAX_RETRIES)
+def update_staking_assets(
+    self, snapshot_id: int, user_address_ids: List[int]
+) -> Dict[str, Any]:
     """
-    Fetches the staking assets of a user and stores them in the database with the given Snapshot.
+    Fetches the staking assets of a chunk of user_addresses and stores them in the database with the given Snapshot.
     Args:
         snapshot_id (int): The ID of the Snapshot to associate with the staking assets.
+        user_address_ids (list): The IDs of the user_addresses of the chunk.
     Returns:
-        str: A success message.
+        dict: The user_addresses updated and those that failed.
     """
     snapshot = Snapshot.objects.get(id=snapshot_id)
+    user_addresses = UserAddress.objects.filter(id__in=user_address_ids)
+    delete_unit_rows(snapshot, "staking", user_address_ids)
 
-    if user_id is None:
-        logging.info("Automated daily snapshot update initiated.")
-        user_addresses = UserAddress.objects.all()
-    else:
-        logging.info(f"User initiated a daily snapshot update with user ID: {user_id}")
-        user_addresses = UserAddress.objects.filter(user_id=user_id)
-
+    succeeded: List[int] = []
+    failed: List[int] = []
     for user_address in user_addresses:
         try:
             logging.info(
                 f"Fetching staking assets for user_address: {user_address.public_address}"
             )
-            fetch_staking_assets(user_address, snapshot)
+            with SnapshotWriter(snapshot) as writer:
+                fetch_staking_assets(user_address, snapshot, writer)
+            succeeded.append(user_address.id)
         except TimeoutError:
             logging.error("TimeoutError: Retrying...")
+            failed.append(user_address.id)
             continue
         except Exception as e:
             logging.error(f"An error occurred: {e}")
+            failed.append(user_address.id)
             continue
-    return "Staking assets updated successfully!"
+    return finish_snapshot_units(self, snapshot, "staking", succeeded, failed)
 
 
-@shared_task(bind=True)
-def update_protocols(self, snapshot_id: int, user_id: Optional[int]) -> str:
+@shared_task(bind=True, max_retries=settings.SNAPSHOT_MAX_RETRIES)
+def update_protocols(
+    self,
+    snapshot_id: int,
+    user_address_ids: List[int],
+    protocols: Optional[List[str]] = None,
+) -> Dict[str, Any]:
     """
-    Fetches the protocols of a user and stores them in the database with the given Snapshot.
+    Fetches the protocols of a chunk of user_addresses and stores them in the database with the given Snapshot.
     Args:
         snapshot_id (int): The ID of the Snapshot to associate with the protocols.
+        user_address_ids (list): The IDs of the user_addresses of the chunk.
+        protocols (list, optional): The protocols to fetch among "aave",
+            "liquity" and "uniswap", all if not provided.
     Returns:
-        str: A success message.
+        dict: The user_addresses updated and those that failed.
     """
 
     snapshot = Snapshot.objects.get(id=snapshot_id)
+    user_addresses = list(UserAddress.objects.filter(id__in=user_address_ids))
+    delete_unit_rows(snapshot, "protocols", user_address_ids, protocols)
+    protocols = protocols or ["aave", "liquity", "uniswap"]
 
-    if user_id is None:
-        logging.info("Automated daily snapshot update initiated.")
-        user_addresses = UserAddress.objects.all()
-    else:
-        logging.info(f"User initiated a daily snapshot update with user ID: {user_id}")
-        user_addresses = UserAddress.objects.filter(user_id=user_id)
+    # A failed AAVE batch fails every user_address of the chunk
+    aave_failed = False
+    if "aave" in protocols:
+        try:
+            logging.info(
+                f"Fetching AAVE pools for {len(user_addresses)} user_addresses"
+            )
+            with ChainPool(get_network_choices()) as pool:
+                failed_pools = update_aave_lending_pools_batch(
+                    user_addresses, snapshot, chain_pool=pool
+                )
+            if failed_pools:
+                logging.error(f"Failed to fetch the AAVE pools {failed_pools}")
+                aave_failed = True
+        except TimeoutError:
+            logging.error("TimeoutError while fetching AAVE pools")
+            aave_failed = True
+        except Exception as e:
+            logging.error(f"An error occurred: {e}")
+            aave_failed = True
 
+    succeeded: List[int] = []
+    failed: List[int] = []
     for user_address in user_addresses:
         try:
             logging.info(f"Fetching protocols for user_address: {user_address}")
-            update_lqty_pools(user_address, snapshot)
-            update_aave_lending_pools(user_address, snapshot)
-            update_uniswap_v3_positions(user_address, snapshot)
+            with SnapshotWriter(snapshot) as writer:
+                if "liquity" in protocols:
+                    update_lqty_pools(user_address, snapshot, writer)
+                if "uniswap" in protocols:
+                    update_uniswap_v3_positions(user_address, snapshot, writer)
         except TimeoutError:
             logging.error("TimeoutError: Retrying...")
+            failed.append(user_address.id)
             continue
         except Exception as e:
             logging.error(f"An error occurred: {e}")
+            failed.append(user_address.id)
             continue
-    return "Protocols updated successfully!"
+        (failed if aave_failed else succeeded).append(user_address.id)
+    logging.info(f"RPC stats: {get_rpc_stats()}")
+    logging.info(f"Response cache stats: {get_response_cache().stats()}")
+    return finish_snapshot_units(self, snapshot, "protocols", succeeded, failed)
+
+
+@shared_task(bind=True)
+def update_portfolio_values(
+    self,
+    results: List[Dict[str, Any]],
+    snapshot_id: int,
+    user_id: Optional[int],
+    flight_key: Optional[str] = None,
+    group_id: Optional[str] = None,
+) -> str:
+    """
+    Finalizes the snapshot once every update task has finished: counts the
+    status of its units into its sources, stores its portfolio values,
+    so the views sum them instead of valuing the snapshot rows, sets its final
+    status and, if complete, records it as the latest complete snapshot of its
+    users.
+    Args:
+        results (list): The outcomes of the update tasks.
+        snapshot_id (int): The ID of the Snapshot to value.
+        user_id (int, optional): The user of the run, the user_addresses of the
+            units of the snapshot if not provided.
+        flight_key (str, optional): The single flight key claimed by the run.
+        group_id (str, optional): The ID of the task group of the run.
+    Returns:
+        str: A success message.
+    """
+    snapshot = Snapshot.objects.get(id=snapshot_id)
+    if user_id is None:
+        user_addresses = UserAddress.objects.filter(
+            snapshot_units__snapshot=snapshot
+        ).distinct()
+    else:
+        user_addresses = UserAddress.objects.filter(user_id=user_id)
+
+    # Carried-forward troves hold the EUR balance of the snapshot they came from
+    update_trove_balances(snapshot)
+    # Stored prices only: a coin missing from the prices unit is valued at its
+    # nearest stored price and backfilled, not fetched by the finalizer
+    stored = materialize_portfolio_values(
+        snapshot, list(user_addresses), PriceBook(snapshot, fetch_missing=False)
+    )
+    if finalize_snapshot(snapshot) == Snapshot.COMPLETE:
+        record_user_snapshots(
+            snapshot, {user_address.user_id for user_address in user_addresses}
+        )
+    if flight_key and group_id:
+        get_single_flight().release(flight_key, group_id)
+    return f"Stored {stored} portfolio values."
+
+
+@shared_task(bind=True, ignore_result=True)
+def mark_snapshot_partial(
+    self,
+    snapshot_id: int,
+    flight_key: Optional[str] = None,
+    group_id: Optional[str] = None,
+) -> None:
+    """
+    Marks a snapshot whose run failed before its finalizer as partial, so it is
+    not left running, and releases the single flight claim of the run.
+    Args:
+        snapshot_id (int): The ID of the Snapshot.
+        flight_key (str, optional): The single flight key claimed by the run.
+        group_id (str, optional): The ID of the task group of the run.
+    """
+    Snapshot.objects.filter(id=snapshot_id).exclude(status=Snapshot.COMPLETE).update(
+        status=Snapshot.PARTIAL
+    )
+    if flight_key and group_id:
+        get_single_flight().release(flight_key, group_id)
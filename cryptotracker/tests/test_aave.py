@@ -0,0 +1,59 @@
+from unittest.mock import MagicMock, patch
+
+from django.test import SimpleTestCase
+from eth_abi import encode
+
+from cryptotracker.protocols.aave import (
+    USER_RESERVE_DATA_TYPES,
+    AavePosition,
+    fetch_aave_positions,
+)
+
+PROVIDER_ADDRESS = "0x2f39d218133afab8f2b819b1066c7e434ad94e9e"
+DATA_PROVIDER_ADDRESS = "0x7b4eb56e7cd4b454ba8ff71e4518426369a138a3"
+WETH = "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2"
+USDC = "0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48"
+ALICE = "0x1111111111111111111111111111111111111111"
+BOB = "0x2222222222222222222222222222222222222222"
+
+
+def reserve_data(supplied, stable_debt, variable_debt):
+    return encode(
+        USER_RESERVE_DATA_TYPES,
+        [supplied, stable_debt, variable_debt, 0, 0, 0, 0, 0, False],
+    )
+
+
+class AavePositionsTests(SimpleTestCase):
+    def test_reads_supplies_and_debts_of_every_user(self):
+        client = MagicMock()
+        client.eth_call.side_effect = [
+            encode(["address"], [DATA_PROVIDER_ADDRESS]),
+            encode(["(string,address)[]"], [[("WETH", WETH), ("USDC", USDC)]]),
+        ]
+        client.batch_eth_call.return_value = [
+            reserve_data(10**18, 0, 0),
+            reserve_data(0, 0, 0),
+            None,
+            reserve_data(0, 5, 7),
+        ]
+        with (
+            patch("cryptotracker.protocols.aave.get_rpc_client", return_value=client),
+            patch(
+                "cryptotracker.protocols.aave.multicall_available", return_value=False
+            ),
+        ):
+            positions = fetch_aave_positions(
+                "ethereum:mainnet:alchemy", PROVIDER_ADDRESS, [ALICE, BOB], 100
+            )
+
+        self.assertEqual(
+            positions,
+            [
+                AavePosition(ALICE, "WETH", 10**18, 0, 0),
+                AavePosition(BOB, "USDC", 0, 5, 7),
+            ],
+        )
+        (calls,) = client.batch_eth_call.call_args.args
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(client.batch_eth_call.call_args.kwargs["block"], 100)
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from cryptotracker.backfill import backfill_prices, split_range
+from cryptotracker.models import Cryptocurrency, Price, Snapshot
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def daily_prices(crypto_id, start, end):
+    points = []
+    day = datetime(start.year, start.month, start.day, tzinfo=timezone.utc)
+    while day <= end:
+        points.append((day, Decimal((day - START).days + 100)))
+        day += timedelta(days=1)
+    return points
+
+
+class BackfillPricesTests(TestCase):
+    def setUp(self):
+        self.ethereum = Cryptocurrency.objects.create(
+            name="ethereum", symbol="ETH", image=""
+        )
+        self.snapshots = [
+            Snapshot.objects.create(date=START + timedelta(days=day))
+            for day in range(0, 400, 50)
+        ]
+        Price.objects.create(
+            cryptocurrency=self.ethereum, price=1, snapshot=self.snapshots[0]
+        )
+
+    def test_split_range(self):
+        windows = split_range(START, START + timedelta(days=400))
+        self.assertEqual(len(windows), 2)
+        self.assertEqual(windows[1][1], START + timedelta(days=400))
+
+    def test_missing_prices_are_filled_with_range_requests(self):
+        with patch(
+            "cryptotracker.backfill.fetch_price_range", side_effect=daily_prices
+        ) as fetch:
+            created = backfill_prices()
+
+        self.assertEqual(created, len(self.snapshots) - 1)
+        self.assertEqual(fetch.call_count, 1)
+        price = Price.objects.get(snapshot=self.snapshots[2])
+        self.assertEqual(price.price, Decimal(100 + 100))
+        self.assertEqual(
+            Price.objects.get(snapshot=self.snapshots[0]).price, Decimal(1)
+        )
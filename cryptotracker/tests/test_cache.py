@@ -0,0 +1,49 @@
+from unittest.mock import MagicMock, patch
+
+from django.test import SimpleTestCase
+
+from cryptotracker.cache import ResponseCache
+from cryptotracker.rpc import RPCClient, encode_call
+
+POOL_ADDRESS = "0x1234567890abcdef1234567890abcdef12345678"
+
+
+def rpc_response(payload):
+    response = MagicMock()
+    response.json.return_value = payload
+    return response
+
+
+class ResponseCacheTests(SimpleTestCase):
+    def test_lru_eviction_and_stats(self):
+        cache = ResponseCache(max_entries=2)
+        cache.set("a", b"1")
+        cache.set("b", b"2")
+        self.assertEqual(cache.get("a", "f()"), b"1")
+        cache.set("c", b"3")
+
+        self.assertIsNone(cache.get("b", "f()"))
+        self.assertEqual(cache.get("c", "g()"), b"3")
+        self.assertEqual(
+            cache.stats(),
+            {"f()": {"hits": 1, "misses": 1}, "g()": {"hits": 1, "misses": 0}},
+        )
+
+    def test_pinned_calls_are_sent_once(self):
+        cache = ResponseCache()
+        client = RPCClient("http://localhost:8545", chain="ethereum", cache=cache)
+        calldata = encode_call("getPoolDataProvider()")
+        with patch.object(client.session, "post") as post:
+            post.return_value = rpc_response(
+                {"jsonrpc": "2.0", "id": 1, "result": "0x01"}
+            )
+            first = client.eth_call(POOL_ADDRESS, calldata, 100)
+            second = client.batch_eth_call([(POOL_ADDRESS, calldata)], block=100)
+            client.eth_call(POOL_ADDRESS, calldata, "latest")
+
+        self.assertEqual(first, b"\x01")
+        self.assertEqual(second, [b"\x01"])
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(
+            cache.stats(), {"getPoolDataProvider()": {"hits": 1, "misses": 1}}
+        )
@@ -0,0 +1,56 @@
+import multiprocessing
+import threading
+
+from django.test import SimpleTestCase
+
+from cryptotracker.chain_pool import ChainPool, LocalChainRunner
+
+
+def read_chain(network_choice, value):
+    return network_choice, value, threading.current_thread().name
+
+
+def fail_read(network_choice):
+    raise ValueError(f"RPC error on {network_choice}")
+
+
+def run_pool_in_child(queue):
+    with ChainPool(["ethereum:mainnet", "base:mainnet"]) as pool:
+        futures = [
+            pool.submit(network_choice, read_chain, 1)
+            for network_choice in ("ethereum:mainnet", "base:mainnet")
+        ]
+        queue.put([future.result()[:2] for future in futures])
+
+
+class ChainPoolTests(SimpleTestCase):
+    def test_reads_run_on_the_thread_of_their_network(self):
+        with ChainPool(["ethereum:mainnet", "base:mainnet"]) as pool:
+            ethereum = pool.submit("ethereum:mainnet", read_chain, 1).result()
+            base = pool.submit("base:mainnet", read_chain, 2).result()
+
+        self.assertEqual(ethereum[:2], ("ethereum:mainnet", 1))
+        self.assertEqual(base[:2], ("base:mainnet", 2))
+        self.assertTrue(ethereum[2].startswith("chain-ethereum:mainnet"))
+        self.assertTrue(base[2].startswith("chain-base:mainnet"))
+
+    def test_errors_are_raised_by_the_future(self):
+        for runner in (ChainPool(["ethereum:mainnet"]), LocalChainRunner()):
+            with self.subTest(runner=type(runner).__name__):
+                future = runner.submit("ethereum:mainnet", fail_read)
+                with self.assertRaisesMessage(ValueError, "RPC error"):
+                    future.result()
+                if isinstance(runner, ChainPool):
+                    runner.shutdown()
+
+    def test_pool_runs_inside_a_daemonic_process(self):
+        # Celery prefork workers are daemonic and cannot start child processes
+        context = multiprocessing.get_context("fork")
+        queue = context.Queue()
+        process = context.Process(target=run_pool_in_child, args=(queue,), daemon=True)
+        process.start()
+        results = queue.get(timeout=30)
+        process.join(timeout=30)
+
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(results, [("ethereum:mainnet", 1), ("base:mainnet", 1)])
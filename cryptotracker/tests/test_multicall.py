@@ -0,0 +1,66 @@
+from django.test import SimpleTestCase
+from eth_abi import decode, encode
+
+from cryptotracker.constants import MULTICALL3_ADDRESS
+from cryptotracker.multicall import (
+    AGGREGATE3_SELECTOR,
+    BALANCE_OF_SELECTOR,
+    GET_ETH_BALANCE_SELECTOR,
+    chunk_calls,
+    encode_balance_call,
+    fetch_balances,
+)
+
+TOKEN = "0x5f98805a4e8be255a32880fdec7f6728c6568ba0"
+OWNER = "0x1234567890abcdef1234567890abcdef12345678"
+
+
+class FakeMulticall:
+    """
+    Executes aggregate3 calldata against an in-memory map of balances.
+    """
+
+    def __init__(self, balances):
+        self.balances = balances
+        self.requests = 0
+
+    def __call__(self, to, data):
+        self.requests += 1
+        assert to == MULTICALL3_ADDRESS
+        assert data[:4] == AGGREGATE3_SELECTOR
+        (calls,) = decode(["(address,bool,bytes)[]"], data[4:])
+        results = []
+        for target, _, call_data in calls:
+            (owner,) = decode(["address"], call_data[4:])
+            key = (target.lower(), call_data[:4], owner.lower())
+            if key in self.balances:
+                results.append((True, encode(["uint256"], [self.balances[key]])))
+            else:
+                results.append((False, b""))
+        return encode(["(bool,bytes)[]"], [results])
+
+
+class MulticallTests(SimpleTestCase):
+    def test_encode_native_balance_call(self):
+        target, data = encode_balance_call(None, OWNER)
+        self.assertEqual(target, MULTICALL3_ADDRESS)
+        self.assertEqual(data[:4], GET_ETH_BALANCE_SELECTOR)
+
+    def test_chunk_calls_respects_size(self):
+        calls = [encode_balance_call(TOKEN, OWNER)] * 10
+        chunks = list(chunk_calls(calls, max_bytes=3 * 224))
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 3, 3, 1])
+
+    def test_fetch_balances(self):
+        eth_call = FakeMulticall(
+            {
+                (MULTICALL3_ADDRESS.lower(), GET_ETH_BALANCE_SELECTOR, OWNER): 5,
+                (TOKEN, BALANCE_OF_SELECTOR, OWNER): 7,
+            }
+        )
+        balances = fetch_balances(
+            eth_call,
+            [(None, OWNER), (TOKEN, OWNER), (TOKEN.replace("5f", "6f"), OWNER)],
+        )
+        self.assertEqual(balances, [5, 7, None])
+        self.assertEqual(eth_call.requests, 1)
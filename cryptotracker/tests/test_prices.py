@@ -0,0 +1,74 @@
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from cryptotracker.models import Cryptocurrency, HistoricalPrice, Price, Snapshot
+from cryptotracker.utils import (
+    PriceBook,
+    fetch_historical_price,
+    historical_price_cache,
+)
+
+
+class PriceBookTests(TestCase):
+    def setUp(self):
+        self.snapshot = Snapshot.objects.create(
+            date=datetime(2025, 1, 1, tzinfo=timezone.utc)
+        )
+        for name, price in (("ethereum", "3000"), ("bitcoin", "90000")):
+            Price.objects.create(
+                cryptocurrency=Cryptocurrency.objects.create(
+                    name=name, symbol=name[:3].upper(), image=""
+                ),
+                price=Decimal(price),
+                snapshot=self.snapshot,
+            )
+
+    def test_prices_are_loaded_with_one_query(self):
+        with self.assertNumQueries(1):
+            prices = PriceBook(self.snapshot)
+            self.assertEqual(prices.get("ethereum"), Decimal("3000"))
+            self.assertEqual(
+                prices.get("bitcoin", self.snapshot.date), Decimal("90000")
+            )
+
+    def test_missing_price_is_fetched_once(self):
+        prices = PriceBook(self.snapshot)
+        with patch(
+            "cryptotracker.utils.fetch_historical_price", return_value=Decimal("1")
+        ) as fetch:
+            self.assertEqual(prices.get("liquity"), Decimal("1"))
+            self.assertEqual(prices.get("liquity"), Decimal("1"))
+        fetch.assert_called_once()
+
+    def test_render_prices_never_call_the_api(self):
+        later = Snapshot.objects.create(date=datetime(2025, 1, 2, tzinfo=timezone.utc))
+        prices = PriceBook(later, fetch_missing=False)
+        with (
+            patch("cryptotracker.utils.fetch_historical_price") as fetch,
+            patch("cryptotracker.utils.request_price_backfill") as backfill,
+        ):
+            self.assertEqual(prices.get("ethereum"), Decimal("3000"))
+            self.assertEqual(prices.get("liquity"), Decimal(0))
+        fetch.assert_not_called()
+        self.assertEqual(backfill.call_count, 2)
+        self.assertEqual(
+            prices.stale, {"ethereum": self.snapshot.date, "liquity": None}
+        )
+
+
+class HistoricalPriceCacheTests(TestCase):
+    def test_historical_price_is_fetched_once(self):
+        response = {"market_data": {"current_price": {"eur": 2500.5}}}
+        historical_price_cache.hits = historical_price_cache.misses = 0
+        with patch("cryptotracker.utils.APIquery", return_value=response) as query:
+            for _ in range(3):
+                self.assertEqual(
+                    fetch_historical_price("ethereum", date(2024, 5, 1)),
+                    Decimal("2500.5"),
+                )
+        query.assert_called_once()
+        self.assertEqual(HistoricalPrice.objects.count(), 1)
+        self.assertAlmostEqual(historical_price_cache.hit_ratio, 2 / 3)
@@ -0,0 +1,111 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from cryptotracker.models import (
+    Account,
+    Cryptocurrency,
+    Pool,
+    Snapshot,
+    UserAddress,
+    WalletType,
+)
+from cryptotracker.protocols.protocols import get_protocols_snapshots
+from cryptotracker.protocols import subgraph
+from cryptotracker.protocols.subgraph import (
+    SubgraphError,
+    get_indexed_block,
+    send_graphql_query,
+)
+from cryptotracker.utils import PriceBook
+from cryptotracker.writer import SnapshotWriter
+
+
+class ProtocolsSnapshotsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command("initialize_db")
+
+    def setUp(self):
+        user = User.objects.create_user(username="testuser", password="testpassword")
+        self.user_address = UserAddress.objects.create(
+            user=user,
+            public_address="0x1234567890abcdef1234567890abcdef12345678",
+            account=Account.objects.create(user=user, name="Test Account"),
+            wallet_type=WalletType.objects.get(name="HOT"),
+        )
+        self.snapshot = Snapshot.objects.create(
+            date=datetime(2025, 1, 1, tzinfo=timezone.utc)
+        )
+        self.ethereum = Cryptocurrency.objects.get(name="ethereum")
+        with SnapshotWriter(self.snapshot) as writer:
+            writer.add_price(self.ethereum, Decimal("3000"))
+        self.prices = PriceBook(self.snapshot)
+
+    def add_positions(self, count):
+        with SnapshotWriter(self.snapshot) as writer:
+            for pool in Pool.objects.all()[:count]:
+                writer.add_pool_balance(
+                    pool, self.user_address, self.ethereum.symbol, Decimal("1")
+                )
+                writer.add_pool_balance(
+                    pool,
+                    self.user_address,
+                    self.ethereum.symbol,
+                    Decimal("0.1"),
+                    is_reward=True,
+                )
+
+    def render(self):
+        protocols = get_protocols_snapshots(
+            [self.user_address], self.snapshot, self.prices
+        )
+        pools = [pool for pools in protocols["pool_data"].values() for pool in pools]
+        for pool in pools:
+            str(pool.pool_position.pool.type)
+            str(pool.pool_position.pool.protocol_network.network)
+            pool.pool_position.user_address.public_address
+            [balance.token.symbol for balance in pool.balances]
+            [reward.token.symbol for reward in pool.rewards]
+        return pools
+
+    def test_query_count_does_not_grow_with_positions(self):
+        self.add_positions(1)
+        with self.assertNumQueries(2):
+            self.assertEqual(len(self.render()), 1)
+
+        self.add_positions(3)
+        with self.assertNumQueries(2):
+            pools = self.render()
+
+        self.assertEqual(len(pools), 3)
+        self.assertEqual(len(pools[0].balances), 2)
+        self.assertEqual(pools[0].balance_eur, Decimal("6000"))
+        self.assertEqual(len(pools[1].rewards), 1)
+
+
+class SubgraphQueryTests(SimpleTestCase):
+    @patch("cryptotracker.protocols.subgraph.requests.post")
+    def test_graphql_errors_are_raised(self, post):
+        post.return_value.json.return_value = {
+            "errors": [{"message": "block not yet indexed"}]
+        }
+
+        with self.assertRaisesMessage(SubgraphError, "block not yet indexed"):
+            send_graphql_query("subgraph", "{ troves { id } }")
+
+    @patch.dict(subgraph._indexed_blocks, clear=True)
+    @patch("cryptotracker.protocols.subgraph.requests.post")
+    def test_pinned_block_is_clamped_to_the_indexed_block(self, post):
+        post.return_value.json.return_value = {
+            "data": {"_meta": {"block": {"number": 90}}}
+        }
+
+        self.assertEqual(get_indexed_block("subgraph", 100), 90)
+        self.assertEqual(get_indexed_block("subgraph", 80), 80)
+        self.assertEqual(get_indexed_block("subgraph", "latest"), "latest")
+        post.assert_called_once()
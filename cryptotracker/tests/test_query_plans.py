@@ -0,0 +1,129 @@
+from datetime import datetime, timezone
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase
+
+from cryptotracker.models import (
+    Account,
+    PoolBalanceSnapshot,
+    PoolRewardsSnapshot,
+    PortfolioValueSnapshot,
+    Price,
+    Snapshot,
+    SnapshotAssets,
+    TroveSnapshot,
+    UserAddress,
+    ValidatorSnapshot,
+    WalletType,
+)
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN is SQLite specific")
+class QueryPlanTests(TestCase):
+    """
+    The hot read queries of the views must search the snapshot tables through
+    an index, never scan them.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command("initialize_db")
+
+    def setUp(self):
+        user = User.objects.create_user(username="testuser", password="testpassword")
+        self.user_addresses = [
+            UserAddress.objects.create(
+                user=user,
+                public_address="0x1234567890abcdef1234567890abcdef12345678",
+                account=Account.objects.create(user=user, name="Test Account"),
+                wallet_type=WalletType.objects.get(name="HOT"),
+            )
+        ]
+        self.snapshot = Snapshot.objects.create(
+            date=datetime(2025, 1, 1, tzinfo=timezone.utc)
+        )
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertSearches(self, queryset, index):
+        table = queryset.model._meta.db_table
+        plan = self.query_plan(queryset)
+        self.assertFalse(
+            [step for step in plan if step.startswith(f"SCAN {table}")], plan
+        )
+        self.assertTrue(
+            [step for step in plan if step.startswith(f"SEARCH {table}")], plan
+        )
+        self.assertIn(index, " ".join(plan))
+
+    def test_snapshot_assets(self):
+        self.assertSearches(
+            SnapshotAssets.objects.filter(
+                user_address__in=self.user_addresses, snapshot=self.snapshot
+            ),
+            "snapshotassets_snapshot_idx",
+        )
+
+    def test_prices_of_a_snapshot_date(self):
+        self.assertSearches(
+            Price.objects.filter(snapshot__date=self.snapshot.date).values_list(
+                "cryptocurrency__name", "price"
+            ),
+            # Unique constraints are backed by an automatic index on SQLite
+            "sqlite_autoindex_cryptotracker_price",
+        )
+
+    def test_validator_snapshots(self):
+        self.assertSearches(
+            ValidatorSnapshot.objects.filter(
+                validator__user_address__in=self.user_addresses,
+                snapshot=self.snapshot,
+            ),
+            "validatorsnapshot_snap_idx",
+        )
+
+    def test_pool_snapshots(self):
+        for model, index in (
+            (PoolBalanceSnapshot, "poolbalance_snapshot_idx"),
+            (PoolRewardsSnapshot, "poolrewards_snapshot_idx"),
+        ):
+            with self.subTest(model=model.__name__):
+                self.assertSearches(
+                    model.objects.filter(
+                        pool_position__user_address__in=self.user_addresses,
+                        snapshot=self.snapshot,
+                    ),
+                    index,
+                )
+
+    def test_trove_snapshots(self):
+        self.assertSearches(
+            TroveSnapshot.objects.filter(
+                trove__user_address__in=self.user_addresses, snapshot=self.snapshot
+            ),
+            "trovesnapshot_snapshot_idx",
+        )
+
+    def test_portfolio_values(self):
+        self.assertSearches(
+            PortfolioValueSnapshot.objects.filter(
+                snapshot=self.snapshot, user_address__user__username="testuser"
+            )
+            .values_list("user_address__account")
+            .annotate(total=Sum("value_eur"))
+            .order_by(),
+            "sqlite_autoindex_cryptotracker_portfoliovaluesnapshot",
+        )
+
+    def test_last_snapshot(self):
+        plan = self.query_plan(Snapshot.objects.all()[:1])
+        self.assertIn("snapshot_date_idx", " ".join(plan))
+        self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", " ".join(plan))
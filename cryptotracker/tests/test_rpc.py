@@ -0,0 +1,66 @@
+from unittest.mock import MagicMock, patch
+
+from django.test import SimpleTestCase
+
+from cryptotracker.rpc import RPCClient, RPCError, encode_call
+
+
+def rpc_response(payload):
+    response = MagicMock()
+    response.json.return_value = payload
+    return response
+
+
+class RPCClientTests(SimpleTestCase):
+    def setUp(self):
+        self.client = RPCClient("http://localhost:8545")
+
+    def test_encode_call(self):
+        calldata = encode_call(
+            "balanceOf(address)", "0x1234567890abcdef1234567890abcdef12345678"
+        )
+        self.assertEqual(calldata[:4].hex(), "70a08231")
+        self.assertEqual(len(calldata), 36)
+
+    def test_batch_keeps_order_and_counts_calls(self):
+        with patch.object(self.client.session, "post") as post:
+            post.return_value = rpc_response(
+                [
+                    {"jsonrpc": "2.0", "id": 2, "result": "0x2"},
+                    {"jsonrpc": "2.0", "id": 1, "result": "0x1"},
+                ]
+            )
+            results = self.client.batch(
+                [("eth_blockNumber", []), ("eth_blockNumber", [])]
+            )
+        self.assertEqual(results, ["0x1", "0x2"])
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(self.client.stats.calls["eth_blockNumber"], 2)
+        self.assertEqual(self.client.stats.requests, 1)
+
+    def test_batch_errors(self):
+        payload = [
+            {"jsonrpc": "2.0", "id": 1, "error": {"code": 3, "message": "revert"}}
+        ]
+        with patch.object(self.client.session, "post") as post:
+            post.return_value = rpc_response(payload)
+            with self.assertRaises(RPCError):
+                self.client.batch([("eth_call", [])])
+
+            payload[0]["id"] = 2
+            results = self.client.batch([("eth_call", [])], allow_failure=True)
+        self.assertEqual(results, [None])
+        self.assertEqual(self.client.stats.errors["eth_call"], 2)
+
+    def test_rejected_batch_raises(self):
+        with patch.object(self.client.session, "post") as post:
+            post.return_value = rpc_response(
+                {
+                    "jsonrpc": "2.0",
+                    "id": None,
+                    "error": {"code": -32005, "message": "rate limited"},
+                }
+            )
+            with self.assertRaisesMessage(RPCError, "rate limited"):
+                self.client.batch([("eth_call", []), ("eth_call", [])])
+        self.assertEqual(self.client.stats.errors["eth_call"], 2)
@@ -0,0 +1,167 @@
+from datetime import date, datetime, timezone
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from cryptotracker.models import (
+    Network,
+    Snapshot,
+    SnapshotBlock,
+    SnapshotSource,
+    SnapshotUnit,
+)
+from cryptotracker.protocols.subgraph import block_filter
+from cryptotracker.snapshots import (
+    finalize_snapshot,
+    get_snapshot_block,
+    get_snapshot_blocks,
+    get_user_snapshot,
+    mark_snapshot_units,
+    pin_snapshot_blocks,
+    record_user_snapshots,
+    snapshot_index,
+    start_snapshot_source,
+)
+
+
+def complete_snapshot(date):
+    return Snapshot.objects.create(
+        date=date, status=Snapshot.COMPLETE, completed_at=date
+    )
+
+
+class SnapshotBlockTests(TestCase):
+    def setUp(self):
+        self.snapshot = Snapshot.objects.create(date=datetime(2025, 1, 1))
+        Network.objects.create(name="Ethereum", url_rpc="ethereum:mainnet:alchemy")
+        Network.objects.create(name="Arbitrum", url_rpc="arbitrum:mainnet:alchemy")
+        Network.objects.create(name="Offline")
+
+    def test_pin_skips_failing_networks(self):
+        def fetch_block_number(network_choice, finalized=False):
+            if network_choice.startswith("arbitrum"):
+                raise ConnectionError("unreachable")
+            return 21000000
+
+        with patch(
+            "cryptotracker.snapshots.fetch_block_number",
+            side_effect=fetch_block_number,
+        ):
+            blocks = pin_snapshot_blocks(self.snapshot)
+
+        self.assertEqual(blocks, {"ethereum:mainnet:alchemy": 21000000})
+        self.assertEqual(SnapshotBlock.objects.count(), 1)
+        self.assertEqual(get_snapshot_blocks(self.snapshot), blocks)
+        self.assertEqual(
+            get_snapshot_block(self.snapshot, "ethereum:mainnet:alchemy"), 21000000
+        )
+        self.assertEqual(
+            get_snapshot_block(self.snapshot, "arbitrum:mainnet:alchemy"), "latest"
+        )
+
+    def test_block_filter(self):
+        self.assertEqual(block_filter(21000000), "block: {number: 21000000},")
+        self.assertEqual(block_filter("latest"), "")
+
+
+class SnapshotIndexTests(TestCase):
+    def setUp(self):
+        self.snapshots = [
+            complete_snapshot(datetime(2025, 1, day, hour, tzinfo=timezone.utc))
+            for day, hour in ((1, 0), (1, 12), (5, 0))
+        ]
+
+    def test_resolves_exact_or_nearest_earlier_snapshot(self):
+        self.assertEqual(snapshot_index.latest(), self.snapshots[2])
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                snapshot_index.at_or_before(date(2025, 1, 1)), self.snapshots[1]
+            )
+        self.assertEqual(
+            snapshot_index.at_or_before(date(2025, 1, 4)), self.snapshots[1]
+        )
+        self.assertEqual(
+            snapshot_index.at_or_before(date(2025, 1, 5)), self.snapshots[2]
+        )
+        self.assertIsNone(snapshot_index.at_or_before(date(2024, 12, 31)))
+        self.assertEqual(self.snapshots[2].day, date(2025, 1, 5))
+
+    def test_sees_new_and_deleted_snapshots(self):
+        snapshot_index.latest()
+        snapshot = complete_snapshot(datetime(2025, 1, 3, tzinfo=timezone.utc))
+        self.assertEqual(snapshot_index.at_or_before(date(2025, 1, 4)), snapshot)
+
+        snapshot.delete()
+        self.assertEqual(
+            snapshot_index.at_or_before(date(2025, 1, 4)), self.snapshots[1]
+        )
+
+
+class UserSnapshotTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice", password="password")
+        self.bob = User.objects.create_user(username="bob", password="password")
+        self.daily = complete_snapshot(datetime(2025, 1, 1, tzinfo=timezone.utc))
+        record_user_snapshots(self.daily, [self.alice.id, self.bob.id])
+        # Refresh triggered by alice, holding only her rows
+        self.refresh = complete_snapshot(datetime(2025, 1, 2, tzinfo=timezone.utc))
+        record_user_snapshots(self.refresh, [self.alice.id])
+
+    def test_users_get_their_last_complete_snapshot(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_user_snapshot(self.alice), self.refresh)
+        self.assertEqual(get_user_snapshot(self.bob), self.daily)
+        self.assertEqual(get_user_snapshot(self.bob, date(2025, 1, 3)), self.daily)
+        self.assertEqual(get_user_snapshot(self.alice, date(2025, 1, 1)), self.daily)
+        self.assertIsNone(get_user_snapshot(self.alice, date(2024, 12, 31)))
+
+    def test_users_without_snapshots_fall_back_to_the_last_one(self):
+        carol = User.objects.create_user(username="carol", password="password")
+        self.assertEqual(get_user_snapshot(carol), self.refresh)
+
+
+class SnapshotLifecycleTests(TestCase):
+    def setUp(self):
+        self.snapshot = Snapshot.objects.create(
+            date=datetime(2025, 1, 1, tzinfo=timezone.utc)
+        )
+
+    def run_sources(self, failed_source=None):
+        for source, _ in SnapshotSource.SOURCES:
+            start_snapshot_source(self.snapshot, source)
+            mark_snapshot_units(
+                self.snapshot,
+                source,
+                (
+                    SnapshotUnit.FAILED
+                    if source == failed_source
+                    else SnapshotUnit.SUCCEEDED
+                ),
+            )
+
+    def test_complete_snapshot(self):
+        self.assertEqual(self.snapshot.status, Snapshot.PENDING)
+        self.run_sources()
+        self.snapshot.refresh_from_db()
+        self.assertEqual(self.snapshot.status, Snapshot.RUNNING)
+        self.assertIsNone(snapshot_index.latest())
+
+        self.assertEqual(finalize_snapshot(self.snapshot), Snapshot.COMPLETE)
+        self.assertIsNotNone(self.snapshot.completed_at)
+        self.assertEqual(snapshot_index.latest(), self.snapshot)
+
+    def test_partial_snapshot_is_not_read(self):
+        self.run_sources(failed_source="staking")
+
+        self.assertEqual(finalize_snapshot(self.snapshot), Snapshot.PARTIAL)
+        self.assertEqual(
+            SnapshotSource.objects.get(snapshot=self.snapshot, source="staking").failed,
+            1,
+        )
+        self.assertIsNone(snapshot_index.latest())
+
+    def test_missing_source_is_partial(self):
+        start_snapshot_source(self.snapshot, "prices")
+        mark_snapshot_units(self.snapshot, "prices", SnapshotUnit.SUCCEEDED)
+        self.assertEqual(finalize_snapshot(self.snapshot), Snapshot.PARTIAL)
@@ -0,0 +1,666 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone as django_timezone
+
+from cryptotracker import tasks
+from cryptotracker.models import (
+    Account,
+    Cryptocurrency,
+    CryptocurrencyNetwork,
+    Pool,
+    PoolBalanceSnapshot,
+    PortfolioValueSnapshot,
+    Price,
+    Snapshot,
+    SnapshotAssets,
+    SnapshotUnit,
+    TroveSnapshot,
+    UserAddress,
+    ValidatorSnapshot,
+    WalletType,
+)
+from cryptotracker.single_flight import SingleFlight
+from cryptotracker.snapshots import (
+    mark_snapshot_units,
+    record_user_snapshots,
+    start_snapshot_source,
+)
+from cryptotracker.tasks import (
+    reprice_key,
+    reprice_snapshot,
+    request_snapshot_reprice,
+    request_snapshot_update,
+    run_daily_snapshot_update,
+    snapshot_update_key,
+    update_assets_database,
+    update_portfolio_values,
+    update_protocols,
+    update_staking_assets,
+)
+from cryptotracker.valuation import get_portfolio_values
+from cryptotracker.writer import SnapshotWriter
+
+
+class SnapshotFanOutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command("initialize_db")
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword"
+        )
+        account = Account.objects.create(user=self.user, name="Test Account")
+        self.user_addresses = [
+            UserAddress.objects.create(
+                user=self.user,
+                public_address=f"0x{index:040x}",
+                account=account,
+                wallet_type=WalletType.objects.get(name="HOT"),
+            )
+            for index in range(5)
+        ]
+        self.ids = [user_address.id for user_address in self.user_addresses]
+
+    @override_settings(SNAPSHOT_CHUNK_SIZE=2)
+    @patch.object(tasks, "pin_snapshot_blocks")
+    @patch.object(tasks, "chord")
+    def test_run_fans_out_per_source_and_chunk(self, chord, pin_snapshot_blocks):
+        run_daily_snapshot_update(self.user.id)
+
+        [task_group] = chord.call_args.args
+        calls = [(task.task.split(".")[-1], task.args) for task in task_group.tasks]
+        snapshot = Snapshot.objects.get()
+        self.assertEqual(calls[0], ("update_cryptocurrency_price", (snapshot.id,)))
+        self.assertEqual(len(calls), 1 + 3 * 3)
+        self.assertEqual(
+            [args[1] for name, args in calls if name == "update_staking_assets"],
+            [self.ids[0:2], self.ids[2:4], self.ids[4:]],
+        )
+        self.assertEqual(snapshot.status, Snapshot.RUNNING)
+        self.assertEqual(
+            dict(snapshot.sources.values_list("source", "expected")),
+            {
+                "prices": 1,
+                "assets": 5,
+                "staking": 5,
+                "protocols": 5,
+            },
+        )
+
+    @patch.object(tasks, "pin_snapshot_blocks")
+    @patch.object(tasks, "chord")
+    def test_chunk_size_argument(self, chord, pin_snapshot_blocks):
+        run_daily_snapshot_update(self.user.id, chunk_size=5)
+
+        [task_group] = chord.call_args.args
+        self.assertEqual(len(task_group.tasks), 1 + 3)
+
+    def start_run(self):
+        snapshot = Snapshot.objects.create(
+            date=datetime(2025, 1, 1, tzinfo=timezone.utc)
+        )
+        with SnapshotWriter(snapshot) as writer:
+            writer.add_price(Cryptocurrency.objects.get(name="ethereum"), Decimal(3000))
+        start_snapshot_source(snapshot, "prices")
+        for source in ("assets", "staking", "protocols"):
+            start_snapshot_source(snapshot, source, self.ids)
+        return snapshot
+
+    def succeed_units(self, snapshot, *sources):
+        mark_snapshot_units(snapshot, "prices", SnapshotUnit.SUCCEEDED)
+        for source in sources:
+            mark_snapshot_units(snapshot, source, SnapshotUnit.SUCCEEDED, self.ids)
+
+    def fetch_staking_assets(self, failing):
+        def fetch_staking_assets(user_address, snapshot, writer):
+            if user_address in failing:
+                raise ConnectionError("unreachable")
+            writer.add_validator(
+                user_address,
+                user_address.id,
+                f"0x{user_address.id}",
+                "2023-01-01",
+                Decimal("32"),
+                "active",
+                0,
+            )
+
+        return patch.object(tasks, "fetch_staking_assets", fetch_staking_assets)
+
+    def test_finalizer_collects_unit_outcomes(self):
+        snapshot = self.start_run()
+        self.succeed_units(snapshot, "assets", "protocols")
+        failing = self.user_addresses[3]
+
+        with self.fetch_staking_assets([failing]):
+            outcomes = [
+                update_staking_assets(snapshot.id, self.ids[:2]),
+                update_staking_assets(snapshot.id, self.ids[2:]),
+            ]
+        self.assertEqual(outcomes[1]["failed"], [failing.id])
+
+        update_portfolio_values(outcomes, snapshot.id, self.user.id)
+
+        snapshot.refresh_from_db()
+        self.assertEqual(snapshot.status, Snapshot.PARTIAL)
+        staking = snapshot.sources.get(source="staking")
+        self.assertEqual((staking.succeeded, staking.failed), (4, 1))
+        self.assertEqual(snapshot.sources.get(source="assets").succeeded, 5)
+        self.assertEqual(
+            snapshot.units.get(source="staking", user_address=failing).status,
+            SnapshotUnit.FAILED,
+        )
+
+    @patch.object(tasks, "update_uniswap_v3_positions")
+    @patch.object(tasks, "update_lqty_pools")
+    def test_failed_networks_fail_their_units(self, update_lqty_pools, update_uniswap):
+        snapshot = self.start_run()
+
+        with patch.object(tasks, "fetch_assets_batch", return_value=["Base"]):
+            assets = update_assets_database(snapshot.id, self.ids)
+        with patch.object(
+            tasks,
+            "update_aave_lending_pools_batch",
+            return_value=[Pool.objects.first()],
+        ):
+            protocols = update_protocols(snapshot.id, self.ids)
+
+        self.assertEqual((assets["succeeded"], assets["failed"]), ([], self.ids))
+        self.assertEqual((protocols["succeeded"], protocols["failed"]), ([], self.ids))
+        self.assertFalse(
+            snapshot.units.filter(status=SnapshotUnit.SUCCEEDED)
+            .exclude(source="prices")
+            .exists()
+        )
+
+    @override_settings(SNAPSHOT_RETRY_BACKOFF=0)
+    def test_subtask_retries_failed_units_only(self):
+        snapshot = self.start_run()
+        failing = self.user_addresses[4]
+        attempts = []
+
+        def fetch_staking_assets(user_address, snapshot, writer):
+            attempts.append(user_address.id)
+            if len(attempts) == 4:
+                raise ConnectionError("unreachable")
+
+        with patch.object(tasks, "fetch_staking_assets", fetch_staking_assets):
+            outcome = update_staking_assets.apply((snapshot.id, self.ids[1:])).get()
+
+        self.assertEqual(attempts, self.ids[1:] + [failing.id])
+        self.assertEqual(outcome["succeeded"], [failing.id])
+        unit = snapshot.units.get(source="staking", user_address=failing)
+        self.assertEqual((unit.status, unit.attempts), (SnapshotUnit.SUCCEEDED, 2))
+
+    @patch.object(tasks, "chord")
+    def test_resume_runs_failed_units_into_the_same_snapshot(self, chord):
+        snapshot = self.start_run()
+        self.succeed_units(snapshot, "assets", "protocols")
+        failing = self.user_addresses[3]
+        with self.fetch_staking_assets([failing]):
+            outcomes = [update_staking_assets(snapshot.id, self.ids)]
+        update_portfolio_values(outcomes, snapshot.id, None)
+
+        call_command("resume_snapshot", stdout=StringIO())
+
+        [task_group] = chord.call_args.args
+        self.assertEqual(
+            [(task.task.split(".")[-1], task.args) for task in task_group.tasks],
+            [("update_staking_assets", (snapshot.id, [failing.id]))],
+        )
+        snapshot.refresh_from_db()
+        self.assertEqual(snapshot.status, Snapshot.RUNNING)
+
+        with self.fetch_staking_assets([]):
+            outcomes = [update_staking_assets(snapshot.id, [failing.id])]
+        update_portfolio_values(outcomes, snapshot.id, None)
+
+        snapshot.refresh_from_db()
+        self.assertEqual(snapshot.status, Snapshot.COMPLETE)
+        self.assertEqual(ValidatorSnapshot.objects.filter(snapshot=snapshot).count(), 5)
+        self.assertEqual(
+            PortfolioValueSnapshot.objects.filter(snapshot=snapshot).count(), 5
+        )
+
+
+class SingleFlightTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command("initialize_db")
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword"
+        )
+        UserAddress.objects.create(
+            user=self.user,
+            public_address="0x1234567890abcdef1234567890abcdef12345678",
+            account=Account.objects.create(user=self.user, name="Test Account"),
+            wallet_type=WalletType.objects.get(name="HOT"),
+        )
+        self.flights = SingleFlight()
+        patcher = patch.object(tasks, "get_single_flight", return_value=self.flights)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_claims(self):
+        self.assertIsNone(self.flights.claim("key", "first"))
+        self.assertEqual(self.flights.claim("key", "second"), "first")
+        self.flights.release("key", "second")
+        self.assertEqual(self.flights.holder("key"), "first")
+        self.flights.release("key", "first")
+        self.assertIsNone(self.flights.holder("key"))
+
+        expired = SingleFlight(ttl=0)
+        expired.claim("key", "first")
+        self.assertIsNone(expired.claim("key", "second"))
+
+    @patch.object(tasks, "run_daily_snapshot_update")
+    def test_concurrent_refreshes_attach_to_the_run_in_flight(self, run):
+        group_id = request_snapshot_update(self.user.id)
+        self.assertEqual(request_snapshot_update(self.user.id), group_id)
+
+        run.delay.assert_called_once()
+        self.assertEqual(run.delay.call_args.kwargs["group_id"], group_id)
+        flight_key = run.delay.call_args.kwargs["flight_key"]
+        self.assertEqual(self.flights.holder(flight_key), group_id)
+
+        # The finalizer of the run releases its claim
+        snapshot = Snapshot.objects.create(
+            date=datetime(2025, 1, 1, tzinfo=timezone.utc)
+        )
+        update_portfolio_values(
+            [], snapshot.id, self.user.id, flight_key=flight_key, group_id=group_id
+        )
+        self.assertIsNone(self.flights.holder(flight_key))
+
+    @patch.object(tasks, "run_daily_snapshot_update")
+    def test_refresh_attaches_to_the_run_of_every_user(self, run):
+        group_id = request_snapshot_update()
+        self.assertEqual(request_snapshot_update(self.user.id), group_id)
+        run.delay.assert_called_once_with(
+            None,
+            group_id=group_id,
+            flight_key=snapshot_update_key(None),
+            user_address_ids=None,
+            sources=None,
+        )
+
+    @patch.object(tasks, "run_daily_snapshot_update")
+    def test_fresh_snapshot_is_reused(self, run):
+        now = django_timezone.now()
+        snapshot = Snapshot.objects.create(
+            date=now, status=Snapshot.COMPLETE, completed_at=now
+        )
+        start_snapshot_source(
+            snapshot, "assets", tasks.get_user_address_ids(self.user.id)
+        )
+        record_user_snapshots(snapshot, [self.user.id])
+
+        self.assertIsNone(request_snapshot_update(self.user.id))
+        run.delay.assert_not_called()
+
+        with override_settings(SNAPSHOT_FRESHNESS=0):
+            self.assertIsNotNone(request_snapshot_update(self.user.id))
+        run.delay.assert_called_once()
+
+    @patch.object(tasks, "run_daily_snapshot_update")
+    def test_fresh_snapshot_does_not_cover_a_new_address(self, run):
+        now = django_timezone.now()
+        snapshot = Snapshot.objects.create(
+            date=now, status=Snapshot.COMPLETE, completed_at=now
+        )
+        start_snapshot_source(
+            snapshot, "assets", tasks.get_user_address_ids(self.user.id)
+        )
+        record_user_snapshots(snapshot, [self.user.id])
+        UserAddress.objects.create(
+            user=self.user,
+            public_address="0xabcdefabcdefabcdefabcdefabcdefabcdefabcd",
+            account=Account.objects.get(user=self.user),
+            wallet_type=WalletType.objects.get(name="HOT"),
+        )
+
+        self.assertIsNotNone(request_snapshot_update(self.user.id))
+        run.delay.assert_called_once()
+
+    @patch.object(tasks, "create_snapshot", side_effect=ConnectionError("RPC down"))
+    def test_failed_run_releases_its_claim(self, create_snapshot):
+        flight_key = snapshot_update_key(None)
+        self.flights.claim(flight_key, "group")
+
+        with self.assertRaises(ConnectionError):
+            run_daily_snapshot_update(group_id="group", flight_key=flight_key)
+        self.assertIsNone(self.flights.holder(flight_key))
+
+    @patch.object(tasks, "reprice_snapshot")
+    def test_concurrent_reprices_attach_to_the_reprice_in_flight(self, reprice):
+        group_id = request_snapshot_reprice(self.user.id)
+        self.assertEqual(request_snapshot_reprice(self.user.id), group_id)
+        reprice.delay.assert_called_once_with(
+            self.user.id, group_id=group_id, flight_key=reprice_key(self.user.id)
+        )
+
+        # The reprice releases its claim once finished
+        reprice_snapshot(
+            self.user.id, group_id=group_id, flight_key=reprice_key(self.user.id)
+        )
+        self.assertIsNone(self.flights.holder(reprice_key(self.user.id)))
+
+    @patch.object(tasks, "reprice_snapshot")
+    @patch.object(tasks, "run_daily_snapshot_update")
+    def test_reprice_attaches_to_the_snapshot_update_in_flight(self, run, reprice):
+        group_id = request_snapshot_update()
+        self.assertEqual(request_snapshot_reprice(self.user.id), group_id)
+        reprice.delay.assert_not_called()
+
+    @patch.object(tasks, "run_daily_snapshot_update")
+    def test_fresh_reprice_does_not_skip_a_refresh(self, run):
+        now = django_timezone.now()
+        snapshot = Snapshot.objects.create(
+            date=now,
+            status=Snapshot.COMPLETE,
+            completed_at=now,
+            refreshed_sources=[],
+            refreshed_addresses=[],
+        )
+        record_user_snapshots(snapshot, [self.user.id])
+
+        self.assertIsNotNone(request_snapshot_update(self.user.id))
+        run.delay.assert_called_once()
+
+
+class ScopedRefreshTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command("initialize_db")
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword"
+        )
+        account = Account.objects.create(user=self.user, name="Test Account")
+        self.hot, self.cold = [
+            UserAddress.objects.create(
+                user=self.user,
+                public_address=f"0x{index:040x}",
+                account=account,
+                wallet_type=WalletType.objects.get(name="HOT"),
+            )
+            for index in range(2)
+        ]
+        date = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        self.previous = Snapshot.objects.create(
+            date=date, status=Snapshot.COMPLETE, completed_at=date
+        )
+        ethereum = Cryptocurrency.objects.get(name="ethereum")
+        aave = Pool.objects.filter(protocol_network__protocol__name="Aave v3").first()
+        liquity = Pool.objects.filter(
+            protocol_network__protocol__name="Liquity v1"
+        ).first()
+        with SnapshotWriter(self.previous) as writer:
+            for user_address in (self.hot, self.cold):
+                writer.add_asset(
+                    CryptocurrencyNetwork.objects.filter(
+                        cryptocurrency=ethereum
+                    ).first(),
+                    user_address,
+                    Decimal("1"),
+                )
+                writer.add_validator(
+                    user_address,
+                    user_address.id,
+                    f"0x{user_address.id}",
+                    "2023-01-01",
+                    Decimal("32"),
+                    "active",
+                    0,
+                )
+            writer.add_pool_balance(aave, self.hot, "ETH", Decimal("2"))
+            writer.add_pool_balance(liquity, self.hot, "ETH", Decimal("3"))
+
+    @patch.object(tasks, "pin_snapshot_blocks")
+    @patch.object(tasks, "chord")
+    def test_scoped_refresh_carries_the_rest_forward(self, chord, pin_snapshot_blocks):
+        run_daily_snapshot_update(
+            self.user.id, user_address_ids=[self.hot.id], sources=["tokens", "aave"]
+        )
+
+        snapshot = Snapshot.objects.exclude(id=self.previous.id).get()
+        [task_group] = chord.call_args.args
+        self.assertEqual(
+            [
+                (task.task.split(".")[-1], task.args, task.kwargs)
+                for task in task_group.tasks
+            ],
+            [
+                ("update_cryptocurrency_price", (snapshot.id,), {}),
+                ("update_assets_database", (snapshot.id, [self.hot.id]), {}),
+                (
+                    "update_protocols",
+                    (snapshot.id, [self.hot.id]),
+                    {"protocols": ["aave"]},
+                ),
+            ],
+        )
+        self.assertEqual(
+            list(
+                SnapshotAssets.objects.filter(snapshot=snapshot).values_list(
+                    "user_address", flat=True
+                )
+            ),
+            [self.cold.id],
+        )
+        self.assertEqual(ValidatorSnapshot.objects.filter(snapshot=snapshot).count(), 2)
+        self.assertEqual(
+            list(
+                PoolBalanceSnapshot.objects.filter(snapshot=snapshot).values_list(
+                    "pool_position__pool__protocol_network__protocol__name",
+                    "quantity",
+                )
+            ),
+            [("Liquity v1", Decimal("3"))],
+        )
+        self.assertEqual(
+            sorted(
+                snapshot.units.exclude(status=SnapshotUnit.SUCCEEDED).values_list(
+                    "source", "user_address"
+                ),
+                key=str,
+            ),
+            sorted(
+                [
+                    ("assets", self.hot.id),
+                    ("prices", None),
+                    ("protocols", self.hot.id),
+                ],
+                key=str,
+            ),
+        )
+
+    @patch.object(tasks, "pin_snapshot_blocks")
+    @patch.object(tasks, "chord")
+    def test_scoped_refresh_without_previous_snapshot_updates_all(
+        self, chord, pin_snapshot_blocks
+    ):
+        self.previous.delete()
+        run_daily_snapshot_update(self.user.id, sources=["staking"])
+
+        [task_group] = chord.call_args.args
+        self.assertEqual(len(task_group.tasks), 4)
+        self.assertNotIn("protocols", task_group.tasks[-1].kwargs)
+
+    @patch.object(tasks, "pin_snapshot_blocks")
+    @patch.object(tasks, "chord")
+    def test_run_of_every_user_carries_forward_the_snapshot_of_each_user(
+        self, chord, pin_snapshot_blocks
+    ):
+        other = User.objects.create_user(username="other", password="testpassword")
+        other_address = UserAddress.objects.create(
+            user=other,
+            public_address="0xabcdefabcdefabcdefabcdefabcdefabcdefabcd",
+            account=Account.objects.create(user=other, name="Other Account"),
+            wallet_type=WalletType.objects.get(name="HOT"),
+        )
+        date = datetime(2025, 1, 2, tzinfo=timezone.utc)
+        other_snapshot = Snapshot.objects.create(
+            date=date, status=Snapshot.COMPLETE, completed_at=date
+        )
+        with SnapshotWriter(other_snapshot) as writer:
+            writer.add_asset(
+                CryptocurrencyNetwork.objects.first(), other_address, Decimal("1")
+            )
+        record_user_snapshots(self.previous, [self.user.id])
+        record_user_snapshots(other_snapshot, [other.id])
+
+        run_daily_snapshot_update(sources=["staking"])
+
+        snapshot = Snapshot.objects.order_by("-id").first()
+        self.assertEqual(
+            sorted(
+                SnapshotAssets.objects.filter(snapshot=snapshot).values_list(
+                    "user_address", flat=True
+                )
+            ),
+            [self.hot.id, self.cold.id, other_address.id],
+        )
+        self.assertEqual(snapshot.refreshed_sources, ["staking"])
+
+    @patch.object(tasks, "run_daily_snapshot_update")
+    def test_fresh_scoped_snapshot_only_covers_its_scope(self, run):
+        now = django_timezone.now()
+        snapshot = Snapshot.objects.create(
+            date=now,
+            status=Snapshot.COMPLETE,
+            completed_at=now,
+            refreshed_sources=["tokens"],
+            refreshed_addresses=[self.hot.id],
+        )
+        record_user_snapshots(snapshot, [self.user.id])
+
+        with patch.object(tasks, "get_single_flight", return_value=SingleFlight()):
+            self.assertIsNone(
+                request_snapshot_update(self.user.id, [self.hot.id], ["tokens"])
+            )
+            self.assertIsNotNone(
+                request_snapshot_update(self.user.id, [self.cold.id], ["tokens"])
+            )
+            self.assertIsNotNone(request_snapshot_update(self.user.id))
+        self.assertEqual(run.delay.call_count, 2)
+
+    @patch.object(tasks, "pin_snapshot_blocks")
+    def test_reprice_values_the_latest_quantities(self, pin_snapshot_blocks):
+        names = Cryptocurrency.objects.values_list("name", flat=True)
+        with patch.object(
+            tasks,
+            "fetch_cryptocurrency_price",
+            return_value={name: {"eur": Decimal("4000")} for name in names},
+        ) as fetch_prices:
+            reprice_snapshot(self.user.id)
+
+        fetch_prices.assert_called_once()
+        pin_snapshot_blocks.assert_not_called()
+        snapshot = Snapshot.objects.exclude(id=self.previous.id).get()
+        self.assertEqual(snapshot.status, Snapshot.COMPLETE)
+        self.assertEqual(snapshot.refreshed_sources, [])
+        self.assertEqual(snapshot.refreshed_addresses, [])
+        self.assertEqual(SnapshotAssets.objects.filter(snapshot=snapshot).count(), 2)
+        self.assertEqual(
+            PoolBalanceSnapshot.objects.filter(snapshot=snapshot).count(), 2
+        )
+        self.assertEqual(
+            get_portfolio_values(snapshot, "category", category="staking"),
+            {"staking": Decimal("256000")},
+        )
+
+    @patch.object(tasks, "pin_snapshot_blocks")
+    def test_reprice_values_carried_troves_at_the_new_prices(self, pin_snapshot_blocks):
+        ethereum = Cryptocurrency.objects.get(name="ethereum")
+        liquity = Pool.objects.filter(
+            protocol_network__protocol__name="Liquity v1"
+        ).first()
+        with SnapshotWriter(self.previous) as writer:
+            writer.add_trove(
+                self.hot,
+                liquity,
+                "1",
+                ethereum,
+                Decimal("2"),
+                Decimal("1000"),
+                Decimal("3000"),
+                Decimal("5"),
+            )
+
+        prices = {
+            name: {"eur": Decimal("4000")}
+            for name in Cryptocurrency.objects.values_list("name", flat=True)
+        }
+        prices["liquity-bold-2"] = {"eur": Decimal("1")}
+        with patch.object(tasks, "fetch_cryptocurrency_price", return_value=prices):
+            reprice_snapshot(self.user.id)
+
+        snapshot = Snapshot.objects.exclude(id=self.previous.id).get()
+        self.assertEqual(
+            TroveSnapshot.objects.get(snapshot=snapshot).balance, Decimal("7000")
+        )
+
+    @patch.object(tasks, "pin_snapshot_blocks")
+    def test_reprice_of_every_user_skips_users_without_snapshot(
+        self, pin_snapshot_blocks
+    ):
+        other = User.objects.create_user(username="other", password="testpassword")
+        UserAddress.objects.create(
+            user=other,
+            public_address="0xabcdefabcdefabcdefabcdefabcdefabcdefabcd",
+            account=Account.objects.create(user=other, name="Other Account"),
+            wallet_type=WalletType.objects.get(name="HOT"),
+        )
+        names = Cryptocurrency.objects.values_list("name", flat=True)
+        with patch.object(
+            tasks,
+            "get_user_snapshot",
+            side_effect=lambda user: self.previous if user.id == self.user.id else None,
+        ), patch.object(
+            tasks,
+            "fetch_cryptocurrency_price",
+            return_value={name: {"eur": Decimal("4000")} for name in names},
+        ):
+            reprice_snapshot()
+
+        snapshot = Snapshot.objects.exclude(id=self.previous.id).get()
+        self.assertEqual(snapshot.status, Snapshot.COMPLETE)
+        self.assertEqual(
+            set(snapshot.units.values_list("user_address", flat=True)),
+            {None, self.hot.id, self.cold.id},
+        )
+
+    @patch("cryptotracker.utils.request_price_backfill")
+    @patch.object(tasks, "pin_snapshot_blocks")
+    def test_reprice_with_partial_prices_makes_one_request(
+        self, pin_snapshot_blocks, request_price_backfill
+    ):
+        Price.objects.create(
+            cryptocurrency=Cryptocurrency.objects.get(name="ethereum"),
+            price=Decimal("3000"),
+            snapshot=self.previous,
+        )
+        with patch.object(
+            tasks, "fetch_cryptocurrency_price", return_value={}
+        ) as fetch_prices, patch("cryptotracker.utils.fetch_historical_price") as fetch:
+            reprice_snapshot(self.user.id)
+
+        fetch_prices.assert_called_once()
+        fetch.assert_not_called()
+        snapshot = Snapshot.objects.exclude(id=self.previous.id).get()
+        self.assertEqual(snapshot.status, Snapshot.PARTIAL)
+        self.assertEqual(
+            get_portfolio_values(snapshot, "category", category="staking"),
+            {"staking": Decimal("192000")},
+        )
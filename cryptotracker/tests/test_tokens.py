@@ -0,0 +1,75 @@
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+
+from cryptotracker import tokens
+from cryptotracker.chain_pool import ChainPool
+from cryptotracker.models import (
+    Account,
+    Network,
+    Snapshot,
+    SnapshotAssets,
+    UserAddress,
+    WalletType,
+)
+from cryptotracker.tokens import fetch_assets_batch, get_network_tokens
+
+
+def scan_every_pair(network_choice, network_tokens, public_addresses, block):
+    return {
+        (address, token.id): 10**18
+        for address in public_addresses
+        for token in network_tokens
+    }
+
+
+class FetchAssetsBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command("initialize_db")
+
+    def setUp(self):
+        user = User.objects.create_user(username="testuser", password="testpassword")
+        account = Account.objects.create(user=user, name="Test Account")
+        self.user_addresses = [
+            UserAddress.objects.create(
+                user=user,
+                public_address=f"0x{index:040x}",
+                account=account,
+                wallet_type=WalletType.objects.get(name="HOT"),
+            )
+            for index in range(2)
+        ]
+        self.snapshot = Snapshot.objects.create(
+            date=datetime(2025, 1, 1, tzinfo=timezone.utc)
+        )
+
+    def test_each_network_is_scanned_once_for_every_address(self):
+        tokens_by_network = get_network_tokens()
+        networks = [
+            network.url_rpc
+            for network in Network.objects.all()
+            if tokens_by_network.get(network.id)
+        ]
+        with patch.object(
+            tokens, "scan_network_balances", side_effect=scan_every_pair
+        ) as scan:
+            with ChainPool(networks) as pool:
+                fetch_assets_batch(self.user_addresses, self.snapshot, chain_pool=pool)
+
+        self.assertEqual(
+            sorted(call.args[0] for call in scan.call_args_list), sorted(networks)
+        )
+        for call in scan.call_args_list:
+            self.assertEqual(
+                call.args[2],
+                [address.public_address for address in self.user_addresses],
+            )
+        self.assertEqual(
+            SnapshotAssets.objects.filter(snapshot=self.snapshot).count(),
+            2
+            * sum(len(network_tokens) for network_tokens in tokens_by_network.values()),
+        )
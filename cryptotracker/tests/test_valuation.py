@@ -0,0 +1,284 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from cryptotracker import valuation
+from cryptotracker.models import (
+    Account,
+    Cryptocurrency,
+    CryptocurrencyNetwork,
+    Pool,
+    PortfolioValueSnapshot,
+    Price,
+    Snapshot,
+    SnapshotUnit,
+    UserAddress,
+    WalletType,
+)
+from cryptotracker.snapshots import (
+    mark_snapshot_units,
+    record_user_snapshots,
+    snapshot_index,
+    start_snapshot_source,
+)
+from cryptotracker.tasks import backfill_price, update_portfolio_values
+from cryptotracker.valuation import (
+    PortfolioValuation,
+    get_portfolio_breakdowns,
+    get_portfolio_values,
+)
+from cryptotracker.views import calculate_total_value
+from cryptotracker.writer import SnapshotWriter
+
+
+class PortfolioValuationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command("initialize_db")
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="testpassword"
+        )
+        self.user_address = UserAddress.objects.create(
+            user=self.user,
+            public_address="0x1234567890abcdef1234567890abcdef12345678",
+            account=Account.objects.create(user=self.user, name="Test Account"),
+            wallet_type=WalletType.objects.get(name="HOT"),
+        )
+        date = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        self.snapshot = Snapshot.objects.create(
+            date=date, status=Snapshot.COMPLETE, completed_at=date
+        )
+        start_snapshot_source(self.snapshot, "prices")
+        mark_snapshot_units(self.snapshot, "prices", SnapshotUnit.SUCCEEDED)
+        for source in ("assets", "staking", "protocols"):
+            start_snapshot_source(self.snapshot, source, [self.user_address.id])
+            mark_snapshot_units(
+                self.snapshot, source, SnapshotUnit.SUCCEEDED, [self.user_address.id]
+            )
+        ethereum = Cryptocurrency.objects.get(name="ethereum")
+        with SnapshotWriter(self.snapshot) as writer:
+            writer.add_price(ethereum, Decimal("3000"))
+            writer.add_asset(
+                CryptocurrencyNetwork.objects.filter(cryptocurrency=ethereum).first(),
+                self.user_address,
+                Decimal("2"),
+            )
+            writer.add_validator(
+                self.user_address, 7, "0xabc", "2023-01-01", Decimal("32"), "active", 1
+            )
+            writer.add_trove(
+                self.user_address,
+                Pool.objects.first(),
+                "1",
+                ethereum,
+                Decimal("1"),
+                Decimal("1000"),
+                Decimal("2000"),
+                Decimal("5"),
+            )
+        # Load the snapshot index, as in a running process
+        snapshot_index.latest()
+
+    def test_total_is_the_sum_of_line_items(self):
+        portfolio = PortfolioValuation([self.user_address], self.snapshot)
+
+        self.assertEqual(
+            [item.category for item in portfolio.line_items],
+            ["assets", "staking", "troves"],
+        )
+        self.assertEqual(portfolio.total, Decimal("6000") + Decimal("96000") + 2000)
+        self.assertEqual(
+            calculate_total_value([self.user_address], self.snapshot), portfolio.total
+        )
+        self.assertEqual(portfolio.stale_prices, {})
+
+    def test_portfolio_view_aggregates_once(self):
+        self.client.login(username="testuser", password="testpassword")
+        with patch.object(
+            valuation,
+            "fetch_aggregated_assets",
+            wraps=valuation.fetch_aggregated_assets,
+        ) as fetch_assets:
+            response = self.client.get(reverse("portfolio"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(fetch_assets.call_count, 1)
+        self.assertContains(response, "104,000.00")
+
+    def test_no_snapshot(self):
+        Snapshot.objects.all().delete()
+        self.assertEqual(PortfolioValuation([self.user_address]).total, Decimal(0))
+
+    def test_portfolio_values_are_stored_by_category(self):
+        self.assertEqual(
+            update_portfolio_values([], self.snapshot.id, self.user.id),
+            "Stored 3 portfolio values.",
+        )
+
+        values = PortfolioValueSnapshot.objects.get(category="staking")
+        self.assertEqual(values.value_eur, Decimal("96000"))
+        [line_item] = values.line_items
+        self.assertEqual(line_item["label"], "ethereum")
+        self.assertEqual(Decimal(line_item["value_eur"]), Decimal("96000"))
+        with self.assertNumQueries(2):
+            self.assertEqual(
+                get_portfolio_values(self.snapshot, "user_address__account"),
+                {self.user_address.account_id: Decimal("104000")},
+            )
+
+    def test_statistics_view_sums_stored_values(self):
+        update_portfolio_values([], self.snapshot.id, None)
+        self.client.login(username="testuser", password="testpassword")
+        with patch.object(valuation, "PortfolioValuation") as portfolio_valuation:
+            response = self.client.get(reverse("statistics"))
+
+        self.assertEqual(response.status_code, 200)
+        portfolio_valuation.assert_not_called()
+        self.assertEqual(response.context["hot_wallets_value"], Decimal("104000"))
+
+    def test_breakdowns_come_from_one_query(self):
+        update_portfolio_values([], self.snapshot.id, None)
+        # Finalizing the snapshot reset the index
+        snapshot_index.latest()
+        with self.assertNumQueries(3):
+            breakdowns = get_portfolio_breakdowns(
+                None,
+                ["user_address__wallet_type__name", "user_address__account"],
+                user_address__user=self.user,
+            )
+
+        self.assertEqual(
+            breakdowns,
+            {
+                "user_address__wallet_type__name": {"HOT": Decimal("104000")},
+                "user_address__account": {
+                    self.user_address.account_id: Decimal("104000")
+                },
+            },
+        )
+
+    def test_statistics_queries_do_not_grow_with_accounts(self):
+        update_portfolio_values([], self.snapshot.id, None)
+        self.client.login(username="testuser", password="testpassword")
+        with CaptureQueriesContext(connection) as one_account:
+            self.client.get(reverse("statistics"))
+
+        for index in range(5):
+            UserAddress.objects.create(
+                user=self.user,
+                public_address=f"0x{index:040x}",
+                account=Account.objects.create(user=self.user, name=f"Account {index}"),
+                wallet_type=WalletType.objects.get(name="COLD"),
+            )
+        update_portfolio_values([], self.snapshot.id, self.user.id)
+        with CaptureQueriesContext(connection) as six_accounts:
+            self.client.get(reverse("statistics"))
+
+        self.assertEqual(len(six_accounts), len(one_account))
+
+    def test_lazy_values_are_limited_to_the_requested_addresses(self):
+        other = User.objects.create_user(username="other", password="testpassword")
+        UserAddress.objects.create(
+            user=other,
+            public_address="0xabcdefabcdefabcdefabcdefabcdefabcdefabcd",
+            account=Account.objects.create(user=other, name="Other Account"),
+            wallet_type=WalletType.objects.get(name="HOT"),
+        )
+
+        self.assertEqual(
+            get_portfolio_values(
+                self.snapshot, "user_address", user_address__user=self.user
+            ),
+            {self.user_address.id: Decimal("104000")},
+        )
+        self.assertEqual(
+            set(PortfolioValueSnapshot.objects.values_list("user_address", flat=True)),
+            {self.user_address.id},
+        )
+
+    def test_user_addresses_are_valued_once(self):
+        empty = UserAddress.objects.create(
+            user=self.user,
+            public_address="0xabcdefabcdefabcdefabcdefabcdefabcdefabcd",
+            account=self.user_address.account,
+            wallet_type=WalletType.objects.get(name="HOT"),
+        )
+        update_portfolio_values([], self.snapshot.id, self.user.id)
+        self.assertEqual(
+            PortfolioValueSnapshot.objects.get(user_address=empty).value_eur,
+            Decimal("0"),
+        )
+
+        with patch.object(
+            valuation, "PortfolioValuation", wraps=valuation.PortfolioValuation
+        ) as portfolio_valuation:
+            get_portfolio_values(
+                self.snapshot, "user_address", user_address__user=self.user
+            )
+            portfolio_valuation.assert_not_called()
+
+            # A user_address added later is valued on its own
+            added = UserAddress.objects.create(
+                user=self.user,
+                public_address="0x0000000000000000000000000000000000000001",
+                account=self.user_address.account,
+                wallet_type=WalletType.objects.get(name="HOT"),
+            )
+            values = get_portfolio_values(
+                self.snapshot, "user_address", user_address__user=self.user
+            )
+        portfolio_valuation.assert_called_once()
+        self.assertEqual(portfolio_valuation.call_args.args[0], [added])
+        self.assertEqual(values[added.id], Decimal("0"))
+
+    @patch("cryptotracker.utils.request_price_backfill")
+    def test_finalizer_values_missing_prices_without_fetching(
+        self, request_price_backfill
+    ):
+        Price.objects.filter(snapshot=self.snapshot).delete()
+        with patch("cryptotracker.utils.fetch_historical_price") as fetch:
+            update_portfolio_values([], self.snapshot.id, self.user.id)
+
+        fetch.assert_not_called()
+        request_price_backfill.assert_called()
+        self.snapshot.refresh_from_db()
+        self.assertEqual(self.snapshot.status, Snapshot.COMPLETE)
+
+    @patch("cryptotracker.utils.request_price_backfill")
+    def test_backfilled_price_values_the_snapshot_again(self, request_price_backfill):
+        Price.objects.filter(snapshot=self.snapshot).delete()
+        self.assertEqual(
+            get_portfolio_values(self.snapshot, "category", category="staking"),
+            {"staking": Decimal("0")},
+        )
+
+        with patch(
+            "cryptotracker.tasks.fetch_historical_price", return_value=Decimal("3000")
+        ):
+            backfill_price("ethereum", self.snapshot.date.isoformat())
+
+        self.assertEqual(
+            get_portfolio_values(self.snapshot, "category", category="staking"),
+            {"staking": Decimal("96000")},
+        )
+
+    def test_command_values_the_snapshots_without_values(self):
+        record_user_snapshots(self.snapshot, [self.user.id])
+
+        call_command("materialize_portfolio_values", stdout=StringIO())
+
+        self.assertEqual(
+            get_portfolio_values(self.snapshot, "user_address"),
+            {self.user_address.id: Decimal("104000")},
+        )
+        self.assertEqual(PortfolioValueSnapshot.objects.count(), 3)
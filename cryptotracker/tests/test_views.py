@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 from django.contrib.auth.models import User
 from django.core.management import call_command
 from django.test import TestCase
@@ -100,6 +102,26 @@ class CryptoTrackerViewTests(TestCase):
         response = self.client.get(reverse("refresh"))
         self.assertEqual(response.status_code, 302)  # Redirect to waiting page
 
+    def test_refresh_view_rejects_unknown_scope(self):
+        response = self.client.get(reverse("refresh"), {"source": "compound"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse("refresh"), {"address": "0xunknown"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_reprice_view_enqueues_a_reprice(self):
+        response = self.client.get(reverse("reprice"))
+        self.assertEqual(response.status_code, 405)
+
+        with patch(
+            "cryptotracker.views.request_snapshot_reprice", return_value="group"
+        ) as request_reprice:
+            response = self.client.post(reverse("reprice"))
+        self.assertRedirects(
+            response, reverse("waiting_page"), fetch_redirect_response=False
+        )
+        request_reprice.assert_called_once_with(self.user.id)
+        self.assertEqual(self.client.session["task_group_id"], "group")
+
     def test_statistics_view(self):
         response = self.client.get(reverse("statistics"))
         self.assertEqual(response.status_code, 200)
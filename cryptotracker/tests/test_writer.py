@@ -0,0 +1,97 @@
+from datetime import datetime
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+
+from cryptotracker.models import (
+    Account,
+    Cryptocurrency,
+    Pool,
+    PoolBalanceSnapshot,
+    PoolPosition,
+    PoolRewardsSnapshot,
+    Snapshot,
+    UserAddress,
+    Validator,
+    ValidatorSnapshot,
+    WalletType,
+)
+from cryptotracker.writer import SnapshotWriter
+
+
+class SnapshotWriterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command("initialize_db")
+
+    def setUp(self):
+        user = User.objects.create_user(username="testuser", password="testpassword")
+        self.user_address = UserAddress.objects.create(
+            user=user,
+            public_address="0x1234567890abcdef1234567890abcdef12345678",
+            account=Account.objects.create(user=user, name="Test Account"),
+            wallet_type=WalletType.objects.get(name="HOT"),
+        )
+        self.snapshot = Snapshot.objects.create(date=datetime(2025, 1, 1))
+        self.pool = Pool.objects.first()
+        self.token = Cryptocurrency.objects.first()
+
+    def test_flush_resolves_pool_positions_once(self):
+        PoolPosition.objects.create(pool=self.pool, user_address=self.user_address)
+        with SnapshotWriter(self.snapshot) as writer:
+            writer.add_pool_balance(
+                self.pool, self.user_address, self.token.symbol, Decimal("1.5")
+            )
+            writer.add_pool_balance(
+                self.pool,
+                self.user_address,
+                self.token.symbol,
+                Decimal("0.1"),
+                is_reward=True,
+            )
+            writer.add_pool_balance(
+                self.pool,
+                self.user_address,
+                self.token.symbol,
+                Decimal("2"),
+                position_id="42",
+            )
+            writer.add_pool_balance(
+                self.pool, self.user_address, "UNKNOWN", Decimal("3")
+            )
+            self.assertEqual(PoolBalanceSnapshot.objects.count(), 0)
+
+        self.assertEqual(PoolPosition.objects.count(), 2)
+        self.assertEqual(PoolBalanceSnapshot.objects.count(), 2)
+        self.assertEqual(PoolRewardsSnapshot.objects.count(), 1)
+        self.assertEqual(len(writer), 0)
+
+    def test_exit_discards_rows_when_the_block_raised(self):
+        with self.assertRaises(RuntimeError):
+            with SnapshotWriter(self.snapshot) as writer:
+                writer.add_pool_balance(
+                    self.pool, self.user_address, self.token.symbol, Decimal("1.5")
+                )
+                raise RuntimeError("RPC error")
+
+        self.assertEqual(PoolBalanceSnapshot.objects.count(), 0)
+        self.assertEqual(len(writer), 0)
+
+    def test_flush_keeps_existing_validators(self):
+        for balance in (Decimal("32"), Decimal("33")):
+            with SnapshotWriter(self.snapshot) as writer:
+                writer.add_validator(
+                    self.user_address, 7, "0xabc", "2023-01-01", balance, "active", 1
+                )
+
+        self.assertEqual(Validator.objects.count(), 1)
+        self.assertEqual(
+            list(
+                ValidatorSnapshot.objects.order_by("balance").values_list(
+                    "balance", flat=True
+                )
+            ),
+            [Decimal("32"), Decimal("33")],
+        )
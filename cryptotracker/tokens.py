@@ -1,10 +1,10 @@
 import logging
-from typing import Optional
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
 
 from decimal import Decimal
 
-from ape import Contract, networks
-
+from cryptotracker.chain_pool import ChainPool, LocalChainRunner
 from cryptotracker.models import (
     CryptocurrencyNetwork,
     Network,
@@ -12,53 +12,168 @@ from cryptotracker.models import (
     SnapshotAssets,
     UserAddress,
 )
-from cryptotracker.utils import get_last_price
+from cryptotracker.multicall import (
+    fetch_balances,
+    fetch_balances_without_multicall,
+    multicall_available,
+)
+from cryptotracker.rpc import BlockIdentifier, get_rpc_client
+from cryptotracker.snapshots import get_snapshot_blocks
+from cryptotracker.utils import PriceBook
+from cryptotracker.writer import SnapshotWriter, snapshot_writer
 
 
-def fetch_assets(user_address: UserAddress, snapshot: Snapshot) -> None:
+def get_network_tokens() -> Dict[int, List[CryptocurrencyNetwork]]:
     """
-    Fetches the assets of a user from the Ethereum blockchain and stores them in the database.
-    This function uses the Ape library to interact with the Ethereum blockchain and fetch the balance of each token.
-    It also fetches the current price of each token using the fetch_historical_price function from Coingeko app
+    Loads the tracked tokens of every network with a single query.
+    Returns:
+        dict: A dictionary mapping each network ID to its CryptocurrencyNetwork objects.
+    """
+    tokens_by_network: Dict[int, List[CryptocurrencyNetwork]] = defaultdict(list)
+    for token in CryptocurrencyNetwork.objects.select_related(
+        "cryptocurrency", "network"
+    ):
+        if not token.token_address:
+            logging.warning(
+                f"Token {token.cryptocurrency.name} does not have a token address on network {token.network.name}"
+            )
+            continue
+        tokens_by_network[token.network_id].append(token)
+    return tokens_by_network
+
+
+def scan_network_balances(
+    network_choice: str,
+    tokens: List[CryptocurrencyNetwork],
+    public_addresses: List[str],
+    block: BlockIdentifier = "latest",
+) -> Dict[Tuple[str, int], int]:
+    """
+    Fetches the balance of every (address, token) pair of a network in one pass.
+    The balances are read with aggregated Multicall3 calls, falling back to
+    JSON-RPC batches of single calls on networks without Multicall3.
+    Args:
+        network_choice (str): The Ape network choice of the network.
+        tokens (list): The CryptocurrencyNetwork objects of the network.
+        public_addresses (list): The addresses holding the balances.
+        block (int|str): The block number or tag to read at.
+    Returns:
+        dict: The non-zero raw balances keyed by (public_address, CryptocurrencyNetwork ID).
+    """
+    client = get_rpc_client(network_choice)
+    pairs = [(address, token) for address in public_addresses for token in tokens]
+    queries = [
+        (None if token.token_address == "NativeToken" else token.token_address, address)
+        for address, token in pairs
+    ]
+    if multicall_available(client, block):
+        balances = fetch_balances(
+            lambda to, data: client.eth_call(to, data, block), queries
+        )
+    else:
+        logging.warning(
+            f"Multicall3 not available on {network_choice}, fetching balances one by one"
+        )
+        balances = fetch_balances_without_multicall(client, queries, block)
+
+    return {
+        (address, token.id): balance
+        for (address, token), balance in zip(pairs, balances)
+        if balance
+    }
+
 
+def fetch_assets_batch(
+    user_addresses: List[UserAddress],
+    snapshot: Snapshot,
+    chain_pool: Optional[ChainPool] = None,
+    writer: Optional[SnapshotWriter] = None,
+) -> List[str]:
     """
-    crypto_networks = Network.objects.all()
-    for network in crypto_networks:
-        with networks.parse_network_choice(network.url_rpc) as provider:
-            public_address = user_address.public_address
-            # Fetch tokens balance
-            for token in CryptocurrencyNetwork.objects.filter(network=network):
-                if token.token_address == "NativeToken":
-                    logging.info(
-                        f"Fetching balance for Ethereum on network {network.name}"
-                    )
-                    token_asset = provider.get_balance(public_address)
-                else:
-                    if not token.token_address:
-                        logging.warning(
-                            f"Token {token.cryptocurrency.name} does not have a token address on network {network.name}"
-                        )
-                        continue
-                    token_contract = Contract(token.token_address)
-                    token_asset = token_contract.balanceOf(public_address)
-
-                if token_asset != 0:
-                    asset_snapshot = SnapshotAssets(
-                        cryptocurrency=token,
-                        user_address=user_address,
-                        quantity=token_asset / 1e18,
-                        snapshot=snapshot,
-                    )
-                    asset_snapshot.save()
+    Fetches the assets of a list of user_addresses and stores them in the database.
+    Each network is opened once and the balances of all the addresses are fetched
+    through the same batched pipeline.
+    Args:
+        user_addresses (list): A list of UserAddress objects.
+        snapshot (Snapshot): The Snapshot to associate with the assets.
+        chain_pool (ChainPool, optional): Pool fetching the networks concurrently.
+            If not provided, the networks are fetched one after another.
+        writer (SnapshotWriter, optional): The writer buffering the snapshot rows,
+            a new one is flushed at the end if not provided.
+    Returns:
+        list: The names of the networks whose balances could not be fetched.
+    """
+    public_addresses = sorted({address.public_address for address in user_addresses})
+    if not public_addresses:
+        return []
+    tokens_by_network = get_network_tokens()
+    blocks = get_snapshot_blocks(snapshot)
+    runner = chain_pool or LocalChainRunner()
+
+    scans = {}
+    for network in Network.objects.all():
+        tokens = tokens_by_network.get(network.id)
+        if not tokens or not network.url_rpc:
+            continue
+        logging.info(
+            f"Fetching {len(tokens)} tokens for {len(public_addresses)} addresses on network {network.name}"
+        )
+        scans[network] = runner.submit(
+            network.url_rpc,
+            scan_network_balances,
+            tokens,
+            public_addresses,
+            blocks.get(network.url_rpc, "latest"),
+        )
+
+    failed_networks: List[str] = []
+    with snapshot_writer(snapshot, writer) as writer:
+        for network, scan in scans.items():
+            try:
+                balances = scan.result()
+            except Exception as e:
+                logging.error(f"Error fetching balances on network {network.name}: {e}")
+                failed_networks.append(network.name)
+                continue
+
+            for user_address in user_addresses:
+                for token in tokens_by_network[network.id]:
+                    balance = balances.get((user_address.public_address, token.id))
+                    if balance:
+                        writer.add_asset(token, user_address, balance / 1e18)
+    return failed_networks
+
+
+def fetch_assets(
+    user_address: UserAddress,
+    snapshot: Snapshot,
+    writer: Optional[SnapshotWriter] = None,
+) -> List[str]:
+    """
+    Fetches the assets of a user from the Ethereum blockchain and stores them in the database.
+    The balances are read through the batched Multicall3 pipeline of fetch_assets_batch.
+    Args:
+        user_address (UserAddress): The UserAddress object.
+        snapshot (Snapshot): The Snapshot to associate with the assets.
+        writer (SnapshotWriter, optional): The writer buffering the snapshot rows,
+            a new one is flushed at the end if not provided.
+    Returns:
+        list: The names of the networks whose balances could not be fetched.
+    """
+    return fetch_assets_batch([user_address], snapshot, writer=writer)
 
 
 def fetch_aggregated_assets(
-    user_addresses: list[UserAddress], snapshot: Optional[Snapshot] = None
+    user_addresses: list[UserAddress],
+    snapshot: Optional[Snapshot] = None,
+    prices: Optional[PriceBook] = None,
 ) -> dict:
     """
     Fetches the aggregated assets of a list of user_addresses.
     Args:
         user_addresses (list): A list of UserAddress objects.
+        snapshot (Snapshot, optional): The snapshot to read, the last one if not provided.
+        prices (PriceBook, optional): The prices shared by the caller.
     Returns:
         dict: A dictionary containing the aggregated assets and their values.
     """
@@ -70,11 +185,13 @@ def fetch_aggregated_assets(
     # Filter assets for the given user_addresses and snapshot date
     last_assets = SnapshotAssets.objects.filter(
         user_address__in=user_addresses, snapshot=snapshot
-    )
+    ).select_related("cryptocurrency__cryptocurrency", "cryptocurrency__network")
 
     if not last_assets.exists():
         return {}
 
+    prices = prices or PriceBook(snapshot)
+
     # Aggregate assets by cryptocurrency and network
     aggregated_assets: dict = {}
     for asset in last_assets:
@@ -86,7 +203,7 @@ def fetch_aggregated_assets(
         key = f"{symbol}_{network.name}"
 
         # Fetch the current price
-        current_price = get_last_price(token.name, snapshot.date)
+        current_price = prices.get(token.name, snapshot.date)
 
         # Update or initialize the aggregated data
         if key not in aggregated_assets:
@@ -11,6 +11,7 @@ from cryptotracker.views import (
     home,
     portfolio,
     refresh,
+    reprice,
     sign_up,
     staking,
     statistics,
@@ -51,6 +52,7 @@ urlpatterns = [
         name="delete_account",
     ),
     path("refresh/", refresh, name="refresh"),
+    path("refresh/prices/", reprice, name="reprice"),
     path("staking/", staking, name="staking"),
     path(
         "user_address/<str:id>/edit/",
@@ -1,13 +1,19 @@
 import logging
-from datetime import date, datetime
+import threading
+from datetime import date, datetime, time, timezone
 from decimal import Decimal
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import backoff
 import requests
 
 
-from cryptotracker.models import Cryptocurrency, Price
+from django.core.cache import cache
+
+from cryptotracker.models import HistoricalPrice, Price, Snapshot
+
+# Minimum interval in seconds between two backfill requests of the same price
+PRICE_BACKFILL_INTERVAL = 600
 
 
 def log_backoff(details):
@@ -48,11 +54,63 @@ def APIquery(url: str, params: Dict) -> Optional[Dict]:
     return response.json()
 
 
+class HistoricalPriceCache:
+    """
+    Persistent cache of the daily historical prices, stored in the HistoricalPrice
+    table shared by the web and Celery processes.
+    A past daily price never changes, so it is fetched from the API only once.
+    """
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, crypto_id: str, date: date, currency: str) -> Optional[Decimal]:
+        price = (
+            HistoricalPrice.objects.filter(
+                coin_id=crypto_id, date=date, currency=currency
+            )
+            .values_list("price", flat=True)
+            .first()
+        )
+        if price is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return price
+
+    def set_many(self, prices: Iterable[Tuple[str, date, str, Decimal]]) -> None:
+        """
+        Stores (crypto_id, date, currency, price) entries, keeping the existing ones.
+        """
+        HistoricalPrice.objects.bulk_create(
+            [
+                HistoricalPrice(
+                    coin_id=crypto_id, date=date, currency=currency, price=price
+                )
+                for crypto_id, date, currency, price in prices
+            ],
+            ignore_conflicts=True,
+        )
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": self.hit_ratio}
+
+
+historical_price_cache = HistoricalPriceCache()
+
+
 def fetch_historical_price(
     crypto_id: str, date: date, currency: str = "eur"
 ) -> Optional[Decimal]:
     """
     Fetches historical price data for a cryptocurrency from the Coingecko API.
+    The price is read from the historical price cache when it was already fetched.
     Args:
         crypto_id (str): The ID of the cryptocurrency.
         date (datetime.date): The date for which to fetch the historical price.
@@ -60,13 +118,57 @@ def fetch_historical_price(
     Returns:
         Decimal: The historical price of the cryptocurrency, or None if the request fails.
     """
+    cached_price = historical_price_cache.get(crypto_id, date, currency)
+    if cached_price is not None:
+        return cached_price
+
     url = f"https://api.coingecko.com/api/v3/coins/{crypto_id}/history"
     params = {"date": date.strftime("%d-%m-%Y")}
 
     data = APIquery(url, params)
     if data is None:
         return None
-    return Decimal(data["market_data"]["current_price"][currency])
+    price = Decimal(str(data["market_data"]["current_price"][currency]))
+    historical_price_cache.set_many([(crypto_id, date, currency, price)])
+    return price
+
+
+def fetch_price_range(
+    crypto_id: str, start: datetime, end: datetime, currency: str = "eur"
+) -> Optional[List[Tuple[datetime, Decimal]]]:
+    """
+    Fetches the price history of a cryptocurrency between two dates from the
+    Coingecko API in a single request. Ranges longer than 90 days have one price
+    per day, shorter ones one per hour.
+    Args:
+        crypto_id (str): The ID of the cryptocurrency.
+        start (datetime): The start of the range.
+        end (datetime): The end of the range.
+        currency (str): The currency in which to fetch the prices (default is "eur").
+    Returns:
+        list: (timestamp, price) tuples sorted by timestamp, or None if the request fails.
+    """
+    url = f"https://api.coingecko.com/api/v3/coins/{crypto_id}/market_chart/range"
+    params = {
+        "vs_currency": currency,
+        "from": int(start.timestamp()),
+        "to": int(end.timestamp()),
+    }
+
+    data = APIquery(url, params)
+    if data is None:
+        return None
+    points = sorted(
+        (datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc), Decimal(str(price)))
+        for timestamp, price in data["prices"]
+    )
+    # The points at midnight UTC are the daily prices of the history endpoint
+    historical_price_cache.set_many(
+        (crypto_id, timestamp.date(), currency, price)
+        for timestamp, price in points
+        if timestamp.time() == time(0)
+    )
+    return points
 
 
 def fetch_cryptocurrency_price(
@@ -109,28 +211,112 @@ def convertWeiIntStr(value: int) -> str:
     return f"{value_decimal.normalize():,.3f} ether"
 
 
-def get_last_price(crypto_id: str, snapshot: datetime) -> Decimal:
+class PriceBook:
     """
-    Fetches the last price of a cryptocurrency from the database or API if not found.
-    Args:
-        crypto_id (str): The ID of the cryptocurrency.
-        snapshot (datetime): The date of the snapshot.
-    Returns:
-        Decimal: The last price of the cryptocurrency.
-    """
-    cryptocurrency = Cryptocurrency.objects.get(name=crypto_id)
-    current_price = Price.objects.filter(
-        cryptocurrency=cryptocurrency, snapshot__date=snapshot
-    ).first()
-
-    if not current_price:
-        # Fetch historical price if not found in the database
-        historical_price = fetch_historical_price(crypto_id, snapshot.date())
-        if historical_price:
-            return historical_price
-        else:
-            raise ValueError(
-                f"Price data for {crypto_id} on {snapshot.date()} not found."
+    Price matrix of the cryptocurrencies keyed by snapshot date.
+    The prices of a date are loaded with a single query the first time they are
+    needed, so valuing many rows of a snapshot costs one query in total.
+    Share one PriceBook across the valuation code of a request or task.
+    With fetch_missing disabled (page rendering) a missing price is replaced by
+    the nearest stored one, flagged in stale, and its backfill is enqueued
+    instead of calling the API.
+    """
+
+    def __init__(self, snapshot: Optional[Snapshot] = None, fetch_missing: bool = True):
+        self.snapshot = snapshot
+        self.fetch_missing = fetch_missing
+        # Cryptocurrencies valued with the nearest stored price, and its date
+        self.stale: Dict[str, Optional[datetime]] = {}
+        self._prices: Dict[datetime, Dict[str, Decimal]] = {}
+        if snapshot is not None:
+            self._load(snapshot.date)
+
+    def _load(self, snapshot_date: datetime) -> Dict[str, Decimal]:
+        if snapshot_date not in self._prices:
+            self._prices[snapshot_date] = dict(
+                Price.objects.filter(snapshot__date=snapshot_date).values_list(
+                    "cryptocurrency__name", "price"
+                )
             )
+        return self._prices[snapshot_date]
 
-    return current_price.price
+    def get(self, crypto_id: str, snapshot_date: Optional[datetime] = None) -> Decimal:
+        """
+        Returns the price of a cryptocurrency at a snapshot date, fetching the
+        historical price from the API if it is not stored and fetch_missing is set.
+        Args:
+            crypto_id (str): The ID of the cryptocurrency.
+            snapshot_date (datetime, optional): The date of the snapshot, the date of
+                the PriceBook snapshot if not provided.
+        Returns:
+            Decimal: The price of the cryptocurrency.
+        """
+        if snapshot_date is None:
+            if self.snapshot is None:
+                raise ValueError("A snapshot date is required without a snapshot.")
+            snapshot_date = self.snapshot.date
+        prices = self._load(snapshot_date)
+
+        if crypto_id not in prices and not self.fetch_missing:
+            prices[crypto_id] = self._nearest_price(crypto_id, snapshot_date)
+        elif crypto_id not in prices:
+            # Fetch historical price if not found in the database
+            historical_price = fetch_historical_price(crypto_id, snapshot_date.date())
+            if not historical_price:
+                raise ValueError(
+                    f"Price data for {crypto_id} on {snapshot_date.date()} not found."
+                )
+            prices[crypto_id] = historical_price
+
+        return prices[crypto_id]
+
+    def _nearest_price(self, crypto_id: str, snapshot_date: datetime) -> Decimal:
+        """
+        Returns the stored price closest to the date, preferring earlier ones,
+        and enqueues the backfill of the exact price. Returns 0 if the
+        cryptocurrency has no stored price at all.
+        """
+        prices = Price.objects.filter(cryptocurrency__name=crypto_id).select_related(
+            "snapshot"
+        )
+        nearest = (
+            prices.filter(snapshot__date__lte=snapshot_date)
+            .order_by("-snapshot__date")
+            .first()
+            or prices.filter(snapshot__date__gt=snapshot_date)
+            .order_by("snapshot__date")
+            .first()
+        )
+        self.stale[crypto_id] = nearest.snapshot.date if nearest else None
+        request_price_backfill(crypto_id, snapshot_date)
+        if nearest is None:
+            logging.warning(f"No stored price for {crypto_id}, valued at 0")
+            return Decimal(0)
+        return nearest.price
+
+
+def request_price_backfill(crypto_id: str, snapshot_date: datetime) -> None:
+    """
+    Enqueues the background fetch of a missing price, at most once every
+    PRICE_BACKFILL_INTERVAL seconds per cryptocurrency and date.
+    The task is sent from a separate thread so an unreachable broker never
+    delays the page being rendered.
+    """
+    key = f"price_backfill:{crypto_id}:{snapshot_date.isoformat()}"
+    if not cache.add(key, True, timeout=PRICE_BACKFILL_INTERVAL):
+        return
+    threading.Thread(
+        target=_send_price_backfill,
+        args=(crypto_id, snapshot_date.isoformat()),
+        daemon=True,
+    ).start()
+
+
+def _send_price_backfill(crypto_id: str, snapshot_date: str) -> None:
+    # Imported here: the tasks module imports this one
+    from cryptotracker.tasks import backfill_price
+
+    try:
+        backfill_price.apply_async(args=[crypto_id, snapshot_date], retry=False)
+    except Exception as e:
+        logging.warning(f"Could not enqueue the price backfill of {crypto_id}: {e}")
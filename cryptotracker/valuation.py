@@ -0,0 +1,272 @@
+import logging
+from collections import defaultdict
+from decimal import Decimal
+from functools import cached_property
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Union
+
+from django.db import transaction
+from django.db.models import QuerySet, Sum
+
+from cryptotracker.eth_staking import get_aggregated_staking
+from cryptotracker.models import (
+    PortfolioValueSnapshot,
+    Snapshot,
+    TroveSnapshot,
+    UserAddress,
+)
+from cryptotracker.protocols.protocols import PoolData, get_protocols_snapshots
+from cryptotracker.snapshots import snapshot_index
+from cryptotracker.tokens import fetch_aggregated_assets
+from cryptotracker.utils import PriceBook
+
+
+class LineItem(NamedTuple):
+    category: str
+    label: str
+    value_eur: Decimal
+
+
+class PortfolioValuation:
+    """
+    Valuation of a set of user_addresses at a snapshot.
+    The assets, staking, protocol pools and troves are aggregated once, with a
+    single PriceBook, and the total is the sum of the resulting line items.
+    Build one per request and hand it to every consumer of the page.
+    """
+
+    def __init__(
+        self,
+        user_addresses: List[UserAddress],
+        snapshot: Optional[Snapshot] = None,
+        prices: Optional[PriceBook] = None,
+    ):
+        """
+        Args:
+            user_addresses (list): A list of UserAddress objects.
+            snapshot (Snapshot, optional): The snapshot to value, the last one if not provided.
+            prices (PriceBook, optional): The prices shared by the caller, stored
+                prices only if not provided.
+        """
+        self.user_addresses = list(user_addresses)
+        self.snapshot = snapshot or snapshot_index.latest()
+        self.prices = prices or PriceBook(self.snapshot, fetch_missing=False)
+        self.assets: dict = {}
+        self.staking: Optional[Dict[str, Union[int, Decimal]]] = None
+        self.protocols: Dict[str, List[PoolData]] = {}
+        self.troves: List[TroveSnapshot] = []
+
+        if self.snapshot is None:
+            logging.warning("No snapshot available for calculating total value.")
+            return
+        if not self.user_addresses:
+            return
+
+        self.assets = fetch_aggregated_assets(
+            self.user_addresses, snapshot=self.snapshot, prices=self.prices
+        )
+        self.staking = get_aggregated_staking(
+            self.user_addresses, snapshot=self.snapshot, prices=self.prices
+        )
+        protocols = get_protocols_snapshots(
+            self.user_addresses, snapshot=self.snapshot, prices=self.prices
+        )
+        self.protocols = protocols["pool_data"]
+        self.troves = list(protocols["troves"])
+
+    @cached_property
+    def line_items(self) -> List[LineItem]:
+        """
+        Returns the EUR value of every asset, staking, pool and trove position.
+        """
+        items = [
+            LineItem("assets", key, asset["amount_eur"])
+            for key, asset in self.assets.items()
+        ]
+        if self.staking:
+            items.append(
+                LineItem("staking", "ethereum", Decimal(self.staking["balance_eur"]))
+            )
+        for protocol, pools in self.protocols.items():
+            items.extend(
+                LineItem(
+                    "protocols",
+                    f"{protocol}:{pool.pool_position.id}",
+                    pool.balance_eur or Decimal(0),
+                )
+                for pool in pools
+            )
+        items.extend(
+            LineItem("troves", trove.trove.trove_id, trove.balance)
+            for trove in self.troves
+        )
+        return items
+
+    @property
+    def total(self) -> Decimal:
+        return sum((item.value_eur for item in self.line_items), Decimal(0))
+
+    @property
+    def stale_prices(self) -> dict:
+        return self.prices.stale
+
+
+def materialize_portfolio_values(
+    snapshot: Snapshot,
+    user_addresses: Optional[List[UserAddress]] = None,
+    prices: Optional[PriceBook] = None,
+) -> int:
+    """
+    Stores the value of each category of positions of the user_addresses in the
+    snapshot, replacing the values stored before. A user_address without any
+    position gets a zero assets value, so every valued user_address has a row.
+    Args:
+        snapshot (Snapshot): The snapshot to value.
+        user_addresses (list, optional): The user_addresses to value, all if not provided.
+        prices (PriceBook, optional): The prices shared by the caller, stored
+            prices only if not provided.
+    Returns:
+        int: The number of PortfolioValueSnapshot rows stored.
+    """
+    if user_addresses is None:
+        user_addresses = list(UserAddress.objects.all())
+    prices = prices or PriceBook(snapshot, fetch_missing=False)
+
+    rows = []
+    for user_address in user_addresses:
+        valuation = PortfolioValuation([user_address], snapshot, prices)
+        categories = defaultdict(list)
+        for item in valuation.line_items:
+            categories[item.category].append(item)
+        if not categories:
+            # Marks the user_address as valued
+            categories["assets"] = []
+        for category, items in categories.items():
+            rows.append(
+                PortfolioValueSnapshot(
+                    snapshot=snapshot,
+                    user_address=user_address,
+                    category=category,
+                    value_eur=sum((item.value_eur for item in items), Decimal(0)),
+                    line_items=[
+                        {"label": item.label, "value_eur": str(item.value_eur)}
+                        for item in items
+                    ],
+                )
+            )
+
+    with transaction.atomic():
+        PortfolioValueSnapshot.objects.filter(
+            snapshot=snapshot, user_address__in=user_addresses
+        ).delete()
+        PortfolioValueSnapshot.objects.bulk_create(rows)
+    logging.info(f"Stored {len(rows)} portfolio values of snapshot {snapshot.id}")
+    return len(rows)
+
+
+def rematerialize_portfolio_values(snapshots: Iterable[Snapshot]) -> int:
+    """
+    Values again the user_addresses with stored values in the snapshots, once a
+    missing price of the snapshots was stored, so the values built from the
+    nearest stored price are replaced.
+    Args:
+        snapshots (iterable): The snapshots whose prices were stored.
+    Returns:
+        int: The number of PortfolioValueSnapshot rows stored.
+    """
+    stored = 0
+    for snapshot in snapshots:
+        user_addresses = list(
+            UserAddress.objects.filter(
+                portfoliovaluesnapshot__snapshot=snapshot
+            ).distinct()
+        )
+        if user_addresses:
+            stored += materialize_portfolio_values(
+                snapshot, user_addresses, PriceBook(snapshot, fetch_missing=False)
+            )
+    return stored
+
+
+def _stored_values(
+    snapshot: Snapshot, **filters: Any
+) -> QuerySet[PortfolioValueSnapshot]:
+    """
+    Returns the stored values of a snapshot matching the filters. The
+    user_addresses matched by the filters without any stored value in the
+    snapshot are materialized first with stored prices, so a user_address is
+    only valued on a page once.
+    """
+    address_filters = {}
+    for lookup, value in filters.items():
+        if lookup.split("__")[0] != "user_address":
+            continue
+        field = lookup.removeprefix("user_address").removeprefix("__")
+        if field in ("", "exact", "in"):
+            # Lookups on the user_address itself
+            field = f"pk__{field or 'exact'}"
+        address_filters[field] = value
+    unvalued = list(
+        UserAddress.objects.filter(**address_filters).exclude(
+            portfoliovaluesnapshot__snapshot=snapshot
+        )
+    )
+    if unvalued:
+        materialize_portfolio_values(
+            snapshot, unvalued, prices=PriceBook(snapshot, fetch_missing=False)
+        )
+    return PortfolioValueSnapshot.objects.filter(snapshot=snapshot, **filters)
+
+
+def get_portfolio_values(
+    snapshot: Optional[Snapshot], group_by: str, **filters: Any
+) -> Dict[Any, Decimal]:
+    """
+    Returns the stored value of a snapshot summed by a field, with one query.
+    The user_addresses matched by the filters are materialized first with stored
+    prices if the snapshot has no value of theirs.
+    Args:
+        snapshot (Snapshot): The snapshot to read, the last one if not provided.
+        group_by (str): The PortfolioValueSnapshot field to group by, e.g. "user_address".
+        filters: Lookups restricting the PortfolioValueSnapshot rows.
+    Returns:
+        dict: The summed EUR value keyed by the group_by field.
+    """
+    snapshot = snapshot or snapshot_index.latest()
+    if snapshot is None:
+        return {}
+    return dict(
+        _stored_values(snapshot, **filters)
+        .values_list(group_by)
+        .annotate(total=Sum("value_eur"))
+        .order_by()
+    )
+
+
+def get_portfolio_breakdowns(
+    snapshot: Optional[Snapshot], group_by: Sequence[str], **filters: Any
+) -> Dict[str, Dict[Any, Decimal]]:
+    """
+    Returns the stored value of a snapshot summed by each of several fields,
+    from a single query grouped by all of them.
+    Args:
+        snapshot (Snapshot): The snapshot to read, the last one if not provided.
+        group_by (list): The PortfolioValueSnapshot fields to sum by.
+        filters: Lookups restricting the PortfolioValueSnapshot rows.
+    Returns:
+        dict: For each field, the summed EUR value keyed by the field value.
+    """
+    breakdowns: Dict[str, Dict[Any, Decimal]] = {field: {} for field in group_by}
+    snapshot = snapshot or snapshot_index.latest()
+    if snapshot is None:
+        return breakdowns
+    rows = (
+        _stored_values(snapshot, **filters)
+        .values_list(*group_by)
+        .annotate(total=Sum("value_eur"))
+        .order_by()
+    )
+    for *keys, total in rows:
+        for field, key in zip(group_by, keys):
+            breakdown = breakdowns[field]
+            breakdown[key] = breakdown.get(key, Decimal(0)) + total
+    return breakdowns
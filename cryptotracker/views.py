@@ -9,19 +9,20 @@ from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
-from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.http import Http404, HttpRequest, HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
+from django.views.decorators.http import require_POST
 from web3 import Web3
 
 from cryptotracker.form import AccountForm, UserAddressForm, Dateform, SignUpForm, GenerateInviteCodeForm
 from cryptotracker.models import Account, Snapshot, UserAddress, SnapshotError, InviteCode
-from cryptotracker.protocols.protocols import get_protocols_snapshots
-from cryptotracker.eth_staking import get_aggregated_staking, get_last_validators
-from cryptotracker.tasks import run_daily_snapshot_update
-from cryptotracker.tokens import fetch_aggregated_assets
-from cryptotracker.constants import WALLET_TYPES
-from cryptotracker.utils import get_last_price
+from cryptotracker.eth_staking import get_last_validators
+from cryptotracker.snapshots import get_user_snapshot
+from cryptotracker.tasks import request_snapshot_reprice, request_snapshot_update
+from cryptotracker.constants import REFRESH_SOURCES, WALLET_TYPES
+from cryptotracker.utils import PriceBook
+from cryptotracker.valuation import PortfolioValuation, get_portfolio_breakdowns, get_portfolio_values
 
 # Create your views here.
 
@@ -29,31 +30,13 @@ from cryptotracker.utils import get_last_price
 def calculate_total_value(
     user_addresses: List[UserAddress],
     snapshot: Optional[Snapshot] = None,
+    prices: Optional[PriceBook] = None,
 ) -> Decimal:
     """
     Helper function to calculate the total value for a given set of user_addresses.
+    Views showing the line items as well should build a PortfolioValuation instead.
     """
-    if not snapshot:
-        snapshot = Snapshot.objects.first()
-        if not snapshot:
-            logging.warning("No snapshot available for calculating total value.")
-            return Decimal(0)
-    aggregated_assets = fetch_aggregated_assets(user_addresses, snapshot=snapshot)
-    total_eth_staking = get_aggregated_staking(user_addresses, snapshot=snapshot)
-    total_protocols = get_protocols_snapshots(user_addresses, snapshot=snapshot)
-
-    total_value = Decimal(0)
-    for asset in aggregated_assets.values():
-        total_value += asset["amount_eur"]
-    if total_eth_staking:
-        total_value += total_eth_staking["balance_eur"]
-    if total_protocols:
-        for protocol_pools in total_protocols["pool_data"].values():
-            total_value += sum(data.balance_eur for data in protocol_pools)
-        if total_protocols["troves"]:
-            for trove in total_protocols["troves"]:
-                total_value += trove.balance
-    return total_value
+    return PortfolioValuation(user_addresses, snapshot, prices).total
 
 
 def sign_up(request: HttpRequest) -> HttpResponse:
@@ -97,20 +80,21 @@ def portfolio(request: HttpRequest, date_str: Optional[str] = None) -> HttpRespo
     date = None
     user_addresses = list(UserAddress.objects.filter(user=user))
     snapshot = None
-    last_snapshot = Snapshot.objects.first()
+    last_snapshot = get_user_snapshot(user)
     last_snapshot_date = last_snapshot.date if last_snapshot else None
 
     if date_str:
-        # If a date is provided, filter the snapshots by that date
+        # If a date is provided, use the snapshot of that date or the nearest earlier one
         date = datetime.strptime(date_str, "%Y-%m-%d")
         last_snapshot_date = date
-        snapshot = Snapshot.objects.filter(date__date=date).first()
+        snapshot = get_user_snapshot(user, date.date())
         if not snapshot:
-            # If no snapshot exists for the given date, use the most recent one
+            # If no snapshot exists up to the given date, use the most recent one
             error_warning = "No snapshot found for the given date. Using the most recent snapshot instead."
-            snapshot = None
-            last_snapshot = Snapshot.objects.first()
             last_snapshot_date = last_snapshot.date if last_snapshot else None
+        elif snapshot.day != date.date():
+            error_warning = "No snapshot found for the given date. Using the closest earlier snapshot instead."
+            last_snapshot_date = snapshot.date
 
     if request.method == "POST":
         form = Dateform(request.POST)
@@ -120,10 +104,8 @@ def portfolio(request: HttpRequest, date_str: Optional[str] = None) -> HttpRespo
     else:
         form = Dateform(initial={"date": date})
 
-    aggregated_assets = fetch_aggregated_assets(user_addresses, snapshot=snapshot)
-    total_eth_staking = get_aggregated_staking(user_addresses, snapshot=snapshot)
-    total_protocols = get_protocols_snapshots(user_addresses, snapshot=snapshot)
-    portfolio_value = calculate_total_value(user_addresses, snapshot=snapshot)
+    # Aggregated once with stored prices, the total is the sum of the line items on the page
+    valuation = PortfolioValuation(user_addresses, snapshot=snapshot or last_snapshot)
     error_logs = (
         SnapshotError.objects.filter(snapshot=last_snapshot) if last_snapshot else []
     )
@@ -131,15 +113,16 @@ def portfolio(request: HttpRequest, date_str: Optional[str] = None) -> HttpRespo
     context = {
         "form3": form,
         "user": request.user,
-        "assets": aggregated_assets,
-        "staking": total_eth_staking,
-        "protocols": total_protocols["pool_data"],
-        "troves": total_protocols["troves"],
+        "assets": valuation.assets,
+        "staking": valuation.staking,
+        "protocols": valuation.protocols,
+        "troves": valuation.troves,
         "user_addresses": user_addresses,
-        "portfolio_value": f"{portfolio_value:,.2f}",
+        "portfolio_value": f"{valuation.total:,.2f}",
         "last_snapshot": last_snapshot_date,
         "error_warning": error_warning,
         "errors": error_logs,
+        "stale_prices": valuation.stale_prices,
     }
 
     return render(request, "portfolio.html", context)
@@ -150,7 +133,7 @@ def staking(request: HttpRequest) -> HttpResponse:
     user = cast(User, request.user)
 
     user_addresses = list(UserAddress.objects.filter(user=user))
-    snapshot = Snapshot.objects.first()
+    snapshot = get_user_snapshot(user)
     if snapshot:
         validators = get_last_validators(user_addresses, snapshot=snapshot)
     else:
@@ -169,9 +152,9 @@ def accounts(request: HttpRequest) -> HttpResponse:
     accounts = list(Account.objects.filter(user=user))
 
     if accounts:
+        account_values = get_portfolio_values(get_user_snapshot(user), "user_address__account", user_address__account__in=accounts)
         for account in accounts:
-            user_addresses = list(UserAddress.objects.filter(account=account))
-            account_value = calculate_total_value(user_addresses)
+            account_value = account_values.get(account.id, Decimal(0))
             account_detail = {
                 "account": account,
                 "balance": f"{account_value:,.2f}",
@@ -221,8 +204,9 @@ def user_addresses(request: HttpRequest) -> HttpResponse:
     addresses_detail = []
     user = cast(User, request.user)  # Ensure user is cast to User explicitly
     user_addresses = list(UserAddress.objects.filter(user=user))
+    address_values = get_portfolio_values(get_user_snapshot(user), "user_address", user_address__user=user)
     for user_address in user_addresses:
-        address_value = calculate_total_value([user_address])
+        address_value = address_values.get(user_address.id, Decimal(0))
 
         address_detail = {
             "user_address": user_address,
@@ -263,12 +247,9 @@ def address_detail(request: HttpRequest, public_address: str) -> HttpResponse:
     user_address = UserAddress.objects.get(user=user, public_address=public_address)
     user_addresses = [user_address]
 
-    aggregated_assets = fetch_aggregated_assets(user_addresses)
-    total_eth_staking = get_aggregated_staking(user_addresses)
-    total_protocols = get_protocols_snapshots(user_addresses)
-    portfolio_value = calculate_total_value(user_addresses)
+    last_snapshot = get_user_snapshot(user)
+    valuation = PortfolioValuation(user_addresses, last_snapshot)
 
-    last_snapshot = Snapshot.objects.first()
     last_snapshot_date = last_snapshot.date if last_snapshot else None
     errors = (
         SnapshotError.objects.filter(
@@ -279,15 +260,16 @@ def address_detail(request: HttpRequest, public_address: str) -> HttpResponse:
     )
     context = {
         "user": request.user,
-        "assets": aggregated_assets,
-        "staking": total_eth_staking,
-        "protocols": total_protocols["pool_data"],
-        "troves": total_protocols["troves"],
+        "assets": valuation.assets,
+        "staking": valuation.staking,
+        "protocols": valuation.protocols,
+        "troves": valuation.troves,
         "user_addresses": user_addresses,
-        "portfolio_value": f"{portfolio_value:,.2f}",
+        "portfolio_value": f"{valuation.total:,.2f}",
         "last_snapshot": last_snapshot_date,
         "user_address": user_address,
         "errors": errors,
+        "stale_prices": valuation.stale_prices,
     }
     return render(request, "user_address_detail.html", context)
 
@@ -301,18 +283,17 @@ def rewards(request: HttpRequest) -> HttpResponse:
 
     user_addresses = list(UserAddress.objects.filter(user=user))
 
-    snapshot = Snapshot.objects.first()
+    snapshot = get_user_snapshot(user)
 
     # Get ETH Staking rewards
     eth_rewards = Decimal(0)
+    prices = PriceBook(snapshot, fetch_missing=False)
     if snapshot:
         validators = get_last_validators(user_addresses, snapshot=snapshot)
 
         if validators:
             for validator in validators:
-                current_price = get_last_price(
-                    "ethereum", snapshot=validator.snapshot.date
-                )
+                current_price = prices.get("ethereum", validator.snapshot.date)
                 eth_rewards += validator.rewards * current_price
 
     # Get protocol rewards
@@ -323,6 +304,7 @@ def rewards(request: HttpRequest) -> HttpResponse:
     context = {
         "rewards": rewards,
         "total_rewards": f"{eth_rewards:,.2f}",
+        "stale_prices": prices.stale,
     }
     return render(request, "rewards.html", context)
 
@@ -361,15 +343,41 @@ def logout_view(request: HttpRequest) -> None:
 @login_required()
 def refresh(request: HttpRequest) -> HttpResponse:
     """
-    Trigger the tasks asynchronously with a shared Snapshot.
+    Trigger the tasks asynchronously with a shared Snapshot, or wait for the
+    update already in flight, unless the last snapshot of the user is fresh.
+    The update can be scoped with "address" and "source" query parameters, the
+    rest of the snapshot being carried forward from the last one.
     """
     user = cast(User, request.user)
 
-    task_group_result = run_daily_snapshot_update(user.id)
+    sources = request.GET.getlist("source")
+    if any(source not in REFRESH_SOURCES for source in sources):
+        return HttpResponseBadRequest(f"Sources must be among {', '.join(REFRESH_SOURCES)}")
+    addresses = request.GET.getlist("address")
+    user_address_ids = None
+    if addresses:
+        user_address_ids = list(UserAddress.objects.filter(user=user, public_address__in=addresses).values_list("id", flat=True))
+        if not user_address_ids:
+            raise Http404("No such address")
+
+    task_group_id = request_snapshot_update(user.id, user_address_ids, sources or None)
+    if task_group_id is None:
+        return redirect(reverse("portfolio"))
+
+    request.session["task_group_id"] = task_group_id
+
+    return redirect(reverse("waiting_page"))
+
 
-    request.session["task_group_id"] = task_group_result.id
+@login_required()
+@require_POST
+def reprice(request: HttpRequest) -> HttpResponse:
+    """
+    Value the latest quantities of the user at the current prices, with a single price request.
+    """
+    user = cast(User, request.user)
 
-    task_group_result.save()
+    request.session["task_group_id"] = request_snapshot_reprice(user.id)
 
     return redirect(reverse("waiting_page"))
 
@@ -416,21 +424,19 @@ def statistics(request: HttpRequest) -> HttpResponse:
     Show some statistics of the portfolio.
     """
     user = cast(User, request.user)
-    user_addresses = list(UserAddress.objects.filter(user=user))
 
+    # Wallet type and account breakdowns (EUR) from one grouped query
+    breakdowns = get_portfolio_breakdowns(get_user_snapshot(user), ["user_address__wallet_type__name", "user_address__account"], user_address__user=user)
     wallet_values = {
-        wallet: calculate_total_value(
-            list(filter(lambda addr: addr.wallet_type.name == wallet, user_addresses))
-        )
+        wallet: breakdowns["user_address__wallet_type__name"].get(wallet, Decimal(0))
         for wallet in WALLET_TYPES.values()
     }
 
-    # Amount (EUR) per account
     accounts_detail = []
     accounts = list(Account.objects.filter(user=user))
+    account_values = breakdowns["user_address__account"]
     for account in accounts:
-        account_addresses = list(UserAddress.objects.filter(account=account))
-        account_value = calculate_total_value(account_addresses)
+        account_value = account_values.get(account.id, Decimal(0))
         accounts_detail.append(
             {
                 "account": account,
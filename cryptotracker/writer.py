@@ -0,0 +1,453 @@
+import logging
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from django.db import transaction
+from django.db.models import QuerySet
+
+from cryptotracker.constants import PROTOCOLS_DATA, REFRESH_SOURCES
+from cryptotracker.models import (
+    Cryptocurrency,
+    CryptocurrencyNetwork,
+    Pool,
+    PoolBalanceSnapshot,
+    PoolPosition,
+    PoolRewardsSnapshot,
+    Price,
+    Snapshot,
+    SnapshotAssets,
+    Trove,
+    TroveSnapshot,
+    UserAddress,
+    Validator,
+    ValidatorSnapshot,
+)
+
+
+class _PoolRow(NamedTuple):
+    pool: Pool
+    user_address: UserAddress
+    position_id: Optional[str]
+    token_symbol: str
+    quantity: Decimal
+    is_reward: bool
+
+
+class _ValidatorRow(NamedTuple):
+    user_address: UserAddress
+    validator_index: int
+    public_key: str
+    activation_date: str
+    balance: Union[Decimal, float]
+    status: str
+    rewards: Union[Decimal, float]
+
+
+class _TroveRow(NamedTuple):
+    user_address: UserAddress
+    pool: Pool
+    trove_id: str
+    token: Cryptocurrency
+    collateral: Decimal
+    debt: Decimal
+    balance: Decimal
+    interest_rate: Decimal
+
+
+class SnapshotWriter:
+    """
+    Buffers the rows of a snapshot and writes them with bulk inserts in a single
+    transaction, instead of one implicit transaction per saved row.
+    The PoolPosition, Validator and Trove parents of the buffered rows are
+    resolved with one query and the missing ones are bulk created.
+    Can be used as a context manager flushing the rows on exit, or discarding
+    them when the block raised so a failed fetch stores no partial rows.
+    """
+
+    def __init__(self, snapshot: Snapshot):
+        self.snapshot = snapshot
+        self._assets: List[SnapshotAssets] = []
+        self._prices: List[Price] = []
+        self._pool_rows: List[_PoolRow] = []
+        self._validator_rows: List[_ValidatorRow] = []
+        self._trove_rows: List[_TroveRow] = []
+
+    def __enter__(self) -> "SnapshotWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
+
+    def __len__(self) -> int:
+        return (
+            len(self._assets)
+            + len(self._prices)
+            + len(self._pool_rows)
+            + len(self._validator_rows)
+            + len(self._trove_rows)
+        )
+
+    def add_asset(
+        self,
+        token: CryptocurrencyNetwork,
+        user_address: UserAddress,
+        quantity: Union[Decimal, float],
+    ) -> None:
+        self._assets.append(
+            SnapshotAssets(
+                cryptocurrency=token,
+                user_address=user_address,
+                quantity=quantity,
+                snapshot=self.snapshot,
+            )
+        )
+
+    def add_price(self, cryptocurrency: Cryptocurrency, price: Decimal) -> None:
+        self._prices.append(
+            Price(cryptocurrency=cryptocurrency, price=price, snapshot=self.snapshot)
+        )
+
+    def add_pool_balance(
+        self,
+        pool: Pool,
+        user_address: UserAddress,
+        token_symbol: str,
+        quantity: Decimal,
+        is_reward: bool = False,
+        position_id: Optional[str] = None,
+    ) -> None:
+        """
+        Buffers a PoolBalanceSnapshot, or a PoolRewardsSnapshot if is_reward.
+        """
+        self._pool_rows.append(
+            _PoolRow(pool, user_address, position_id, token_symbol, quantity, is_reward)
+        )
+
+    def add_validator(
+        self,
+        user_address: UserAddress,
+        validator_index: int,
+        public_key: str,
+        activation_date: str,
+        balance: Union[Decimal, float],
+        status: str,
+        rewards: Union[Decimal, float],
+    ) -> None:
+        self._validator_rows.append(
+            _ValidatorRow(
+                user_address,
+                validator_index,
+                public_key,
+                activation_date,
+                balance,
+                status,
+                rewards,
+            )
+        )
+
+    def add_trove(
+        self,
+        user_address: UserAddress,
+        pool: Pool,
+        trove_id: str,
+        token: Cryptocurrency,
+        collateral: Decimal,
+        debt: Decimal,
+        balance: Decimal,
+        interest_rate: Decimal,
+    ) -> None:
+        self._trove_rows.append(
+            _TroveRow(
+                user_address,
+                pool,
+                trove_id,
+                token,
+                collateral,
+                debt,
+                balance,
+                interest_rate,
+            )
+        )
+
+    def flush(self) -> None:
+        """
+        Writes the buffered rows in one transaction and empties the buffers.
+        """
+        if not len(self):
+            return
+        with transaction.atomic():
+            SnapshotAssets.objects.bulk_create(self._assets)
+            # One Price per cryptocurrency of a snapshot, the first one stored wins
+            Price.objects.bulk_create(self._prices, ignore_conflicts=True)
+            self._write_pool_rows()
+            self._write_validator_rows()
+            self._write_trove_rows()
+        logging.info(f"Wrote {len(self)} rows of snapshot {self.snapshot.id}")
+        self.discard()
+
+    def discard(self) -> None:
+        """
+        Empties the buffers without writing them.
+        """
+        self._assets = []
+        self._prices = []
+        self._pool_rows = []
+        self._validator_rows = []
+        self._trove_rows = []
+
+    def _write_pool_rows(self) -> None:
+        if not self._pool_rows:
+            return
+        tokens = {
+            token.symbol: token
+            for token in Cryptocurrency.objects.filter(
+                symbol__in={row.token_symbol for row in self._pool_rows}
+            )
+        }
+        positions = self._resolve_pool_positions()
+
+        balances: List[PoolBalanceSnapshot] = []
+        rewards: List[PoolRewardsSnapshot] = []
+        for row in self._pool_rows:
+            token = tokens.get(row.token_symbol)
+            if token is None:
+                logging.warning(
+                    f"Error saving pool {row.pool} {'reward' if row.is_reward else 'balance'}: "
+                    f"unknown token {row.token_symbol}"
+                )
+                continue
+            position = positions[(row.pool.id, row.user_address.id, row.position_id)]
+            if row.is_reward:
+                rewards.append(
+                    PoolRewardsSnapshot(
+                        pool_position=position,
+                        token=token,
+                        quantity=row.quantity,
+                        snapshot=self.snapshot,
+                    )
+                )
+            else:
+                balances.append(
+                    PoolBalanceSnapshot(
+                        pool_position=position,
+                        token=token,
+                        quantity=row.quantity,
+                        snapshot=self.snapshot,
+                    )
+                )
+        PoolBalanceSnapshot.objects.bulk_create(balances)
+        PoolRewardsSnapshot.objects.bulk_create(rewards)
+
+    def _resolve_pool_positions(
+        self,
+    ) -> Dict[Tuple[int, int, Optional[str]], PoolPosition]:
+        """
+        Returns the PoolPosition of every buffered (pool, user_address, position_id),
+        bulk creating the missing ones.
+        """
+        positions = {
+            (position.pool_id, position.user_address_id, position.position_id): position
+            for position in PoolPosition.objects.filter(
+                pool__in={row.pool.id for row in self._pool_rows},
+                user_address__in={row.user_address.id for row in self._pool_rows},
+            )
+        }
+        missing = {}
+        for row in self._pool_rows:
+            key = (row.pool.id, row.user_address.id, row.position_id)
+            if key not in positions and key not in missing:
+                missing[key] = PoolPosition(
+                    pool=row.pool,
+                    user_address=row.user_address,
+                    position_id=row.position_id,
+                )
+        PoolPosition.objects.bulk_create(missing.values())
+        if missing:
+            logging.info(f"Created {len(missing)} new pool positions")
+        positions.update(missing)
+        return positions
+
+    def _write_validator_rows(self) -> None:
+        if not self._validator_rows:
+            return
+        Validator.objects.bulk_create(
+            [
+                Validator(
+                    user_address=row.user_address,
+                    validator_index=row.validator_index,
+                    public_key=row.public_key,
+                    activation_date=row.activation_date,
+                )
+                for row in self._validator_rows
+            ],
+            ignore_conflicts=True,
+        )
+        validators = Validator.objects.in_bulk(
+            [row.validator_index for row in self._validator_rows],
+            field_name="validator_index",
+        )
+        ValidatorSnapshot.objects.bulk_create(
+            [
+                ValidatorSnapshot(
+                    validator=validators[row.validator_index],
+                    balance=row.balance,
+                    status=row.status,
+                    rewards=row.rewards,
+                    snapshot=self.snapshot,
+                )
+                for row in self._validator_rows
+            ]
+        )
+
+    def _write_trove_rows(self) -> None:
+        if not self._trove_rows:
+            return
+        troves = {
+            trove.trove_id: trove
+            for trove in Trove.objects.filter(
+                trove_id__in={row.trove_id for row in self._trove_rows}
+            )
+        }
+        missing = {}
+        for row in self._trove_rows:
+            if row.trove_id not in troves and row.trove_id not in missing:
+                missing[row.trove_id] = Trove(
+                    trove_id=row.trove_id,
+                    user_address=row.user_address,
+                    pool=row.pool,
+                    token=row.token,
+                )
+        Trove.objects.bulk_create(missing.values())
+        troves.update(missing)
+        TroveSnapshot.objects.bulk_create(
+            [
+                TroveSnapshot(
+                    trove=troves[row.trove_id],
+                    collateral=row.collateral,
+                    debt=row.debt,
+                    balance=row.balance,
+                    interest_rate=row.interest_rate,
+                    snapshot=self.snapshot,
+                )
+                for row in self._trove_rows
+            ]
+        )
+
+
+@contextmanager
+def snapshot_writer(
+    snapshot: Snapshot, writer: Optional[SnapshotWriter] = None
+) -> Iterator[SnapshotWriter]:
+    """
+    Yields the given writer, or a new SnapshotWriter flushed on exit when the
+    caller did not provide one. The rows of a new writer are discarded if the
+    block raised.
+    """
+    if writer is not None:
+        yield writer
+        return
+    with SnapshotWriter(snapshot) as new_writer:
+        yield new_writer
+
+
+def _refresh_source_rows(
+    refresh_source: str, user_address_ids: List[int]
+) -> List[QuerySet]:
+    """
+    Returns the querysets of the snapshot rows of a part of REFRESH_SOURCES for
+    the user_addresses, across every snapshot.
+    """
+    if refresh_source == "tokens":
+        return [SnapshotAssets.objects.filter(user_address_id__in=user_address_ids)]
+    if refresh_source == "staking":
+        return [
+            ValidatorSnapshot.objects.filter(
+                validator__user_address_id__in=user_address_ids
+            )
+        ]
+    names = [
+        PROTOCOLS_DATA[protocol]["name"]
+        for protocol in REFRESH_SOURCES[refresh_source]["protocols"]
+    ]
+    return [
+        PoolBalanceSnapshot.objects.filter(
+            pool_position__user_address_id__in=user_address_ids,
+            pool_position__pool__protocol_network__protocol__name__in=names,
+        ),
+        PoolRewardsSnapshot.objects.filter(
+            pool_position__user_address_id__in=user_address_ids,
+            pool_position__pool__protocol_network__protocol__name__in=names,
+        ),
+        TroveSnapshot.objects.filter(
+            trove__user_address_id__in=user_address_ids,
+            trove__pool__protocol_network__protocol__name__in=names,
+        ),
+    ]
+
+
+def delete_unit_rows(
+    snapshot: Snapshot,
+    source: str,
+    user_address_ids: List[int],
+    refresh_sources: Optional[List[str]] = None,
+) -> None:
+    """
+    Deletes the rows written for a source of the snapshot by an earlier attempt
+    of its units, so running them again does not duplicate them.
+    Args:
+        snapshot (Snapshot): The snapshot being written.
+        source (str): The source, one of "assets", "staking" or "protocols".
+        user_address_ids (list): The IDs of the user_addresses of the units.
+        refresh_sources (list, optional): The parts of REFRESH_SOURCES of the
+            source run by the units, all if not provided.
+    """
+    querysets = [
+        queryset
+        for name, refresh_source in REFRESH_SOURCES.items()
+        if refresh_source["source"] == source
+        and (refresh_sources is None or name in refresh_sources)
+        for queryset in _refresh_source_rows(name, user_address_ids)
+    ]
+    with transaction.atomic():
+        for queryset in querysets:
+            deleted, _ = queryset.filter(snapshot=snapshot).delete()
+            if deleted:
+                logging.info(
+                    f"Deleted {deleted} {queryset.model.__name__} rows of snapshot {snapshot.id}"
+                )
+
+
+def carry_forward_rows(
+    previous: Snapshot,
+    snapshot: Snapshot,
+    refresh_sources: List[str],
+    user_address_ids: List[int],
+) -> int:
+    """
+    Copies the rows of parts of a previous snapshot into a new snapshot, for
+    the parts a scoped refresh does not fetch again.
+    Args:
+        previous (Snapshot): The snapshot to copy the rows from.
+        snapshot (Snapshot): The snapshot being written.
+        refresh_sources (list): The parts of REFRESH_SOURCES to copy.
+        user_address_ids (list): The IDs of the user_addresses to copy.
+    Returns:
+        int: The number of rows copied.
+    """
+    if not user_address_ids:
+        return 0
+    copied = 0
+    with transaction.atomic():
+        for refresh_source in refresh_sources:
+            for queryset in _refresh_source_rows(refresh_source, user_address_ids):
+                rows = list(queryset.filter(snapshot=previous))
+                for row in rows:
+                    row.pk = None
+                    row.snapshot = snapshot
+                queryset.model.objects.bulk_create(rows)
+                copied += len(rows)
+    return copied
@@ -13,7 +13,7 @@ app = Celery("dcp")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.conf.beat_schedule = {
     "daily-snapshot-update": {
-        "task": "cryptotracker.tasks.run_daily_snapshot_update",
+        "task": "cryptotracker.tasks.request_snapshot_update",
         "schedule": crontab(hour=0, minute=0),
     },
 }
@@ -96,6 +96,29 @@ CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_ENABLE_UTC = True
 
+# Pin snapshots to the last finalized block of each chain instead of the head block
+SNAPSHOT_FINALIZED_BLOCKS = (
+    os.environ.get("SNAPSHOT_FINALIZED_BLOCKS", "False") == "True"
+)
+
+# Number of user_addresses fetched by each subtask of a snapshot run
+SNAPSHOT_CHUNK_SIZE = int(os.environ.get("SNAPSHOT_CHUNK_SIZE", "10"))
+# Retries of the failed units of a subtask, after a backoff doubling from the base delay in seconds
+SNAPSHOT_MAX_RETRIES = int(os.environ.get("SNAPSHOT_MAX_RETRIES", "3"))
+SNAPSHOT_RETRY_BACKOFF = int(os.environ.get("SNAPSHOT_RETRY_BACKOFF", "60"))
+# Refreshes of a user within this many seconds of their last complete snapshot reuse it
+SNAPSHOT_FRESHNESS = int(os.environ.get("SNAPSHOT_FRESHNESS", "600"))
+# Redis shared by the web processes and the workers to coalesce concurrent
+# snapshot updates, and the lifetime of a claim if its run never releases it
+SNAPSHOT_LOCK_REDIS_URL = os.environ.get("SNAPSHOT_LOCK_REDIS_URL", CELERY_BROKER_URL)
+SNAPSHOT_LOCK_TTL = int(os.environ.get("SNAPSHOT_LOCK_TTL", "3600"))
+
+# Cache of the chain and subgraph responses read at a pinned block.
+# The Redis tier is shared by the processes of a run and is disabled when unset.
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_REDIS_URL = os.environ.get("RESPONSE_CACHE_REDIS_URL")
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", "86400"))
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases